@@ -1,40 +1,74 @@
 import os
-from flask import Flask, redirect, url_for
+import time
+from flask import Flask, Response, redirect, url_for, request, g, abort
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import DeclarativeBase
 from flask_login import LoginManager
-from flask_migrate import Migrate
+from metrics import Histogram, REGISTRY, CONTENT_TYPE, authorized
 
 class Base(DeclarativeBase):
     pass
 
 db = SQLAlchemy(model_class=Base)
-app = Flask(__name__)
 
-app.config['SECRET_KEY'] = os.environ.get("FLASK_SECRET_KEY") or "a_secret_key"
-app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get("DATABASE_URL")
-app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
-    "pool_recycle": 300,
-    "pool_pre_ping": True,
-}
+login_manager = LoginManager()
+login_manager.login_view = 'auth.login'
 
-db.init_app(app)
-migrate = Migrate(app, db)
+HTTP_REQUEST_SECONDS = Histogram('http_request_seconds', 'Flask request latency by endpoint and status.',
+                                 ['method', 'endpoint', 'status'])
 
-login_manager = LoginManager()
-login_manager.init_app(app)
-login_manager.login_view = 'login'
+def start_request_timer():
+    g.request_started = time.perf_counter()
 
-with app.app_context():
-    import models
-    import auth
-    from message_scheduler import message_scheduler
-    # Remove the following line as it's already registered in message_scheduler.py
-    # app.register_blueprint(message_scheduler)
+def record_request_time(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        # Labelled by route endpoint rather than path so IDs don't explode the series count
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, method=request.method,
+                                     endpoint=request.endpoint or 'unmatched', status=response.status_code)
+    return response
+
+def metrics():
+    if not authorized(request.headers.get('Authorization')):
+        abort(401)
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
 
-@app.route('/')
 def index():
     return redirect(url_for('message_scheduler.dashboard'))
 
-if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000)
+def create_app(web=True):
+    """Build the Flask app.
+
+    Workers and one-off scripts pass web=False and get the database and models
+    without the routes, login and Flask-Migrate they never use; those imports
+    are a large share of a cold start.
+    """
+    app = Flask(__name__)
+
+    app.config['SECRET_KEY'] = os.environ.get("FLASK_SECRET_KEY") or "a_secret_key"
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get("DATABASE_URL")
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        "pool_recycle": 300,
+        "pool_pre_ping": True,
+    }
+
+    db.init_app(app)
+    import models
+
+    if web:
+        from flask_migrate import Migrate
+        from auth import auth
+        from message_scheduler import message_scheduler
+        from status_callbacks import status_callbacks, status_buffer
+
+        Migrate(app, db)
+        login_manager.init_app(app)
+        app.before_request(start_request_timer)
+        app.after_request(record_request_time)
+        app.add_url_rule('/metrics', view_func=metrics)
+        app.add_url_rule('/', view_func=index)
+        app.register_blueprint(auth)
+        app.register_blueprint(message_scheduler)
+        app.register_blueprint(status_callbacks)
+        status_buffer.init_app(app)
+    return app
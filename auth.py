@@ -1,14 +1,86 @@
-from flask import render_template, redirect, url_for, flash, request
+import os
+import time
+import threading
+from flask import Blueprint, render_template, redirect, url_for, flash, request
 from flask_login import login_user, login_required, logout_user, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
-from app import app, db, login_manager
+from sqlalchemy import event
+from sqlalchemy.orm import make_transient_to_detached
+from app import db, login_manager
 from models import User
+from metrics import Counter, REGISTRY
+
+USER_CACHE_TTL = float(os.environ.get("USER_CACHE_TTL", "60"))
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", "10000"))
+
+auth = Blueprint('auth', __name__)
+
+USER_CACHE_LOOKUPS = Counter('user_cache_lookups_total', 'Session user lookups by cache result.', ['result'])
+
+class UserCache:
+    """Per-process cache of User column values, keyed by id, kept for `ttl` seconds.
+
+    Changes made through the ORM in this process drop the entry at once; other
+    processes see them when their entry expires.
+    """
+
+    def __init__(self, ttl=USER_CACHE_TTL, max_size=USER_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, user_id):
+        entry = self._entries.get(user_id)
+        if entry is not None and entry[0] > time.monotonic():
+            USER_CACHE_LOOKUPS.inc(result='hit')
+            return entry[1]
+        USER_CACHE_LOOKUPS.inc(result='miss')
+        return None
+
+    def put(self, user):
+        values = {column.key: getattr(user, column.key) for column in User.__table__.columns}
+        now = time.monotonic()
+        with self._lock:
+            if len(self._entries) >= self.max_size:
+                self._entries = {key: entry for key, entry in self._entries.items() if entry[0] > now}
+                # Still full: drop the oldest insertions
+                while len(self._entries) >= self.max_size:
+                    self._entries.pop(next(iter(self._entries)))
+            self._entries[user.id] = (now + self.ttl, values)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+user_cache = UserCache()
+REGISTRY.add_collector(lambda: [('user_cache_entries', 'Users held in this process\'s session cache.', len(user_cache))])
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def invalidate_cached_user(mapper, connection, target):
+    # Covers set_password and any other edit, whichever route makes it
+    user_cache.invalidate(target.id)
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    user_id = int(user_id)
+    values = user_cache.get(user_id)
+    if values is not None:
+        # Rebuilt from the cached columns and attached without a SELECT, so
+        # relationships still lazy-load from this request's session
+        user = User(**values)
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+    user = db.session.get(User, user_id)
+    if user is not None:
+        user_cache.put(user)
+    return user
 
-@app.route('/login', methods=['GET', 'POST'])
+@auth.route('/login', methods=['GET', 'POST'])
 def login():
     if current_user.is_authenticated:
         return redirect(url_for('message_scheduler.dashboard'))
@@ -24,7 +96,7 @@ def login():
             flash('Invalid username or password')
     return render_template('login.html')
 
-@app.route('/register', methods=['GET', 'POST'])
+@auth.route('/register', methods=['GET', 'POST'])
 def register():
     if current_user.is_authenticated:
         return redirect(url_for('message_scheduler.dashboard'))
@@ -44,12 +116,13 @@ def register():
             db.session.add(new_user)
             db.session.commit()
             flash('Registration successful. Please log in.')
-            return redirect(url_for('login'))
+            return redirect(url_for('auth.login'))
     
     return render_template('register.html')
 
-@app.route('/logout')
+@auth.route('/logout')
 @login_required
 def logout():
+    user_cache.invalidate(current_user.id)
     logout_user()
-    return redirect(url_for('login'))
+    return redirect(url_for('auth.login'))
@@ -0,0 +1,38 @@
+"""Synthetic recipient CSV generator for benchmarks.
+
+    python -m benchmarks.csv_gen --rows 1000000 --output /tmp/recipients_1m.csv
+"""
+import argparse
+import csv
+import random
+
+def generate_csv(path, rows, invalid_ratio=0.01, duplicate_ratio=0.01, custom_fields=3, seed=0):
+    rng = random.Random(seed)
+    fieldnames = ['phone_number', 'name', 'email'] + [f'field_{i}' for i in range(custom_fields)]
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(fieldnames)
+        for i in range(rows):
+            roll = rng.random()
+            if roll < invalid_ratio:
+                phone_number = f'555-{i:07d}'
+            elif roll < invalid_ratio + duplicate_ratio and i:
+                phone_number = f'+1555{rng.randrange(i):07d}'
+            else:
+                phone_number = f'+1555{i:07d}'
+            writer.writerow(
+                [phone_number, f'Recipient {i}', f'recipient{i}@example.com']
+                + [f'value-{i}-{n}' for n in range(custom_fields)]
+            )
+    return path
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--output', required=True)
+    parser.add_argument('--invalid-ratio', type=float, default=0.01)
+    parser.add_argument('--duplicate-ratio', type=float, default=0.01)
+    parser.add_argument('--custom-fields', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    generate_csv(args.output, args.rows, args.invalid_ratio, args.duplicate_ratio, args.custom_fields, args.seed)
@@ -0,0 +1,350 @@
+"""Benchmark scenarios for ingestion, dispatch, cancellation and the dashboard.
+
+    python -m benchmarks.run --sizes 1000,100000 --output results.json
+    python -m benchmarks.run --compare results.json
+
+Scenarios run the same jobs as a worker. Twilio traffic goes to fake_twilio
+(in-process unless --twilio-url is given),
+and the database defaults to a throwaway SQLite file. --database-url must point
+at a scratch database: every run drops and recreates all tables.
+
+Each result reports throughput, p50/p99 latency of the unit of work (CSV chunk,
+Twilio request, dashboard request), database statement count and peak RSS.
+With --compare, any scenario whose throughput drops or p99 grows by more than
+--tolerance exits non-zero.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import resource
+import tempfile
+import threading
+import logging
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import fake_twilio
+from benchmarks.csv_gen import generate_csv
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, int(round(fraction * (len(values) - 1)))))
+    return values[index]
+
+def current_rss():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        # ru_maxrss is KiB on Linux; only a process-lifetime peak is available here
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+class PeakRssSampler:
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, current_rss())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = current_rss()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss())
+
+class QueryCounter:
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+    def __enter__(self):
+        from sqlalchemy import event
+        event.listen(self.engine, 'before_cursor_execute', self._on_execute)
+        return self
+
+    def __exit__(self, *exc):
+        from sqlalchemy import event
+        event.remove(self.engine, 'before_cursor_execute', self._on_execute)
+
+def measure(scenario, size, run, db):
+    """Run `run()` -> (units, latencies) and wrap it in the common measurements."""
+    with QueryCounter(db.engine) as queries, PeakRssSampler() as rss:
+        started = time.perf_counter()
+        units, latencies = run()
+        elapsed = time.perf_counter() - started
+    result = {
+        'scenario': scenario,
+        'size': size,
+        'units': units,
+        'elapsed_seconds': round(elapsed, 4),
+        'throughput_per_second': round(units / elapsed, 2) if elapsed else None,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3) if latencies else None,
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3) if latencies else None,
+        'db_queries': queries.count,
+        'peak_rss_mb': round(rss.peak / (1024 * 1024), 1),
+    }
+    print(f"{scenario:>12} size={size:<8} {result['throughput_per_second']}/s "
+          f"p50={result['p50_ms']}ms p99={result['p99_ms']}ms "
+          f"queries={result['db_queries']} rss={result['peak_rss_mb']}MB", file=sys.stderr)
+    return result
+
+@contextmanager
+def timed_calls(module, name):
+    """Time every call to `module.name` while the block runs. The jobs look the
+    function up as a module global, so they run unchanged around the timer."""
+    original = getattr(module, name)
+    durations = []
+
+    def timed(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return original(*args, **kwargs)
+        finally:
+            durations.append(time.perf_counter() - started)
+
+    setattr(module, name, timed)
+    try:
+        yield durations
+    finally:
+        setattr(module, name, original)
+
+class Benchmarks:
+    """Scenarios run the jobs a worker would: the upload goes through
+    schedule_blast_job, and dispatch through release_blast_job, which plans the
+    blast, cuts it into chunks and sends them with claim_next_chunk/dispatch_chunk."""
+
+    def __init__(self, app, db, workdir):
+        from models import User
+        self.app = app
+        self.db = db
+        self.workdir = workdir
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+            user = User(username='benchmark', email='benchmark@example.com')
+            user.set_password('benchmark')
+            db.session.add(user)
+            db.session.commit()
+            self.user_id = user.id
+
+    def new_blast(self, scheduled_time=None):
+        from models import ScheduledBlast
+        blast = ScheduledBlast(
+            user_id=self.user_id,
+            message_template='Hi {name|there}, your code is {field_0}.',
+            scheduled_time=scheduled_time or datetime.utcnow() + timedelta(hours=1),
+            status='queued'
+        )
+        self.db.session.add(blast)
+        self.db.session.commit()
+        return blast
+
+    def csv_path(self, size):
+        path = os.path.join(self.workdir, f'recipients_{size}.csv')
+        if not os.path.exists(path):
+            generate_csv(path, size)
+        return path
+
+    def run_job(self, kind, blast_id, payload=None, job=None):
+        from models import Job
+        from job_queue import enqueue_job, claim_next_job, run_job
+        if job is None:
+            job = enqueue_job(kind, payload, user_id=self.user_id, scheduled_blast_id=blast_id)
+        job.run_at = datetime.utcnow()
+        self.db.session.commit()
+        job_id = job.id
+        claimed = claim_next_job('benchmark')
+        if claimed is None or claimed.id != job_id:
+            raise RuntimeError(f"Expected to claim job {job_id}, got {claimed and claimed.id}")
+        run_job(claimed, self.app)
+        job = self.db.session.get(Job, job_id, populate_existing=True)
+        if job.status != 'done':
+            raise RuntimeError(f"{kind} job failed: {job.error}")
+        return job
+
+    def ingestion(self, size):
+        import ingestion
+        from uploads import store_upload
+        with self.app.app_context():
+            # Far enough out to be held, so the job stops after storing recipients
+            blast_id = self.new_blast(datetime.utcnow() + timedelta(days=20)).id
+            with open(self.csv_path(size), 'rb') as f:
+                upload_id = store_upload(f)
+            self.db.session.commit()
+
+            def run():
+                with timed_calls(ingestion, 'ingest_chunk') as latencies:
+                    job = self.run_job('schedule_blast', blast_id, {'upload_id': upload_id, 'hold': True})
+                return job.payload['rows'], latencies
+
+            result = measure('ingestion', size, run, self.db)
+            self.db.session.remove()
+        return result, blast_id
+
+    def dispatch(self, size, blast_id):
+        import twilio_dispatch
+        from models import Job, ScheduledBlast
+        with self.app.app_context():
+            # Bring the held blast inside Twilio's window and let its release job run now
+            blast = self.db.session.get(ScheduledBlast, blast_id)
+            blast.scheduled_time = datetime.utcnow() + timedelta(hours=1)
+            release = Job.query.filter_by(kind='release_blast', scheduled_blast_id=blast_id).one()
+
+            def run():
+                with timed_calls(twilio_dispatch, '_send_one') as latencies:
+                    self.run_job('release_blast', blast_id, job=release)
+                return len(latencies), latencies
+
+            result = measure('dispatch', size, run, self.db)
+            self.db.session.remove()
+        return result
+
+    def cancellation(self, size, blast_id):
+        import twilio_dispatch
+        from models import ScheduledBlast
+        with self.app.app_context():
+            self.db.session.get(ScheduledBlast, blast_id).status = 'canceling'
+
+            def run():
+                with timed_calls(twilio_dispatch, '_cancel_one') as latencies:
+                    self.run_job('cancel_blast', blast_id)
+                return len(latencies), latencies
+
+            result = measure('cancellation', size, run, self.db)
+            self.db.session.remove()
+        return result
+
+    def dashboard(self, requests):
+        client = self.app.test_client()
+        client.post('/login', data={'username': 'benchmark', 'password': 'benchmark'})
+
+        def run():
+            latencies = []
+            for _ in range(requests):
+                started = time.perf_counter()
+                response = client.get('/dashboard')
+                latencies.append(time.perf_counter() - started)
+                assert response.status_code == 200, response.status_code
+            return requests, latencies
+
+        with self.app.app_context():
+            return measure('dashboard', requests, run, self.db)
+
+def compare(results, baseline, tolerance):
+    previous = {(r['scenario'], r['size']): r for r in baseline['results']}
+    regressions = []
+    for result in results:
+        before = previous.get((result['scenario'], result['size']))
+        if not before:
+            continue
+        if before['throughput_per_second'] and result['throughput_per_second'] < before['throughput_per_second'] * (1 - tolerance):
+            regressions.append(f"{result['scenario']}[{result['size']}] throughput "
+                               f"{before['throughput_per_second']} -> {result['throughput_per_second']}/s")
+        if before['p99_ms'] and result['p99_ms'] and result['p99_ms'] > before['p99_ms'] * (1 + tolerance):
+            regressions.append(f"{result['scenario']}[{result['size']}] p99 "
+                               f"{before['p99_ms']} -> {result['p99_ms']}ms")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='1000,10000', help='comma-separated CSV sizes for ingestion')
+    parser.add_argument('--dispatch-sizes', default='1000',
+                        help='sizes (subset of --sizes) that also run dispatch and cancellation')
+    parser.add_argument('--dashboard-blasts', type=int, default=200)
+    parser.add_argument('--dashboard-requests', type=int, default=50)
+    parser.add_argument('--database-url', help='scratch database; defaults to a temporary SQLite file')
+    parser.add_argument('--twilio-url', help='use an already running fake_twilio server')
+    parser.add_argument('--latency', type=float, default=0.0, help='fake Twilio latency (seconds)')
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--throttle-rate', type=float, default=0.0)
+    parser.add_argument('--mps', type=float, default=100000, help='dispatch rate limit')
+    parser.add_argument('--output', help='write JSON results here instead of stdout')
+    parser.add_argument('--compare', help='baseline JSON from a previous run')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix='twilio-scheduler-bench-')
+    twilio_url = args.twilio_url
+    if not twilio_url:
+        _, twilio_url = fake_twilio.start_in_thread(latency=args.latency, error_rate=args.error_rate,
+                                                    throttle_rate=args.throttle_rate)
+
+    # Configuration is read at import time, so set it before importing the app
+    os.environ['DATABASE_URL'] = args.database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ['TWILIO_API_BASE_URL'] = twilio_url
+    os.environ['TWILIO_MESSAGING_MPS'] = str(args.mps)
+    os.environ['TWILIO_CANCEL_RATE'] = str(args.mps)
+    for name, value in (('TWILIO_ACCOUNT_SID', 'ACbenchmark'), ('TWILIO_AUTH_TOKEN', 'benchmark'),
+                        ('TWILIO_MESSAGING_SERVICE_SID', 'MGbenchmark')):
+        os.environ.setdefault(name, value)
+
+    from app import create_app, db
+    import blast_jobs  # noqa: F401 registers the job handlers
+    app = create_app()
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger('twilio.http_client').setLevel(logging.WARNING)
+
+    bench = Benchmarks(app, db, workdir)
+    sizes = [int(size) for size in args.sizes.split(',') if size]
+    dispatch_sizes = {int(size) for size in args.dispatch_sizes.split(',') if size}
+    results = []
+    for size in sizes:
+        result, blast_id = bench.ingestion(size)
+        results.append(result)
+        if size in dispatch_sizes:
+            results.append(bench.dispatch(size, blast_id))
+            results.append(bench.cancellation(size, blast_id))
+
+    with app.app_context():
+        for _ in range(args.dashboard_blasts):
+            bench.new_blast()
+    results.append(bench.dashboard(args.dashboard_requests))
+
+    from twilio_integration import http_pool_stats
+    with app.app_context():
+        database = db.engine.dialect.name
+    report = {
+        'meta': {
+            'timestamp': datetime.utcnow().isoformat(),
+            'python': platform.python_version(),
+            'database': database,
+            'twilio_latency': args.latency,
+            'http_pool': http_pool_stats(),
+        },
+        'results': results,
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
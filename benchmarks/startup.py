@@ -0,0 +1,87 @@
+"""Startup import-time report for the worker and the web app.
+
+    python -m benchmarks.startup
+    python -m benchmarks.startup --target worker --top 15 --output startup.json
+
+Each target starts in a fresh interpreter under -X importtime, a few times,
+keeping the fastest run. The report gives the process's wall time, the total
+import time, the slowest modules (cumulative, i.e. including what they import)
+and import time grouped by top-level package.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+TARGETS = {
+    'worker': 'import worker; worker.create_app(web=False)',
+    'web': 'from app import create_app; create_app()',
+}
+
+def parse_importtime(stderr):
+    # "import time: self [us] | cumulative | imported package"; nesting is shown by indentation
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        modules.append({'module': name.strip(), 'self_ms': int(self_us) / 1000,
+                        'cumulative_ms': int(cumulative_us) / 1000, 'depth': (len(name) - len(name.lstrip())) // 2})
+    return modules
+
+def profile(code, runs):
+    best = None
+    env = {**os.environ, 'PYTHONDONTWRITEBYTECODE': '1'}
+    for _ in range(runs):
+        started = time.perf_counter()
+        process = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=ROOT, env=env,
+                                 capture_output=True, text=True)
+        elapsed = time.perf_counter() - started
+        if process.returncode != 0:
+            raise RuntimeError(f"{code!r} failed:\n{process.stderr[-2000:]}")
+        if best is None or elapsed < best[0]:
+            best = (elapsed, process.stderr)
+    return best
+
+def report(name, code, runs, top):
+    elapsed, stderr = profile(code, runs)
+    modules = parse_importtime(stderr)
+    packages = {}
+    for module in modules:
+        package = module['module'].split('.')[0]
+        packages[package] = packages.get(package, 0) + module['self_ms']
+    slowest = sorted(modules, key=lambda module: module['cumulative_ms'], reverse=True)[:top]
+    return {
+        'target': name,
+        'wall_ms': round(elapsed * 1000, 1),
+        'import_ms': round(sum(module['self_ms'] for module in modules), 1),
+        'modules_imported': len(modules),
+        'slowest_modules': [{key: module[key] for key in ('module', 'cumulative_ms', 'self_ms')} for module in slowest],
+        'packages': [{'package': package, 'self_ms': round(ms, 1)}
+                     for package, ms in sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]],
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--target', choices=sorted(TARGETS), action='append',
+                        help='Entry point to profile (repeatable; default: all)')
+    parser.add_argument('--runs', type=int, default=3, help='Cold starts per target; the fastest is reported')
+    parser.add_argument('--top', type=int, default=10, help='Modules and packages listed per target')
+    parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+    args = parser.parse_args(argv)
+
+    results = [report(name, TARGETS[name], args.runs, args.top) for name in (args.target or sorted(TARGETS))]
+    output = json.dumps({'python': sys.version.split()[0], 'results': results}, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
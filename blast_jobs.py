@@ -0,0 +1,386 @@
+import time
+import logging
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import select, func
+from models import ScheduledBlast, RecipientBlastAssociation, RecipientList, Job, db
+from twilio_integration import get_client, send_limiter, schedule_twilio_message, cancel_twilio_message
+from job_queue import job_handler, idle_handler, update_job_progress, Heartbeat
+from ingestion import ingest_csv_stream
+from recipient_lists import sync_recipient_list, associate_list_members
+from csv_validation import find_fresh_validation, reusable_estimate
+from message_templates import estimate_segments
+from dead_letters import record_dead_letters, replay_dead_letters
+from suppression import suppress_failed_sends
+from dispatch_planner import BlastPlan, plan_blast, reconcile_scheduled_count, TWILIO_MIN_SCHEDULE_LEAD
+from dispatch_chunks import (split_blast, create_chunks, claim_next_chunk, chunk_progress, chunk_error, abandon_chunks,
+                             sending_workers, finish_dispatch, LeaseLost, CHUNK_HEARTBEAT_INTERVAL, CHUNK_MAX_ATTEMPTS)
+from local_scheduler import hold_blast
+from phone_timezones import recipient_timezone, count_timezones, local_send_times, wall_clock_time
+from metrics import DB_FLUSH_SECONDS
+from scheduled_messages import (iter_blast_recipient_pages, record_dispatch_results, record_cancel_results, status_counts,
+                                recorded_recipient_ids, recorded_message_counts, CANCELABLE_MESSAGE_STATUSES)
+from csv_stream import CsvStreamReader
+from uploads import open_upload, delete_upload
+
+logger = logging.getLogger(__name__)
+
+RESULT_FLUSH_SIZE = 500
+# How often a worker waiting on chunks other workers hold checks on them
+CHUNK_WAIT_INTERVAL = 1.0
+
+def ingest_csv(blast, upload_id):
+    with open_upload(upload_id) as f:
+        reader = CsvStreamReader(f)
+        try:
+            return ingest_csv_stream(blast.id, reader)
+        finally:
+            reader.close()
+
+def sync_list_csv(recipient_list, upload_id):
+    with open_upload(upload_id) as f:
+        reader = CsvStreamReader(f)
+        try:
+            return sync_recipient_list(recipient_list, reader)
+        finally:
+            reader.close()
+
+def load_recipients(job, blast):
+    """Attach the blast's recipients from its upload, its stored list, or an upload
+    that updates the list; returns the counts for the job payload."""
+    upload_id = job.payload.get('upload_id')
+    if blast.recipient_list_id is None:
+        stats = ingest_csv(blast, upload_id)
+        return {**stats.as_dict(), 'invalid_phone_numbers': stats.invalid_sample}
+
+    counts = {}
+    # Row lock so two uploads to the same list can't interleave their deltas (no-op on SQLite)
+    recipient_list = db.session.get(RecipientList, blast.recipient_list_id, with_for_update=True)
+    if upload_id:
+        stats = sync_list_csv(recipient_list, upload_id)
+        counts.update(stats.as_dict(), invalid_phone_numbers=stats.invalid_sample)
+    associated = associate_list_members(blast.id, recipient_list.id)
+    counts.update(associated=associated, suppressed=recipient_list.member_count - associated)
+    return counts
+
+def split_for_dispatch(blast, local):
+    """Chunk rows for the blast and, in local-time mode, its per-timezone buckets."""
+    if not local:
+        chunks, _ = split_blast(blast.id)
+        return chunks, None
+    # One pass over plain rows with dict lookups; pytz runs once per timezone
+    column = blast.timezone_column
+    chunks, counts = split_blast(blast.id, bucket_of=lambda recipient: recipient_timezone(recipient, column))
+    starts = local_send_times(wall_clock_time(blast.scheduled_time), counts)
+    return chunks, {timezone: (starts[timezone], count) for timezone, count in counts.items()}
+
+def first_local_send_time(blast):
+    # When the first of the recipients' timezones reaches the blast's wall-clock time
+    counts = count_timezones(iter_blast_recipient_pages(blast.id), blast.timezone_column)
+    starts = local_send_times(wall_clock_time(blast.scheduled_time), counts)
+    return min(starts.values(), default=blast.scheduled_time)
+
+def dispatch_chunk(lease, on_flush=None):
+    blast = db.session.get(ScheduledBlast, lease.blast_id)
+    payload = db.session.get(Job, lease.job_id).payload
+    send_now = payload.get('send_now', False)
+    plan = None if send_now else BlastPlan.from_dict(blast.scheduled_time, payload['plan'])
+    indexes = lease.bucket_offsets if lease.bucket_offsets is not None else {None: lease.first_index}
+    # Recipients a previous holder already recorded keep their SID
+    recorded = recorded_recipient_ids(blast.id, lease.first_recipient_id, lease.last_recipient_id)
+    pending_results = []
+    dispatched = len(recorded)
+    last_flush = time.monotonic()
+
+    def record_result(result):
+        nonlocal dispatched
+        pending_results.append(result)
+        dispatched += 1
+        if len(pending_results) >= RESULT_FLUSH_SIZE:
+            flush_results()
+
+    def renew_lease():
+        # Runs on the heartbeat thread, so a slow Twilio or a long page doesn't let the lease lapse
+        try:
+            lease.renew(dispatched)
+        except LeaseLost:
+            return False
+        send_limiter(sending_workers())
+
+    def on_progress(done):
+        # A lost lease stops the chunk here: the flush raises LeaseLost and keep_sent records what went out
+        if lease_heartbeat.lost or time.monotonic() - last_flush >= CHUNK_HEARTBEAT_INTERVAL:
+            flush_results()
+
+    def keep_sent():
+        # Messages Twilio accepted are kept for recipients nobody has recorded yet, so
+        # whoever sends the chunk next skips them; failures are left for it to send
+        db.session.rollback()
+        record_dispatch_results(blast.id, [result for result in pending_results if result.ok], overwrite=False)
+        pending_results.clear()
+        db.session.commit()
+
+    def flush_results(final=False):
+        nonlocal last_flush
+        with DB_FLUSH_SECONDS.time(operation='dispatch_results'):
+            # Checked first, so a holder whose lease was taken over never overwrites the new holder's rows
+            lease.renew(dispatched)
+            record_dispatch_results(blast.id, pending_results)
+            record_dead_letters(blast.id, pending_results)
+            suppress_failed_sends(pending_results)
+            if final:
+                recorded_count, succeeded = recorded_message_counts(blast.id, lease.first_recipient_id,
+                                                                    lease.last_recipient_id)
+                lease.complete(recorded_count, succeeded)
+            db.session.commit()
+            pending_results.clear()
+        last_flush = time.monotonic()
+        if on_flush is not None:
+            on_flush()
+
+    send_limiter(sending_workers())
+    pages = iter_blast_recipient_pages(blast.id, first_id=lease.first_recipient_id, last_id=lease.last_recipient_id)
+    with Heartbeat(current_app._get_current_object(), CHUNK_HEARTBEAT_INTERVAL, renew_lease,
+                   name=f'chunk-{lease.id}-heartbeat') as lease_heartbeat:
+        try:
+            # Sends still in flight when the chunk stops are waited for and kept too
+            schedule_twilio_message(blast, plan, send_now=send_now,
+                                    on_result=record_result, on_progress=on_progress,
+                                    pages=pages, indexes=indexes, skip=recorded,
+                                    on_abandoned=pending_results.extend)
+            flush_results(final=True)
+        except Exception:
+            keep_sent()
+            raise
+    return send_now
+
+def run_chunk(lease, on_flush=None):
+    send_now = False
+    try:
+        if lease.token > CHUNK_MAX_ATTEMPTS:
+            raise RuntimeError(f"Gave up after {CHUNK_MAX_ATTEMPTS} attempts")
+        send_now = dispatch_chunk(lease, on_flush)
+    except LeaseLost:
+        db.session.rollback()
+        logger.warning(f"Lost the lease on {lease}; its new holder sends the rest")
+        return
+    except Exception as e:
+        db.session.rollback()
+        gave_up = lease.release(str(e))
+        db.session.commit()
+        logger.exception(f"Sending {lease} failed{'' if gave_up else ', returned it for another attempt'}: {str(e)}")
+        send_now = db.session.get(Job, lease.job_id).payload.get('send_now', False)
+    finish_dispatch(lease.blast_id, send_now)
+
+@idle_handler
+def help_dispatch(worker_id):
+    lease = claim_next_chunk(worker_id)
+    if lease is None:
+        return False
+    run_chunk(lease)
+    return True
+
+def past_schedule_lead(blast):
+    # Twilio rejects a send_at closer than its minimum lead, which a blast can
+    # drift into while its job waits in the queue
+    return not blast.local_time and blast.scheduled_time <= datetime.utcnow() + TWILIO_MIN_SCHEDULE_LEAD
+
+def dispatch_blast(job, blast, messages, send_now=False):
+    # Missing credentials fail the job here, before anything is planned or reserved
+    get_client()
+    if blast.status == 'dispatching':
+        # Claimed again after its worker died; the plan and chunks were committed before that
+        send_now = job.payload.get('send_now', False)
+    else:
+        chunks, buckets = split_for_dispatch(blast, blast.local_time and not send_now)
+        if send_now:
+            plan = None
+        else:
+            plan = plan_blast(blast, messages, buckets)
+            job.payload = {**job.payload, 'plan': plan.as_dict()}
+        job.payload = {**job.payload, 'send_now': send_now, 'chunks': len(chunks)}
+        create_chunks(blast.id, job.id, chunks)
+        blast.status = 'dispatching'
+        update_job_progress(job, 0, messages)
+
+    def report_progress():
+        update_job_progress(job, chunk_progress(blast.id)[1])
+
+    # This worker sends chunks like any other, then waits out the ones other
+    # workers hold; leases that expire meanwhile are claimed here again
+    while True:
+        lease = claim_next_chunk(job.locked_by, blast_id=blast.id)
+        if lease is not None:
+            run_chunk(lease, on_flush=report_progress)
+            continue
+        open_chunks, dispatched = chunk_progress(blast.id)
+        update_job_progress(job, dispatched)
+        if not open_chunks:
+            break
+        time.sleep(CHUNK_WAIT_INTERVAL)
+
+    finish_dispatch(blast.id, send_now)
+    db.session.refresh(blast)
+    if blast.status == 'failed':
+        error = chunk_error(blast.id)
+        raise RuntimeError('Failed to schedule message blast with Twilio.' + (f' {error}' if error else ''))
+    logger.info(f"Successfully {'sent' if send_now else 'scheduled'} Twilio messages for ScheduledBlast ID: {blast.id}")
+
+def fail_blast(blast):
+    db.session.rollback()
+    abandon_chunks(blast.id)
+    reconcile_scheduled_count(blast.id)
+    blast.status = 'failed'
+    db.session.commit()
+
+def blast_abandoner(statuses):
+    # Fails the blast of a job given up on, unless an earlier attempt already moved it on
+    def abandon(job):
+        blast = db.session.get(ScheduledBlast, job.scheduled_blast_id)
+        if blast.status in statuses:
+            fail_blast(blast)
+        # The attempts that would have deleted the upload never finished
+        upload_id = (job.payload or {}).get('upload_id')
+        if upload_id:
+            delete_upload(upload_id)
+            db.session.commit()
+    return abandon
+
+@job_handler('schedule_blast', on_abandon=blast_abandoner(('queued', 'dispatching')))
+def schedule_blast_job(job):
+    blast = db.session.get(ScheduledBlast, job.scheduled_blast_id)
+    upload_id = job.payload.get('upload_id')
+    try:
+        if blast.status == 'dispatching':
+            dispatch_blast(job, blast, job.payload['estimate']['messages'])
+            return
+        if blast.status != 'queued':
+            # An earlier attempt got as far as holding the blast
+            logger.info(f"ScheduledBlast ID {blast.id} is already {blast.status}")
+            return
+
+        if upload_id:
+            # Hashed here rather than in the request, since reading a large upload takes seconds
+            validation = find_fresh_validation(job.user_id, upload_id, blast.message_template)
+            job.payload = {**job.payload, 'validation_id': validation.id if validation else None}
+            if validation is not None and validation.result['valid'] == 0:
+                result = validation.result
+                raise ValueError(f"The CSV file has no recipients to send to: {result['invalid_count']} invalid, "
+                                 f"{result['duplicates']} duplicate and {result['suppressed']} suppressed rows.")
+
+        counts = load_recipients(job, blast)
+        job.payload = {**job.payload, **counts}
+        db.session.commit()
+
+        # The upload's validation scan already rendered every message
+        estimate = reusable_estimate(job.payload.get('validation_id'), blast.message_template, counts['associated'])
+        if estimate is None:
+            estimate = estimate_segments(blast.message_template, iter_blast_recipient_pages(blast.id))
+        job.payload = {**job.payload, 'estimate': estimate}
+        logger.info(f"Estimate for ScheduledBlast ID {blast.id}: {estimate}")
+
+        if job.payload.get('hold'):
+            # Recipients are stored now; a release_blast job dispatches them later
+            hold_blast(blast, job.user_id, first_send_at=first_local_send_time(blast) if blast.local_time else None)
+            db.session.commit()
+            return
+        send_now = past_schedule_lead(blast)
+        if send_now:
+            logger.warning(f"ScheduledBlast ID {blast.id} waited in the queue past Twilio's minimum lead; sending now")
+        dispatch_blast(job, blast, estimate['messages'], send_now=send_now)
+    except Exception:
+        fail_blast(blast)
+        raise
+    finally:
+        if upload_id:
+            delete_upload(upload_id)
+            db.session.commit()
+
+@job_handler('release_blast', on_abandon=blast_abandoner(('held', 'dispatching')))
+def release_blast_job(job):
+    blast = db.session.get(ScheduledBlast, job.scheduled_blast_id)
+    if blast.status == 'dispatching':
+        try:
+            dispatch_blast(job, blast, job.progress_total)
+        except Exception:
+            fail_blast(blast)
+            raise
+        return
+    if blast.status != 'held':
+        logger.info(f"ScheduledBlast ID {blast.id} is {blast.status}; nothing to release")
+        return
+
+    # A worker outage can carry a Twilio-mode release past the point where
+    # send_at is still accepted; those blasts go out right away instead.
+    # Local-time blasts never do: each timezone keeps its own send_at, and
+    # plan_blast moves the ones already too close to the earliest allowed time.
+    direct = job.payload.get('send_mode') == 'direct'
+    send_now = not blast.local_time and (direct or past_schedule_lead(blast))
+    if send_now and not direct:
+        logger.warning(f"ScheduledBlast ID {blast.id} was released too late for Twilio scheduling; sending now")
+    try:
+        messages = db.session.execute(
+            select(func.count(RecipientBlastAssociation.id))
+            .where(RecipientBlastAssociation.scheduled_blast_id == blast.id)
+        ).scalar()
+        dispatch_blast(job, blast, messages, send_now=send_now)
+    except Exception:
+        fail_blast(blast)
+        raise
+
+def settle_cancel(blast):
+    counts = status_counts(blast.id)
+    remaining = sum(counts.get(status, 0) for status in CANCELABLE_MESSAGE_STATUSES)
+    if remaining == 0:
+        blast.status = 'canceled'
+    elif counts.get('canceled'):
+        blast.status = 'partially_canceled'
+    else:
+        blast.status = 'scheduled'
+    reconcile_scheduled_count(blast.id)
+    db.session.commit()
+    return counts
+
+def abandon_cancel(job):
+    settle_cancel(db.session.get(ScheduledBlast, job.scheduled_blast_id))
+
+@job_handler('cancel_blast', on_abandon=abandon_cancel)
+def cancel_blast_job(job):
+    blast = db.session.get(ScheduledBlast, job.scheduled_blast_id)
+    pending_results = []
+
+    def record_result(result):
+        pending_results.append(result)
+        if len(pending_results) >= RESULT_FLUSH_SIZE:
+            flush_results()
+
+    def flush_results():
+        with DB_FLUSH_SECONDS.time(operation='cancel_results'):
+            record_cancel_results(pending_results)
+            pending_results.clear()
+            db.session.commit()
+
+    counts = status_counts(blast.id)
+    update_job_progress(job, 0, sum(counts.get(status, 0) for status in CANCELABLE_MESSAGE_STATUSES))
+    try:
+        cancel_twilio_message(blast,
+                              on_result=record_result,
+                              on_progress=lambda done: update_job_progress(job, done))
+    finally:
+        flush_results()
+        counts = settle_cancel(blast)
+
+    logger.info(f"Cancellation for ScheduledBlast ID {blast.id} finished: {counts}")
+
+@job_handler('replay_dead_letters')
+def replay_dead_letters_job(job):
+    report = replay_dead_letters(job.scheduled_blast_id,
+                                 include_permanent=job.payload.get('include_permanent', False),
+                                 on_progress=lambda done: update_job_progress(job, done))
+    reconcile_scheduled_count(job.scheduled_blast_id)
+    blast = db.session.get(ScheduledBlast, job.scheduled_blast_id)
+    db.session.refresh(blast)
+    if blast.status == 'failed' and report.succeeded_count:
+        # Every message had been dead-lettered; the ones Twilio took now make it a live blast
+        blast.status = 'scheduled' if blast.scheduled_count else 'sent'
+    job.payload = {**job.payload, **report.summary()}
@@ -0,0 +1,87 @@
+import io
+import os
+import re
+import csv
+import hashlib
+from itertools import islice
+
+CSV_CHUNK_SIZE = int(os.environ.get("CSV_CHUNK_SIZE", "1000"))
+INVALID_SAMPLE_SIZE = 100
+
+PHONE_NUMBER_PATTERN = re.compile(r'\+[1-9]\d{1,14}')
+# Matches a newline-joined batch only when every line is a valid E.164 number
+_VALID_PHONE_BATCH = re.compile(r'(?:\+[1-9]\d{1,14}\n)*')
+
+def invalid_phone_indexes(phone_numbers):
+    """Indexes of the entries in `phone_numbers` that are not E.164 numbers.
+
+    The whole batch is checked with one regex pass first; the per-number check
+    only runs for batches that contain a bad number.
+    """
+    joined = '\n'.join(phone_numbers) + '\n'
+    if joined.count('\n') == len(phone_numbers) and _VALID_PHONE_BATCH.fullmatch(joined):
+        return []
+    return [i for i, phone_number in enumerate(phone_numbers) if not PHONE_NUMBER_PATTERN.fullmatch(phone_number)]
+
+def stream_digest(binary_stream, block_size=1 << 20):
+    digest = hashlib.sha256()
+    for block in iter(lambda: binary_stream.read(block_size), b''):
+        digest.update(block)
+    return digest.hexdigest()
+
+def text_stream(binary_stream, encoding='utf-8'):
+    # newline='' is required by the csv module so quoted newlines survive
+    return io.TextIOWrapper(binary_stream, encoding=encoding, newline='')
+
+class CsvStreamReader:
+    """Reads an uploaded CSV incrementally and yields validated rows in chunks.
+
+    Only one chunk of rows is held in memory at a time. Rows without a valid
+    E.164 `phone_number` are counted (with a bounded sample kept for display)
+    and left out of the chunks.
+    """
+
+    def __init__(self, binary_stream, chunk_size=CSV_CHUNK_SIZE, encoding='utf-8'):
+        self._text = text_stream(binary_stream, encoding)
+        self._reader = csv.DictReader(self._text)
+        self.chunk_size = chunk_size
+        self.rows_read = 0
+        self.invalid_count = 0
+        self.invalid_sample = []
+
+    @property
+    def fieldnames(self):
+        return self._reader.fieldnames or []
+
+    def __iter__(self):
+        while True:
+            rows = list(islice(self._reader, self.chunk_size))
+            if not rows:
+                return
+            self.rows_read += len(rows)
+            phone_numbers = [(row.get('phone_number') or '').strip() for row in rows]
+            invalid = invalid_phone_indexes(phone_numbers)
+            for row, phone_number in zip(rows, phone_numbers):
+                row['phone_number'] = phone_number
+            if invalid:
+                self.invalid_count += len(invalid)
+                for i in invalid[:INVALID_SAMPLE_SIZE - len(self.invalid_sample)]:
+                    self.invalid_sample.append(phone_numbers[i])
+                bad = set(invalid)
+                rows = [row for i, row in enumerate(rows) if i not in bad]
+            if rows:
+                yield rows
+
+    def close(self):
+        # Hand the underlying stream back to its owner instead of closing it
+        self._text.detach()
+
+def read_csv_preview(binary_stream, max_rows=5, encoding='utf-8'):
+    text = text_stream(binary_stream, encoding)
+    try:
+        reader = csv.DictReader(text)
+        headers = reader.fieldnames or []
+        rows = list(islice(reader, max_rows))
+    finally:
+        text.detach()
+    return {'headers': headers, 'rows': rows}
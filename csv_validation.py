@@ -0,0 +1,161 @@
+import os
+import time
+import hashlib
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy.exc import IntegrityError
+from models import CsvValidation, db
+from job_queue import job_handler, enqueue_job, update_job_progress
+from csv_stream import CsvStreamReader, stream_digest
+from uploads import store_upload, open_upload, upload_digest, delete_upload
+from message_templates import compile_template, SegmentTally
+from suppression import get_suppression_index
+
+logger = logging.getLogger(__name__)
+
+# Suppressions change over time, so cached counts are only trusted this long
+CSV_VALIDATION_TTL = timedelta(hours=float(os.environ.get("CSV_VALIDATION_TTL_HOURS", "24")))
+VALIDATION_PROGRESS_INTERVAL = 1.0
+
+def template_digest(template):
+    return hashlib.sha256((template or '').encode()).hexdigest()
+
+def scan_csv(reader, template, suppressed, on_progress=None):
+    """Count valid, invalid, duplicate and suppressed rows of a whole upload, with
+    placeholder coverage and a segment/cost estimate for `template`."""
+    compiled = compile_template(template or '')
+    tally = SegmentTally()
+    seen = set()
+    filled = {}
+    duplicates = 0
+    suppressed_count = 0
+    last_progress = time.monotonic()
+    for chunk in reader:
+        for row in chunk:
+            phone_number = row['phone_number']
+            if phone_number in seen:
+                duplicates += 1
+                continue
+            seen.add(phone_number)
+            if phone_number in suppressed:
+                suppressed_count += 1
+                continue
+            for column, value in row.items():
+                if value:
+                    filled[column] = filled.get(column, 0) + 1
+            tally.add(compiled.render_values(row))
+        if on_progress is not None and time.monotonic() - last_progress >= VALIDATION_PROGRESS_INTERVAL:
+            last_progress = time.monotonic()
+            on_progress(reader.rows_read)
+
+    columns = [column for column in reader.fieldnames if column]
+    valid = tally.totals['messages']
+    return {
+        'rows': reader.rows_read,
+        'valid': valid,
+        'invalid_count': reader.invalid_count,
+        'invalid_sample': reader.invalid_sample,
+        'duplicates': duplicates,
+        'suppressed': suppressed_count,
+        'columns': columns,
+        'missing_phone_column': 'phone_number' not in columns,
+        'missing_fields': compiled.missing_fields(columns),
+        'coverage': compiled.coverage(columns, filled, valid),
+        'estimate': tally.result(),
+    }
+
+def find_validation(user_id, file_hash, template):
+    return CsvValidation.query.filter_by(user_id=user_id, file_hash=file_hash,
+                                         template_hash=template_digest(template)).first()
+
+def is_fresh(validation):
+    return validation.result is not None and validation.created_at > datetime.utcnow() - CSV_VALIDATION_TTL
+
+def find_fresh_validation(user_id, upload_id, template):
+    """The finished scan of this upload and template, unless it is past CSV_VALIDATION_TTL."""
+    validation = find_validation(user_id, upload_digest(upload_id), template)
+    return validation if validation is not None and is_fresh(validation) else None
+
+def request_validation(user_id, binary_stream, template):
+    """Return the CsvValidation for this file and template, storing the upload and
+    queuing a scan of it unless a fresh result or a scan in progress already covers it."""
+    file_hash = stream_digest(binary_stream)
+    validation = find_validation(user_id, file_hash, template)
+    if validation is not None and (is_fresh(validation) or
+                                   (validation.job is not None and validation.job.status in ('queued', 'running'))):
+        return validation
+
+    if validation is None:
+        validation = CsvValidation(user_id=user_id, file_hash=file_hash, template_hash=template_digest(template))
+        db.session.add(validation)
+        try:
+            db.session.flush()
+        except IntegrityError:
+            # The same file was submitted twice at once; the other request queued the scan
+            db.session.rollback()
+            return find_validation(user_id, file_hash, template)
+    validation.result = None
+    binary_stream.seek(0)
+    job = enqueue_job('validate_csv', {
+        'validation_id': validation.id,
+        'upload_id': store_upload(binary_stream),
+        'message_template': template,
+    }, user_id=user_id)
+    db.session.flush()
+    validation.job_id = job.id
+    return validation
+
+def validation_status(validation):
+    job = validation.job
+    if validation.result is not None:
+        status = 'done'
+    else:
+        status = job.status if job is not None else 'failed'
+    return {
+        'id': validation.id,
+        'status': status,
+        'rows_scanned': job.progress_done if job is not None else None,
+        'error': job.error if job is not None else None,
+        'result': validation.result,
+    }
+
+def reusable_estimate(validation_id, template, messages):
+    """The scan's estimate, if it was made for `template` and the blast ended up
+    with exactly the recipients the scan counted."""
+    if validation_id is None:
+        return None
+    validation = db.session.get(CsvValidation, validation_id)
+    if validation is None or not is_fresh(validation) or validation.template_hash != template_digest(template):
+        return None
+    estimate = validation.result['estimate']
+    if estimate['messages'] != messages:
+        return None
+    return dict(estimate)
+
+def discard_validation_upload(job):
+    delete_upload(job.payload['upload_id'])
+    db.session.commit()
+
+@job_handler('validate_csv', on_abandon=discard_validation_upload)
+def validate_csv_job(job):
+    validation = db.session.get(CsvValidation, job.payload['validation_id'])
+    upload_id = job.payload['upload_id']
+    try:
+        with open_upload(upload_id) as f:
+            reader = CsvStreamReader(f)
+            try:
+                result = scan_csv(reader, job.payload.get('message_template'), get_suppression_index(),
+                                  on_progress=lambda rows: update_job_progress(job, rows))
+            finally:
+                reader.close()
+        validation.result = result
+        validation.created_at = datetime.utcnow()
+        job.progress_done = result['rows']
+        summary = {key: result[key] for key in ('rows', 'valid', 'invalid_count', 'duplicates', 'suppressed')}
+        logger.info(f"Validated upload for CsvValidation ID {validation.id}: {summary}")
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        delete_upload(upload_id)
+        db.session.commit()
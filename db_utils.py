@@ -0,0 +1,16 @@
+from models import db
+
+def dialect_name():
+    return db.session.get_bind().dialect.name
+
+def insert_for_dialect(model):
+    # ON CONFLICT support lives on the dialect-specific insert constructs; only
+    # the dialect in use is imported, since loading both slows worker startup
+    dialect = dialect_name()
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+        return insert(model)
+    if dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+        return insert(model)
+    raise NotImplementedError(f"Bulk upsert is not supported on {dialect}")
@@ -0,0 +1,86 @@
+import logging
+from datetime import datetime
+from sqlalchemy import select, func
+from models import DeadLetter, db
+from scheduled_messages import record_dispatch_results
+from dispatch_planner import TWILIO_MIN_SCHEDULE_LEAD
+from twilio_integration import resend_twilio_messages
+
+logger = logging.getLogger(__name__)
+
+def record_dead_letters(blast_id, results):
+    rows = [
+        {
+            'scheduled_blast_id': blast_id,
+            'recipient_id': result.key,
+            'phone_number': result.to,
+            'message_params': result.params,
+            'error_code': result.error_code,
+            'error_message': result.error,
+            'attempts': result.attempts,
+            'permanent': result.permanent,
+            'created_at': datetime.utcnow(),
+        }
+        for result in results if not result.ok
+    ]
+    if rows:
+        db.session.execute(DeadLetter.__table__.insert(), rows)
+
+def pending_dead_letter_counts(blast_ids):
+    if not blast_ids:
+        return {}
+    rows = db.session.execute(
+        select(DeadLetter.scheduled_blast_id, func.count())
+        .where(DeadLetter.scheduled_blast_id.in_(blast_ids),
+               DeadLetter.replayed_at.is_(None),
+               DeadLetter.permanent.is_(False))
+        .group_by(DeadLetter.scheduled_blast_id)
+    )
+    return dict(rows.all())
+
+def is_still_schedulable(params, now):
+    send_at = params.get('send_at')
+    if not send_at:
+        return True
+    send_at = datetime.fromisoformat(send_at)
+    if send_at.tzinfo is not None:
+        send_at = send_at.replace(tzinfo=None) - send_at.utcoffset()
+    return send_at > now + TWILIO_MIN_SCHEDULE_LEAD
+
+def replay_dead_letters(blast_id, include_permanent=False, on_progress=None):
+    query = DeadLetter.query.filter(DeadLetter.scheduled_blast_id == blast_id,
+                                    DeadLetter.replayed_at.is_(None))
+    if not include_permanent:
+        query = query.filter(DeadLetter.permanent.is_(False))
+
+    now = datetime.utcnow()
+    letters = {}
+    skipped = 0
+    for letter in query.order_by(DeadLetter.id):
+        if not is_still_schedulable(letter.message_params, now):
+            skipped += 1
+            continue
+        # A recipient can only have one live message per blast; the newest letter wins
+        letters[letter.recipient_id] = letter
+    if skipped:
+        logger.warning(f"Skipped {skipped} dead letter(s) for ScheduledBlast ID {blast_id}: send time has passed")
+
+    results = []
+
+    def on_result(result):
+        results.append(result)
+        letter = letters[result.key]
+        letter.attempts += result.attempts
+        if result.ok:
+            letter.replayed_at = datetime.utcnow()
+            letter.replay_sid = result.sid
+        else:
+            letter.error_code = result.error_code
+            letter.error_message = result.error
+            letter.permanent = result.permanent
+
+    jobs = [(recipient_id, letter.message_params) for recipient_id, letter in letters.items()]
+    report = resend_twilio_messages(jobs, on_result=on_result, on_progress=on_progress)
+    record_dispatch_results(blast_id, results)
+    db.session.commit()
+    return report
@@ -0,0 +1,212 @@
+"""Leases on slices of a blast's dispatch, so several worker processes can send one blast.
+
+A blast's recipients are cut, in recipient id order, into DispatchChunk rows.
+Workers claim a chunk with SELECT ... FOR UPDATE SKIP LOCKED followed by a
+conditional UPDATE (the only guard on SQLite), renew the lease while sending,
+and lose it if they stop heartbeating for DISPATCH_LEASE_SECONDS. Every write
+a worker makes for a chunk runs in a transaction that first checks its claim
+is still the current one, so results are recorded once per recipient even
+when a stalled worker comes back after its chunk was taken over.
+"""
+import os
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import select, update, func, or_, and_
+from models import DispatchChunk, ScheduledBlast, db
+from dispatch_planner import DISPATCH_CHUNK_SIZE, reconcile_scheduled_count
+from scheduled_messages import iter_blast_recipient_pages, iter_blast_recipient_id_pages
+
+logger = logging.getLogger(__name__)
+
+DISPATCH_LEASE_SECONDS = float(os.environ.get("DISPATCH_LEASE_SECONDS", "60"))
+# A timer thread renews the lease this often while a chunk sends; results are
+# written at least this often too
+CHUNK_HEARTBEAT_INTERVAL = float(os.environ.get("CHUNK_HEARTBEAT_INTERVAL", "5"))
+# Claims after which a chunk that keeps failing or killing its worker is given up
+CHUNK_MAX_ATTEMPTS = int(os.environ.get("CHUNK_MAX_ATTEMPTS", "5"))
+
+OPEN_CHUNK_STATUSES = ['pending', 'leased']
+
+class LeaseLost(Exception):
+    pass
+
+def split_blast(blast_id, chunk_size=DISPATCH_CHUNK_SIZE, bucket_of=None):
+    """Cut the blast's recipients into chunks of `chunk_size`.
+
+    With `bucket_of`, recipients are also sorted into buckets (timezones) and
+    each chunk records how many of every bucket came before it. Returns the
+    chunk rows and the bucket totals.
+    """
+    if bucket_of is None:
+        pages = ([(recipient_id, None) for recipient_id in page]
+                 for page in iter_blast_recipient_id_pages(blast_id))
+    else:
+        pages = ([(recipient.id, bucket_of(recipient)) for recipient in page]
+                 for page in iter_blast_recipient_pages(blast_id))
+    chunks = []
+    counts = {}
+    position = 0
+    for page in pages:
+        for recipient_id, bucket in page:
+            if position % chunk_size == 0:
+                chunks.append({
+                    'seq': len(chunks),
+                    'first_recipient_id': recipient_id,
+                    'first_index': position,
+                    'bucket_offsets': dict(counts) if bucket_of is not None else None,
+                    'messages': 0,
+                })
+            chunk = chunks[-1]
+            chunk['last_recipient_id'] = recipient_id
+            chunk['messages'] += 1
+            if bucket_of is not None:
+                counts[bucket] = counts.get(bucket, 0) + 1
+            position += 1
+    return chunks, counts
+
+def create_chunks(blast_id, job_id, chunks):
+    if chunks:
+        db.session.execute(DispatchChunk.__table__.insert(), [
+            {**chunk, 'scheduled_blast_id': blast_id, 'job_id': job_id, 'status': 'pending',
+             'attempts': 0, 'dispatched': 0, 'succeeded': 0}
+            for chunk in chunks
+        ])
+
+def _claimable(now):
+    return or_(DispatchChunk.status == 'pending',
+               and_(DispatchChunk.status == 'leased', DispatchChunk.lease_expires_at < now))
+
+def claim_next_chunk(worker_id, blast_id=None):
+    # Same two steps as claim_next_job; expired leases are claimable like pending chunks
+    now = datetime.utcnow()
+    query = DispatchChunk.query.filter(_claimable(now))
+    if blast_id is not None:
+        query = query.filter(DispatchChunk.scheduled_blast_id == blast_id)
+    candidate = (query.order_by(DispatchChunk.scheduled_blast_id, DispatchChunk.seq)
+                 .with_for_update(skip_locked=True)
+                 .first())
+    if candidate is None:
+        db.session.rollback()
+        return None
+
+    claimed = (DispatchChunk.query
+               .filter(DispatchChunk.id == candidate.id, _claimable(now))
+               .update({
+                   'status': 'leased',
+                   'lease_owner': worker_id,
+                   'lease_expires_at': now + timedelta(seconds=DISPATCH_LEASE_SECONDS),
+                   'heartbeat_at': now,
+                   'attempts': DispatchChunk.attempts + 1
+               }, synchronize_session=False))
+    db.session.commit()
+    if not claimed:
+        return None
+    return ChunkLease(db.session.get(DispatchChunk, candidate.id, populate_existing=True))
+
+class ChunkLease:
+    """A claimed chunk, held as plain values that survive commits.
+
+    `token` is the attempt count the claim set; every write below only lands
+    while the row still carries it. The caller commits.
+    """
+
+    def __init__(self, chunk):
+        self.id = chunk.id
+        self.blast_id = chunk.scheduled_blast_id
+        self.job_id = chunk.job_id
+        self.seq = chunk.seq
+        self.owner = chunk.lease_owner
+        self.token = chunk.attempts
+        self.first_recipient_id = chunk.first_recipient_id
+        self.last_recipient_id = chunk.last_recipient_id
+        self.first_index = chunk.first_index
+        self.bucket_offsets = chunk.bucket_offsets
+
+    def __str__(self):
+        return f"chunk {self.seq} of ScheduledBlast ID {self.blast_id}"
+
+    def _update(self, **values):
+        return db.session.execute(
+            update(DispatchChunk)
+            .where(DispatchChunk.id == self.id, DispatchChunk.status == 'leased',
+                   DispatchChunk.attempts == self.token)
+            .values(**values)
+        ).rowcount > 0
+
+    def renew(self, dispatched):
+        now = datetime.utcnow()
+        if not self._update(heartbeat_at=now, lease_expires_at=now + timedelta(seconds=DISPATCH_LEASE_SECONDS),
+                            dispatched=dispatched):
+            raise LeaseLost(f"Lease on {self} was taken over")
+
+    def complete(self, dispatched, succeeded):
+        if not self._update(status='done', dispatched=dispatched, succeeded=succeeded,
+                            lease_expires_at=None, finished_at=datetime.utcnow()):
+            raise LeaseLost(f"Lease on {self} was taken over")
+
+    def release(self, error):
+        # Back to the pool for another worker, until it has used up its attempts
+        give_up = self.token >= CHUNK_MAX_ATTEMPTS
+        self._update(status='failed' if give_up else 'pending', error=error, lease_owner=None,
+                     lease_expires_at=None, finished_at=datetime.utcnow() if give_up else None)
+        return give_up
+
+def chunk_progress(blast_id):
+    """(open chunks, recipients dispatched) across every worker on the blast."""
+    open_chunks, dispatched = db.session.execute(
+        select(func.count(DispatchChunk.id).filter(DispatchChunk.status.in_(OPEN_CHUNK_STATUSES)),
+               func.coalesce(func.sum(DispatchChunk.dispatched), 0))
+        .where(DispatchChunk.scheduled_blast_id == blast_id)
+    ).one()
+    return open_chunks, dispatched
+
+def sending_workers(now=None):
+    """Worker processes holding a live chunk lease on any blast, this one included."""
+    return db.session.execute(
+        select(func.count(func.distinct(DispatchChunk.lease_owner)))
+        .where(DispatchChunk.status == 'leased', DispatchChunk.lease_expires_at >= (now or datetime.utcnow()))
+    ).scalar()
+
+def chunk_error(blast_id):
+    return db.session.execute(
+        select(DispatchChunk.error)
+        .where(DispatchChunk.scheduled_blast_id == blast_id, DispatchChunk.error.isnot(None))
+        .order_by(DispatchChunk.seq)
+        .limit(1)
+    ).scalar()
+
+def abandon_chunks(blast_id):
+    # Workers still holding one of these lose their lease at the next heartbeat
+    db.session.execute(
+        update(DispatchChunk)
+        .where(DispatchChunk.scheduled_blast_id == blast_id, DispatchChunk.status.in_(OPEN_CHUNK_STATUSES))
+        .values(status='failed', error='Blast failed', lease_expires_at=None, finished_at=datetime.utcnow())
+    )
+
+def finish_dispatch(blast_id, send_now=False):
+    """Settle a dispatching blast once none of its chunks is open.
+
+    Whichever worker finishes a chunk calls this after committing, so the last
+    one always sees every chunk closed; the conditional UPDATE keeps two of
+    them from both settling it. Returns True once the blast is settled.
+    """
+    open_chunks, _ = chunk_progress(blast_id)
+    if open_chunks:
+        db.session.rollback()
+        return False
+    succeeded = db.session.execute(
+        select(func.coalesce(func.sum(DispatchChunk.succeeded), 0))
+        .where(DispatchChunk.scheduled_blast_id == blast_id)
+    ).scalar()
+    status = ('sent' if send_now else 'scheduled') if succeeded else 'failed'
+    settled = db.session.execute(
+        update(ScheduledBlast)
+        .where(ScheduledBlast.id == blast_id, ScheduledBlast.status == 'dispatching')
+        .values(status=status)
+    ).rowcount
+    if settled:
+        reconcile_scheduled_count(blast_id)
+    db.session.commit()
+    if settled:
+        logger.info(f"ScheduledBlast ID {blast_id} finished dispatching: {status}, {succeeded} messages accepted")
+    return True
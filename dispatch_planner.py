@@ -0,0 +1,149 @@
+import os
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import select, update, func, text
+from models import ScheduledBlast, ScheduledMessage, db
+from db_utils import dialect_name
+
+logger = logging.getLogger(__name__)
+
+# Messages per second the Messaging Service actually delivers; send_at is
+# staggered so Twilio never has more than this to release at once
+TWILIO_DELIVERY_MPS = float(os.environ.get("TWILIO_DELIVERY_MPS", os.environ.get("TWILIO_MESSAGING_MPS", "10")))
+DISPATCH_CHUNK_SIZE = int(os.environ.get("DISPATCH_CHUNK_SIZE", "600"))
+# Twilio's cap on messages waiting to be sent per account
+TWILIO_SCHEDULED_MESSAGE_LIMIT = int(os.environ.get("TWILIO_SCHEDULED_MESSAGE_LIMIT", "500000"))
+# Twilio accepts send_at values from 15 minutes up to 7 days out; a minute of
+# slack covers the time it takes to dispatch
+TWILIO_SCHEDULE_WINDOW = timedelta(days=7)
+TWILIO_MIN_SCHEDULE_LEAD = timedelta(minutes=16)
+# Serializes capacity checks across workers on PostgreSQL
+PLAN_LOCK_KEY = 0x5C4ED
+
+class DispatchPlanError(Exception):
+    pass
+
+class BlastPlan:
+    """Splits a blast into chunks of `chunk_size` messages, each with its own send_at.
+
+    `buckets` maps a key (a timezone in local-time mode) to `(start, messages)`;
+    by default the whole blast is one bucket starting at `scheduled_time`.
+    Chunks from every bucket are laid on one timeline in start order, each
+    taking `chunk_size / rate` seconds of it, so the blast never asks Twilio to
+    release more than `rate` messages per second, even where buckets overlap,
+    and the last message's time is known up front.
+    """
+
+    def __init__(self, scheduled_time, messages, rate=TWILIO_DELIVERY_MPS, chunk_size=DISPATCH_CHUNK_SIZE, buckets=None):
+        self.scheduled_time = scheduled_time
+        self.rate = rate
+        self.chunk_size = chunk_size
+        self.local = buckets is not None
+        self.buckets = buckets if buckets is not None else {None: (scheduled_time, messages)}
+        self.messages = sum(count for _, count in self.buckets.values())
+        self._chunk_times = {}
+        self.finishes_at = scheduled_time
+        cursor = None
+        for key, (start, count) in sorted(self.buckets.items(), key=lambda item: item[1][0]):
+            times = []
+            for offset in range(0, max(count, 1), chunk_size):
+                at = start if cursor is None else max(start, cursor)
+                times.append(at.replace(microsecond=0))
+                cursor = at + timedelta(seconds=min(chunk_size, max(count - offset, 0)) / rate)
+            self._chunk_times[key] = times
+            self.finishes_at = max(self.finishes_at, cursor)
+
+    @property
+    def chunks(self):
+        return sum(len(times) for times in self._chunk_times.values())
+
+    def send_at(self, index, bucket=None):
+        times = self._chunk_times[bucket]
+        return times[min(index // self.chunk_size, len(times) - 1)]
+
+    @property
+    def last_send_at(self):
+        return max(times[-1] for times in self._chunk_times.values())
+
+    def as_dict(self):
+        plan = {
+            'messages': self.messages,
+            'chunks': self.chunks,
+            'chunk_size': self.chunk_size,
+            'rate': self.rate,
+            'last_send_at': self.last_send_at.isoformat(),
+            'finishes_at': self.finishes_at.replace(microsecond=0).isoformat(),
+        }
+        if self.local:
+            plan['buckets'] = {key: {'start': start.isoformat(), 'messages': count}
+                               for key, (start, count) in self.buckets.items()}
+        return plan
+
+    @classmethod
+    def from_dict(cls, scheduled_time, plan):
+        # Rebuilds the same timeline from as_dict() in workers sending single chunks
+        buckets = None
+        if 'buckets' in plan:
+            buckets = {key: (datetime.fromisoformat(bucket['start']), bucket['messages'])
+                       for key, bucket in plan['buckets'].items()}
+        return cls(scheduled_time, plan['messages'], rate=plan['rate'], chunk_size=plan['chunk_size'], buckets=buckets)
+
+def outstanding_scheduled_messages(exclude_blast_id=None, now=None):
+    # Sum of per-blast running counts; blasts whose last send_at has passed no
+    # longer hold messages at Twilio even if no status callback said so.
+    now = now or datetime.utcnow()
+    query = (select(func.coalesce(func.sum(ScheduledBlast.scheduled_count), 0))
+             .where(ScheduledBlast.scheduled_count > 0,
+                    func.coalesce(ScheduledBlast.send_window_end, ScheduledBlast.scheduled_time) > now))
+    if exclude_blast_id is not None:
+        query = query.where(ScheduledBlast.id != exclude_blast_id)
+    return db.session.execute(query).scalar()
+
+def plan_blast(blast, messages, buckets=None, now=None):
+    """Plan `blast` and reserve room for its messages under the account limit.
+
+    Buckets whose start is already too close for Twilio to accept are moved to
+    the earliest allowed time. Raises DispatchPlanError when the staggered blast
+    would run past Twilio's scheduling window or the account has no room for it.
+    """
+    now = now or datetime.utcnow()
+    if buckets is not None:
+        earliest = now + TWILIO_MIN_SCHEDULE_LEAD
+        late = [key for key, (start, _) in buckets.items() if start < earliest]
+        if late:
+            logger.warning(f"ScheduledBlast ID {blast.id}: {', '.join(late)} already past the local send time; "
+                           f"sending at {earliest:%H:%M} UTC instead")
+        buckets = {key: (max(start, earliest), count) for key, (start, count) in buckets.items()}
+    plan = BlastPlan(blast.scheduled_time, messages, buckets=buckets)
+    if plan.last_send_at > now + TWILIO_SCHEDULE_WINDOW:
+        raise DispatchPlanError(
+            f"Delivering {messages} messages at {plan.rate:g}/s runs until {plan.last_send_at:%Y-%m-%d %H:%M} UTC, "
+            f"past Twilio's 7-day scheduling window.")
+
+    if dialect_name() == 'postgresql':
+        # Held until the caller commits the reservation below
+        db.session.execute(text('SELECT pg_advisory_xact_lock(:key)'), {'key': PLAN_LOCK_KEY})
+    outstanding = outstanding_scheduled_messages(exclude_blast_id=blast.id, now=now)
+    available = TWILIO_SCHEDULED_MESSAGE_LIMIT - outstanding
+    if messages > available:
+        raise DispatchPlanError(
+            f"This blast has {messages} messages but only {max(0, available)} of the account's "
+            f"{TWILIO_SCHEDULED_MESSAGE_LIMIT} scheduled-message slots are free.")
+
+    # Reserved up front so concurrent jobs see the space as taken;
+    # reconcile_scheduled_count replaces it with the real number afterwards.
+    blast.scheduled_count = messages
+    blast.send_window_end = plan.last_send_at
+    logger.info(f"Plan for ScheduledBlast ID {blast.id}: {plan.as_dict()} ({outstanding} already outstanding)")
+    return plan
+
+def reconcile_scheduled_count(blast_id):
+    db.session.execute(
+        update(ScheduledBlast)
+        .where(ScheduledBlast.id == blast_id)
+        .values(scheduled_count=(
+            select(func.count(ScheduledMessage.id))
+            .where(ScheduledMessage.scheduled_blast_id == blast_id, ScheduledMessage.status == 'scheduled')
+            .scalar_subquery()
+        ))
+    )
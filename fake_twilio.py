@@ -0,0 +1,148 @@
+"""Minimal local stand-in for the Twilio Messages API.
+
+Run with `python fake_twilio.py --port 8765` and set
+TWILIO_API_BASE_URL=http://127.0.0.1:8765 to send the app's Twilio traffic to it.
+Latency, 5xx errors and 429 throttling can be injected for load testing.
+"""
+import argparse
+import itertools
+import json
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+import re
+
+MESSAGES_PATH = re.compile(r'^/2010-04-01/Accounts/(?P<account>[^/]+)/Messages(?:/(?P<sid>[^/.]+))?\.json$')
+
+class FakeTwilioState:
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, throttle_rate=0.0, max_mps=None):
+        self.messages = {}
+        self.lock = threading.Lock()
+        self._counter = itertools.count(1)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.max_mps = max_mps
+        self._window_start = time.monotonic()
+        self._window_count = 0
+        self.stats = {'requests': 0, 'created': 0, 'updated': 0, 'throttled': 0, 'errors': 0}
+
+    def next_sid(self):
+        return f"SM{next(self._counter):032x}"
+
+    def count(self, key):
+        with self.lock:
+            self.stats[key] += 1
+
+    def over_rate_limit(self):
+        if self.max_mps is None:
+            return False
+        with self.lock:
+            now = time.monotonic()
+            if now - self._window_start >= 1.0:
+                self._window_start, self._window_count = now, 0
+            self._window_count += 1
+            return self._window_count > self.max_mps
+
+    def fault(self):
+        """Return an injected (status, payload) failure, or None to serve normally."""
+        if self.latency or self.jitter:
+            time.sleep(self.latency + random.uniform(0, self.jitter))
+        if self.over_rate_limit() or random.random() < self.throttle_rate:
+            self.count('throttled')
+            return 429, {'code': 20429, 'message': 'Too Many Requests', 'status': 429}
+        if random.random() < self.error_rate:
+            self.count('errors')
+            return 500, {'code': 20500, 'message': 'Internal Server Error', 'status': 500}
+        return None
+
+class FakeTwilioHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_form(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        form = parse_qs(self.rfile.read(length).decode('utf-8'))
+        return {k: v[0] for k, v in form.items()}
+
+    def do_POST(self):
+        match = MESSAGES_PATH.match(self.path.split('?')[0])
+        form = self._read_form()
+        if not match:
+            return self._send_json(404, {'code': 20404, 'message': 'Not found', 'status': 404})
+
+        state = self.server.state
+        state.count('requests')
+        fault = state.fault()
+        if fault:
+            return self._send_json(*fault)
+        account, sid = match.group('account'), match.group('sid')
+        now = datetime.now(timezone.utc).strftime('%a, %d %b %Y %H:%M:%S +0000')
+        with state.lock:
+            if sid is None:
+                sid = state.next_sid()
+                message = {
+                    'sid': sid,
+                    'account_sid': account,
+                    'messaging_service_sid': form.get('MessagingServiceSid'),
+                    'to': form.get('To'),
+                    'body': form.get('Body'),
+                    'status': 'scheduled' if form.get('SendAt') else 'queued',
+                    'date_created': now,
+                    'date_updated': now,
+                }
+                state.messages[sid] = message
+                state.stats['created'] += 1
+                return self._send_json(201, message)
+
+            message = state.messages.get(sid)
+            if message is None:
+                return self._send_json(404, {'code': 20404, 'message': f'Message {sid} not found', 'status': 404})
+            if form.get('Status'):
+                message['status'] = form['Status']
+                message['date_updated'] = now
+                state.stats['updated'] += 1
+            return self._send_json(200, message)
+
+class FakeTwilioServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+def make_server(host='127.0.0.1', port=0, **options):
+    server = FakeTwilioServer((host, port), FakeTwilioHandler)
+    server.state = FakeTwilioState(**options)
+    return server
+
+def start_in_thread(host='127.0.0.1', port=0, **options):
+    server = make_server(host, port, **options)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    parser.add_argument('--jitter', type=float, default=0.0, help='extra random latency, up to this many seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests answered with a 500')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='fraction of requests answered with a 429')
+    parser.add_argument('--max-mps', type=float, default=None, help='answer 429 above this many requests per second')
+    args = parser.parse_args()
+    make_server(args.host, args.port, latency=args.latency, jitter=args.jitter,
+                error_rate=args.error_rate, throttle_rate=args.throttle_rate,
+                max_mps=args.max_mps).serve_forever()
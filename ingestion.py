@@ -0,0 +1,127 @@
+import logging
+from sqlalchemy import select
+from models import Recipient, RecipientBlastAssociation, db
+from db_utils import insert_for_dialect
+from suppression import get_suppression_index
+from metrics import Counter, DB_FLUSH_SECONDS
+
+logger = logging.getLogger(__name__)
+
+CSV_ROWS = Counter('csv_rows_total', 'CSV rows parsed from uploads, by phone number validity.', ['outcome'])
+CSV_ROWS_SKIPPED = Counter('csv_rows_skipped_total', 'Valid CSV rows left out of a blast.', ['reason'])
+
+RESERVED_COLUMNS = ('phone_number', 'name', 'email')
+
+class IngestionStats:
+    def __init__(self):
+        self.rows = 0
+        self.associated = 0
+        self.created = 0
+        self.duplicates = 0
+        self.suppressed = 0
+        self.invalid_count = 0
+        self.invalid_sample = []
+
+    def as_dict(self):
+        return {
+            'rows': self.rows,
+            'associated': self.associated,
+            'created': self.created,
+            'duplicates': self.duplicates,
+            'suppressed': self.suppressed,
+            'invalid_count': self.invalid_count,
+        }
+
+def custom_fields_of(row):
+    return {k: v for k, v in row.items() if k not in RESERVED_COLUMNS}
+
+def upsert_recipients(by_phone):
+    """Create or update a Recipient for each `{phone_number: row}`.
+
+    Returns `(id, phone_number)` for every row and the number that were new.
+    """
+    existing = {
+        phone_number: (name, email, custom_fields)
+        for phone_number, name, email, custom_fields in db.session.execute(
+            select(Recipient.phone_number, Recipient.name, Recipient.email, Recipient.custom_fields)
+            .where(Recipient.phone_number.in_(list(by_phone)))
+        )
+    }
+
+    values = []
+    for phone_number, row in by_phone.items():
+        custom_fields = custom_fields_of(row)
+        if phone_number in existing:
+            name, email, existing_fields = existing[phone_number]
+            values.append({
+                'phone_number': phone_number,
+                'name': row.get('name', name),
+                'email': row.get('email', email),
+                'custom_fields': {**(existing_fields or {}), **custom_fields},
+            })
+        else:
+            values.append({
+                'phone_number': phone_number,
+                'name': row.get('name', ''),
+                'email': row.get('email', ''),
+                'custom_fields': custom_fields,
+            })
+
+    upsert = insert_for_dialect(Recipient).values(values)
+    upsert = upsert.on_conflict_do_update(
+        index_elements=[Recipient.phone_number],
+        set_={
+            'name': upsert.excluded.name,
+            'email': upsert.excluded.email,
+            'custom_fields': upsert.excluded.custom_fields,
+        }
+    ).returning(Recipient.id, Recipient.phone_number)
+    return db.session.execute(upsert).all(), len(by_phone) - len(existing)
+
+def ingest_chunk(blast_id, rows, seen, stats, suppressed=()):
+    # Rows arrive already validated by CsvStreamReader. Dedupe in memory first;
+    # `seen` spans the whole upload so a number that appears in two chunks
+    # still gets a single association. Suppressed numbers are counted and dropped.
+    by_phone = {}
+    for row in rows:
+        phone_number = row['phone_number']
+        if phone_number in seen or phone_number in by_phone:
+            stats.duplicates += 1
+            continue
+        if phone_number in suppressed:
+            stats.suppressed += 1
+            seen.add(phone_number)
+            continue
+        by_phone[phone_number] = row
+    if not by_phone:
+        return
+    seen.update(by_phone)
+
+    recipients, created = upsert_recipients(by_phone)
+    stats.created += created
+
+    associations = insert_for_dialect(RecipientBlastAssociation).values([
+        {'recipient_id': recipient_id, 'scheduled_blast_id': blast_id}
+        for recipient_id, _ in recipients
+    ]).on_conflict_do_nothing(
+        index_elements=[RecipientBlastAssociation.scheduled_blast_id, RecipientBlastAssociation.recipient_id]
+    )
+    db.session.execute(associations)
+    stats.associated += len(recipients)
+
+def ingest_csv_stream(blast_id, reader):
+    stats = IngestionStats()
+    seen = set()
+    suppressed = get_suppression_index()
+    for chunk in reader:
+        with DB_FLUSH_SECONDS.time(operation='ingest_chunk'):
+            ingest_chunk(blast_id, chunk, seen, stats, suppressed)
+        CSV_ROWS.inc(len(chunk), outcome='valid')
+    stats.rows = reader.rows_read
+    stats.invalid_count = reader.invalid_count
+    stats.invalid_sample = reader.invalid_sample
+    CSV_ROWS.inc(stats.invalid_count, outcome='invalid')
+    CSV_ROWS_SKIPPED.inc(stats.duplicates, reason='duplicate')
+    CSV_ROWS_SKIPPED.inc(stats.suppressed, reason='suppressed')
+    logger.info(f"Ingestion for ScheduledBlast ID {blast_id}: {stats.as_dict()}")
+    return stats
@@ -0,0 +1,211 @@
+import os
+import socket
+import time
+import threading
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import func, update, or_, and_
+from models import Job, db
+
+logger = logging.getLogger(__name__)
+
+WORKER_POLL_INTERVAL = float(os.environ.get("WORKER_POLL_INTERVAL", "1"))
+# A running job whose worker hasn't heartbeated for this long is claimed again
+JOB_LEASE_SECONDS = float(os.environ.get("JOB_LEASE_SECONDS", "120"))
+JOB_HEARTBEAT_INTERVAL = float(os.environ.get("JOB_HEARTBEAT_INTERVAL", "15"))
+# Claims after which a job that keeps killing its worker is failed instead of run
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", "3"))
+
+JOB_HANDLERS = {}
+# Called with a job that is given up after JOB_MAX_ATTEMPTS, so its blast
+# doesn't stay in an in-between status
+JOB_ABANDON_HANDLERS = {}
+# Called with the worker id when no job is due, e.g. to help send another
+# worker's blast; each returns True when it found work
+IDLE_HANDLERS = []
+
+def job_handler(kind, on_abandon=None):
+    def decorator(func):
+        JOB_HANDLERS[kind] = func
+        if on_abandon is not None:
+            JOB_ABANDON_HANDLERS[kind] = on_abandon
+        return func
+    return decorator
+
+def idle_handler(func):
+    IDLE_HANDLERS.append(func)
+    return func
+
+class Heartbeat:
+    """Calls `beat()` every `interval` seconds on a daemon thread with its own
+    app context and session, for as long as the `with` block runs. `beat`
+    returns False once the lease it renews has been taken over."""
+
+    def __init__(self, app, interval, beat, name='heartbeat'):
+        self.app = app
+        self.interval = interval
+        self.beat = beat
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            with self.app.app_context():
+                try:
+                    if self.beat() is False:
+                        self.lost = True
+                    db.session.commit()
+                except Exception as e:
+                    # A missed beat is retried next interval; the lease has room for several
+                    db.session.rollback()
+                    logger.warning(f"Heartbeat failed: {str(e)}")
+                finally:
+                    db.session.remove()
+
+def enqueue_job(kind, payload=None, user_id=None, scheduled_blast_id=None, run_at=None):
+    job = Job(
+        kind=kind,
+        payload=payload or {},
+        status='queued',
+        user_id=user_id,
+        scheduled_blast_id=scheduled_blast_id,
+        run_at=run_at or datetime.utcnow()
+    )
+    db.session.add(job)
+    return job
+
+def lease_cutoff(now=None):
+    return (now or datetime.utcnow()) - timedelta(seconds=JOB_LEASE_SECONDS)
+
+def live_job_filter(now=None):
+    """Jobs still waiting or held by a worker that is alive; a 'running' job
+    past its lease is only waiting to be claimed again."""
+    return or_(Job.status == 'queued',
+               and_(Job.status == 'running', Job.heartbeat_at >= lease_cutoff(now)))
+
+def supersede_stale_jobs(blast_id, kind):
+    # Keeps an expired job from being reclaimed next to the one queued to replace it
+    return db.session.execute(
+        update(Job)
+        .where(Job.scheduled_blast_id == blast_id, Job.kind == kind, Job.status == 'running',
+               Job.heartbeat_at < lease_cutoff())
+        .values(status='failed', error='Lease expired; replaced by a new job', finished_at=datetime.utcnow())
+    ).rowcount
+
+def _claimable(now):
+    return or_(and_(Job.status == 'queued', Job.run_at <= now),
+               and_(Job.status == 'running', Job.heartbeat_at < lease_cutoff(now)))
+
+def claim_next_job(worker_id):
+    # SKIP LOCKED keeps concurrent workers off each other's rows on Postgres; the
+    # conditional UPDATE below is what actually guarantees a single owner (and is
+    # the only guard on SQLite, which ignores FOR UPDATE).
+    # Due jobs come off the (status, run_at) index, so jobs waiting weeks
+    # for their run_at cost nothing to skip. Running jobs whose worker died
+    # are claimed again once their lease runs out.
+    now = datetime.utcnow()
+    candidate = (Job.query
+                 .filter(_claimable(now), Job.kind.in_(list(JOB_HANDLERS)))
+                 .order_by(Job.run_at, Job.id)
+                 .with_for_update(skip_locked=True)
+                 .first())
+    if candidate is None:
+        db.session.rollback()
+        return None
+
+    claimed = (Job.query
+               .filter(Job.id == candidate.id, _claimable(now))
+               .update({
+                   'status': 'running',
+                   'locked_by': worker_id,
+                   'started_at': now,
+                   'heartbeat_at': now,
+                   'attempts': Job.attempts + 1
+               }, synchronize_session=False))
+    db.session.commit()
+    if not claimed:
+        return None
+    job = db.session.get(Job, candidate.id, populate_existing=True)
+    if job.attempts > 1:
+        logger.warning(f"Job {job.id} ({job.kind}) claimed again after its lease expired (attempt {job.attempts})")
+    return job
+
+def seconds_until_next_job():
+    next_run_at = db.session.execute(
+        db.select(func.min(Job.run_at)).where(Job.status == 'queued', Job.kind.in_(list(JOB_HANDLERS)))
+    ).scalar()
+    db.session.rollback()
+    if next_run_at is None:
+        return None
+    return max(0.0, (next_run_at - datetime.utcnow()).total_seconds())
+
+def update_job_progress(job, done, total=None):
+    job.progress_done = done
+    if total is not None:
+        job.progress_total = total
+    db.session.commit()
+
+def _settle_job(job_id, attempt, **values):
+    # Fenced by the attempt number, so a worker whose job was reclaimed can't overwrite the new run
+    settled = db.session.execute(
+        update(Job).where(Job.id == job_id, Job.attempts == attempt)
+        .values(finished_at=datetime.utcnow(), **values)
+    ).rowcount
+    db.session.commit()
+    return settled
+
+def run_job(job, app):
+    handler = JOB_HANDLERS[job.kind]
+    job_id, kind, attempt = job.id, job.kind, job.attempts
+
+    def beat():
+        return db.session.execute(
+            update(Job).where(Job.id == job_id, Job.status == 'running', Job.attempts == attempt)
+            .values(heartbeat_at=datetime.utcnow())
+        ).rowcount > 0
+
+    try:
+        if attempt > JOB_MAX_ATTEMPTS:
+            abandon = JOB_ABANDON_HANDLERS.get(kind)
+            if abandon is not None:
+                abandon(job)
+            raise RuntimeError(f"Gave up after {JOB_MAX_ATTEMPTS} attempts")
+        with Heartbeat(app, JOB_HEARTBEAT_INTERVAL, beat, name=f'job-{job_id}-heartbeat'):
+            handler(job)
+        db.session.commit()
+        if _settle_job(job_id, attempt, status='done'):
+            logger.info(f"Job {job_id} ({kind}) finished")
+        else:
+            logger.warning(f"Job {job_id} ({kind}) finished after another worker took it over")
+    except Exception as e:
+        db.session.rollback()
+        _settle_job(job_id, attempt, status='failed', error=str(e))
+        logger.exception(f"Job {job_id} ({kind}) failed: {str(e)}")
+
+def run_worker(app, once=False):
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    logger.info(f"Worker {worker_id} started, handling: {', '.join(sorted(JOB_HANDLERS))}")
+    while True:
+        wait = 0
+        with app.app_context():
+            job = claim_next_job(worker_id)
+            if job is not None:
+                run_job(job, app)
+            elif not any(handler(worker_id) for handler in IDLE_HANDLERS):
+                # Wake early when a delayed job comes due before the next poll
+                next_due = seconds_until_next_job()
+                wait = WORKER_POLL_INTERVAL if next_due is None else min(WORKER_POLL_INTERVAL, next_due)
+            db.session.remove()
+        if once:
+            return
+        if wait:
+            time.sleep(wait)
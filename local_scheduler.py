@@ -0,0 +1,56 @@
+import os
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import update
+from models import Job, db
+from job_queue import enqueue_job
+from dispatch_planner import TWILIO_SCHEDULE_WINDOW, reconcile_scheduled_count
+
+logger = logging.getLogger(__name__)
+
+# How far ahead a blast may be scheduled when it is held locally
+LOCAL_SCHEDULE_MAX_DAYS = int(os.environ.get("LOCAL_SCHEDULE_MAX_DAYS", "90"))
+# 'twilio': release held blasts to Twilio scheduling once inside its window.
+# 'direct': keep them until the scheduled time and send immediately.
+# Local-time blasts are always released in 'twilio' mode, since every
+# timezone needs its own send_at.
+LOCAL_SCHEDULER_MODE = os.environ.get("LOCAL_SCHEDULER_MODE", "twilio")
+# Released this long before Twilio's window closes, leaving room for staggered chunks
+LOCAL_RELEASE_MARGIN = timedelta(hours=float(os.environ.get("LOCAL_RELEASE_MARGIN_HOURS", "24")))
+
+def needs_local_hold(scheduled_time, now):
+    return scheduled_time > now + TWILIO_SCHEDULE_WINDOW
+
+def release_time(scheduled_time, mode=LOCAL_SCHEDULER_MODE):
+    if mode == 'direct':
+        return scheduled_time
+    return scheduled_time - TWILIO_SCHEDULE_WINDOW + LOCAL_RELEASE_MARGIN
+
+def hold_blast(blast, user_id, mode=LOCAL_SCHEDULER_MODE, first_send_at=None):
+    """Park `blast` in the database until its release job comes due.
+
+    `first_send_at` is when a local-time blast's earliest timezone is due;
+    the release is timed so that one is still inside Twilio's window.
+    """
+    blast.status = 'held'
+    if blast.local_time:
+        mode = 'twilio'
+    run_at = release_time(first_send_at or blast.scheduled_time, mode)
+    job = enqueue_job('release_blast', {'send_mode': mode}, user_id=user_id,
+                      scheduled_blast_id=blast.id, run_at=run_at)
+    logger.info(f"Holding ScheduledBlast ID {blast.id} until {run_at} ({mode})")
+    return job
+
+def cancel_held_blast(blast):
+    # Only a release job that no worker has claimed yet can be withdrawn;
+    # the conditional UPDATE loses cleanly against a concurrent claim.
+    withdrawn = db.session.execute(
+        update(Job)
+        .where(Job.scheduled_blast_id == blast.id, Job.kind == 'release_blast', Job.status == 'queued')
+        .values(status='canceled', finished_at=datetime.utcnow())
+    ).rowcount
+    if withdrawn:
+        # Same bookkeeping as a cancel job settling the blast
+        blast.status = 'canceled'
+        reconcile_scheduled_count(blast.id)
+    return bool(withdrawn)
@@ -1,46 +1,154 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
 from flask_login import login_required, current_user
-from models import ScheduledBlast, Recipient, RecipientBlastAssociation, db
-from twilio_integration import schedule_twilio_message, cancel_twilio_message
-from io import StringIO
-import csv
+from models import ScheduledBlast, RecipientBlastAssociation, RecipientList, CsvValidation, Job, db
+from sqlalchemy import func, tuple_
+from sqlalchemy.orm import selectinload
+from job_queue import enqueue_job, live_job_filter, supersede_stale_jobs
+from uploads import store_upload
+from csv_stream import read_csv_preview
+from csv_validation import request_validation, validation_status
+from dead_letters import pending_dead_letter_counts
+from dispatch_planner import outstanding_scheduled_messages, TWILIO_SCHEDULED_MESSAGE_LIMIT
+from local_scheduler import needs_local_hold, cancel_held_blast, LOCAL_SCHEDULE_MAX_DAYS
+from recipient_lists import user_lists, get_or_create_list
 from datetime import datetime, timedelta
 import pytz
-from app import app
 import re
 import logging
-import json
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 message_scheduler = Blueprint('message_scheduler', __name__)
 
+CSV_PREVIEW_ROWS = 5
+
+DASHBOARD_PAGE_SIZE = 25
+
+STATUS_COLORS = {
+    'queued': 'info',
+    'held': 'info',
+    'dispatching': 'info',
+    'scheduled': 'primary',
+    'sent': 'success',
+    'canceling': 'warning',
+    'partially_canceled': 'warning',
+    'canceled': 'danger',
+    'failed': 'warning'
+}
+
+# 'canceling' is included so a cancellation can be started again once the
+# worker running it has died and its job's lease has run out
+CANCELABLE_BLAST_STATUSES = ['held', 'scheduled', 'canceling', 'partially_canceled']
+# 'failed' covers blasts whose every message was dead-lettered
+REPLAYABLE_BLAST_STATUSES = ['scheduled', 'sent', 'failed']
+
 def is_valid_phone_number(phone_number):
     pattern = r'^\+[1-9]\d{1,14}$'
     return re.match(pattern, phone_number) is not None
 
+def parse_dashboard_filters(args):
+    filters = {'status': args.get('status') or None, 'date_from': None, 'date_to': None}
+    for key in ('date_from', 'date_to'):
+        value = args.get(key)
+        if value:
+            try:
+                filters[key] = datetime.strptime(value, '%Y-%m-%d')
+            except ValueError:
+                pass
+    return filters
+
+def parse_cursor(cursor):
+    try:
+        scheduled_time, blast_id = cursor.rsplit('|', 1)
+        return datetime.fromisoformat(scheduled_time), int(blast_id)
+    except (AttributeError, ValueError):
+        return None
+
+def make_cursor(blast):
+    return f"{blast.scheduled_time.isoformat()}|{blast.id}"
+
+def dashboard_page(user_id, filters, cursor=None, page_size=DASHBOARD_PAGE_SIZE):
+    # One round-trip for the page: blasts with their recipient counts, walked
+    # newest first by (scheduled_time, id) so deep pages cost the same as the first.
+    query = (db.session.query(ScheduledBlast, func.count(RecipientBlastAssociation.id))
+             .outerjoin(RecipientBlastAssociation,
+                        RecipientBlastAssociation.scheduled_blast_id == ScheduledBlast.id)
+             .filter(ScheduledBlast.user_id == user_id)
+             .options(selectinload(ScheduledBlast.recipient_list)))
+    if filters['status']:
+        query = query.filter(ScheduledBlast.status == filters['status'])
+    if filters['date_from']:
+        query = query.filter(ScheduledBlast.scheduled_time >= filters['date_from'])
+    if filters['date_to']:
+        query = query.filter(ScheduledBlast.scheduled_time < filters['date_to'] + timedelta(days=1))
+    if cursor:
+        query = query.filter(tuple_(ScheduledBlast.scheduled_time, ScheduledBlast.id) < cursor)
+    rows = (query
+            .group_by(ScheduledBlast.id)
+            .order_by(ScheduledBlast.scheduled_time.desc(), ScheduledBlast.id.desc())
+            .limit(page_size + 1)
+            .all())
+
+    blasts = []
+    for blast, recipient_count in rows[:page_size]:
+        blast.recipient_count = recipient_count
+        blasts.append(blast)
+    next_cursor = make_cursor(blasts[-1]) if len(rows) > page_size else None
+    return blasts, next_cursor
+
 @message_scheduler.route('/dashboard')
 @login_required
 def dashboard():
-    scheduled_blasts = ScheduledBlast.query.filter_by(user_id=current_user.id).all()
+    filters = parse_dashboard_filters(request.args)
+    scheduled_blasts, next_cursor = dashboard_page(current_user.id, filters, parse_cursor(request.args.get('cursor')))
+    jobs = {}
+    if scheduled_blasts:
+        for job in (Job.query
+                    .filter(Job.scheduled_blast_id.in_([blast.id for blast in scheduled_blasts]))
+                    .order_by(Job.id)):
+            jobs[job.scheduled_blast_id] = job
+    dead_letter_counts = pending_dead_letter_counts([blast.id for blast in scheduled_blasts])
     for blast in scheduled_blasts:
-        blast.recipient_count = len(blast.recipient_associations)
-        blast.status_color = {
-            'scheduled': 'primary',
-            'sent': 'success',
-            'canceled': 'danger',
-            'failed': 'warning'
-        }.get(blast.status, 'secondary')
-    return render_template('dashboard.html', scheduled_blasts=scheduled_blasts)
+        blast.job = jobs.get(blast.id)
+        blast.dead_letter_count = dead_letter_counts.get(blast.id, 0)
+        blast.cancelable = blast.status in CANCELABLE_BLAST_STATUSES
+        blast.replayable = bool(blast.dead_letter_count) and blast.status in REPLAYABLE_BLAST_STATUSES
+        blast.status_color = STATUS_COLORS.get(blast.status, 'secondary')
+    return render_template('dashboard.html',
+                           scheduled_blasts=scheduled_blasts,
+                           next_cursor=next_cursor,
+                           filters=request.args,
+                           statuses=list(STATUS_COLORS))
 
 @message_scheduler.route('/schedule_blast', methods=['GET', 'POST'])
 @login_required
 def schedule_blast():
     if request.method == 'POST':
-        csv_file = request.files['csv_file']
+        csv_file = request.files.get('csv_file')
+        if csv_file is not None and not csv_file.filename:
+            csv_file = None
+        list_id = request.form.get('recipient_list_id', type=int)
+        list_name = (request.form.get('list_name') or '').strip()
+        recipient_list = None
+        if list_id:
+            recipient_list = RecipientList.query.filter_by(id=list_id, user_id=current_user.id).first()
+            if recipient_list is None:
+                flash('Recipient list not found.', 'danger')
+                return redirect(url_for('message_scheduler.schedule_blast'))
+        if len(list_name) > 100:
+            flash('Recipient list names can be at most 100 characters.', 'danger')
+            return redirect(url_for('message_scheduler.schedule_blast'))
+        if recipient_list is not None and list_name:
+            flash('Choose an existing recipient list or name a new one, not both.', 'danger')
+            return redirect(url_for('message_scheduler.schedule_blast'))
+        if csv_file is None and recipient_list is None:
+            flash('Upload a CSV file or choose a saved recipient list.', 'danger')
+            return redirect(url_for('message_scheduler.schedule_blast'))
         message_template = request.form['message_template']
         mms_url = request.form.get('mms_url')
+        local_time = bool(request.form.get('local_time'))
+        timezone_column = (request.form.get('timezone_column') or '').strip() or None
         scheduled_time = datetime.strptime(request.form['scheduled_time'], '%Y-%m-%dT%H:%M')
         
         eastern = pytz.timezone('US/Eastern')
@@ -52,77 +160,48 @@ def schedule_blast():
             flash('Scheduled time must be at least 15 minutes in the future.', 'danger')
             return redirect(url_for('message_scheduler.schedule_blast'))
 
-        if scheduled_time_utc > now_utc + timedelta(days=7):
-            flash('Scheduled time must be within 7 days from now.', 'danger')
+        if scheduled_time_utc > now_utc + timedelta(days=LOCAL_SCHEDULE_MAX_DAYS):
+            flash(f'Scheduled time must be within {LOCAL_SCHEDULE_MAX_DAYS} days from now.', 'danger')
             return redirect(url_for('message_scheduler.schedule_blast'))
 
-        try:
-            csv_content = csv_file.read().decode('utf-8')
-            csv_data = csv.DictReader(StringIO(csv_content))
-            
-            if 'phone_number' not in csv_data.fieldnames:
+        # Beyond Twilio's window the blast is held locally and released later
+        hold = needs_local_hold(scheduled_time_utc, now_utc)
+        if not hold and outstanding_scheduled_messages() >= TWILIO_SCHEDULED_MESSAGE_LIMIT:
+            flash(f'The account already has {TWILIO_SCHEDULED_MESSAGE_LIMIT} messages scheduled. '
+                  'Wait for earlier blasts to go out or cancel one first.', 'danger')
+            return redirect(url_for('message_scheduler.schedule_blast'))
+
+        # Only the header is read here; the job hashes the whole file to
+        # find a cached /validate_csv scan of it
+        if csv_file is not None:
+            if 'phone_number' not in read_csv_preview(csv_file.stream, max_rows=0)['headers']:
                 flash('CSV file must contain a "phone_number" column.', 'danger')
                 return redirect(url_for('message_scheduler.schedule_blast'))
+            csv_file.stream.seek(0)
+        try:
+            if list_name:
+                # An existing name means this upload is the list's new version
+                recipient_list = get_or_create_list(current_user.id, list_name)
 
             new_blast = ScheduledBlast(
                 user_id=current_user.id,
                 message_template=message_template,
                 mms_url=mms_url,
                 scheduled_time=scheduled_time_utc,
-                status='scheduled'
+                local_time=local_time,
+                timezone_column=timezone_column if local_time else None,
+                recipient_list_id=recipient_list.id if recipient_list else None,
+                status='queued'
             )
             db.session.add(new_blast)
             db.session.flush()
-            logger.info(f"Created new ScheduledBlast with ID: {new_blast.id}")
-
-            invalid_phone_numbers = []
-            for row in csv_data:
-                phone_number = row.get('phone_number', '').strip()
-                if not phone_number or not is_valid_phone_number(phone_number):
-                    invalid_phone_numbers.append(phone_number)
-                    continue
-
-                recipient = Recipient.query.filter_by(phone_number=phone_number).first()
-                if not recipient:
-                    recipient = Recipient(
-                        phone_number=phone_number,
-                        name=row.get('name', ''),
-                        email=row.get('email', ''),
-                        custom_fields={k: v for k, v in row.items() if k not in ['phone_number', 'name', 'email']}
-                    )
-                    db.session.add(recipient)
-                    logger.info(f"Created new Recipient with phone number: {phone_number}")
-                else:
-                    recipient.name = row.get('name', recipient.name)
-                    recipient.email = row.get('email', recipient.email)
-                    recipient.custom_fields.update({k: v for k, v in row.items() if k not in ['phone_number', 'name', 'email']})
-                    logger.info(f"Updated existing Recipient with phone number: {phone_number}")
-
-                db.session.flush()
-
-                association = RecipientBlastAssociation(
-                    recipient_id=recipient.id,
-                    scheduled_blast_id=new_blast.id
-                )
-                db.session.add(association)
-                logger.info(f"Created RecipientBlastAssociation for Recipient ID: {recipient.id} and ScheduledBlast ID: {new_blast.id}")
-
-            if invalid_phone_numbers:
-                flash(f'The following phone numbers are invalid and were skipped: {", ".join(invalid_phone_numbers)}', 'warning')
-
+            # Stored in the database, in the same transaction, so any worker can read it
+            upload_id = store_upload(csv_file.stream) if csv_file is not None else None
+            job = enqueue_job('schedule_blast', {'upload_id': upload_id, 'hold': hold},
+                              user_id=current_user.id, scheduled_blast_id=new_blast.id)
             db.session.commit()
-            logger.info(f"Committed changes to database for ScheduledBlast ID: {new_blast.id}")
-
-            twilio_message_sids = schedule_twilio_message(new_blast)
-            if twilio_message_sids:
-                new_blast.twilio_message_sid = twilio_message_sids
-                db.session.commit()
-                flash('Message blast scheduled successfully!', 'success')
-                logger.info(f"Successfully scheduled Twilio messages for ScheduledBlast ID: {new_blast.id}")
-            else:
-                db.session.rollback()
-                flash('Failed to schedule message blast with Twilio.', 'danger')
-                logger.error(f"Failed to schedule Twilio messages for ScheduledBlast ID: {new_blast.id}")
+            flash('Message blast queued. Progress is shown on the dashboard.', 'success')
+            logger.info(f"Queued job {job.id} for ScheduledBlast ID: {new_blast.id}")
         except Exception as e:
             db.session.rollback()
             flash(f'Error scheduling message blast: {str(e)}', 'danger')
@@ -130,7 +209,8 @@ def schedule_blast():
 
         return redirect(url_for('message_scheduler.dashboard'))
 
-    return render_template('schedule_blast.html')
+    return render_template('schedule_blast.html', max_days=LOCAL_SCHEDULE_MAX_DAYS,
+                           recipient_lists=user_lists(current_user.id))
 
 @message_scheduler.route('/preview_csv', methods=['POST'])
 @login_required
@@ -138,14 +218,51 @@ def preview_csv():
     csv_file = request.files.get('csv_file')
     if csv_file:
         try:
-            csv_content = csv_file.read().decode('utf-8')
-            csv_data = csv.DictReader(StringIO(csv_content))
-            headers = csv_data.fieldnames
-            return jsonify({'headers': headers})
+            preview = read_csv_preview(csv_file.stream, max_rows=CSV_PREVIEW_ROWS)
+            return jsonify(preview)
         except Exception as e:
             return jsonify({'error': str(e)}), 400
     return jsonify({'error': 'No CSV file provided'}), 400
 
+@message_scheduler.route('/validate_csv', methods=['POST'])
+@login_required
+def validate_csv():
+    csv_file = request.files.get('csv_file')
+    if not csv_file or not csv_file.filename:
+        return jsonify({'error': 'No CSV file provided'}), 400
+    validation = request_validation(current_user.id, csv_file.stream, request.form.get('message_template', ''))
+    db.session.commit()
+    status = validation_status(validation)
+    return jsonify(status), 200 if status['status'] == 'done' else 202
+
+@message_scheduler.route('/validate_csv/<int:validation_id>')
+@login_required
+def validation_result(validation_id):
+    validation = db.session.get(CsvValidation, validation_id)
+    if validation is None or validation.user_id != current_user.id:
+        return jsonify({'error': 'Not found'}), 404
+    status = validation_status(validation)
+    return jsonify(status), 200 if status['status'] == 'done' else 202
+
+@message_scheduler.route('/jobs/<int:job_id>')
+@login_required
+def job_status(job_id):
+    job = Job.query.get_or_404(job_id)
+    if job.user_id != current_user.id:
+        return jsonify({'error': 'Not found'}), 404
+    return jsonify({
+        'id': job.id,
+        'status': job.status,
+        'progress_done': job.progress_done,
+        'progress_total': job.progress_total,
+        'label': job.progress_label,
+        'blast_status': job.scheduled_blast.status if job.scheduled_blast else None,
+        'estimate': (job.payload or {}).get('estimate'),
+        'skipped': {key: (job.payload or {}).get(key) for key in ('duplicates', 'suppressed', 'invalid_count')},
+        'list_delta': {key: (job.payload or {}).get(f'list_{key}') for key in ('added', 'changed', 'removed', 'unchanged')},
+        'error': job.error
+    })
+
 @message_scheduler.route('/cancel_blast/<int:blast_id>', methods=['POST'])
 @login_required
 def cancel_blast(blast_id):
@@ -154,18 +271,54 @@ def cancel_blast(blast_id):
         flash('You are not authorized to cancel this blast.', 'danger')
         return redirect(url_for('message_scheduler.dashboard'))
     
-    if blast.status == 'scheduled':
-        if cancel_twilio_message(blast.twilio_message_sid):
-            blast.status = 'canceled'
-            db.session.commit()
-            flash('Message blast canceled successfully.', 'success')
-            logger.info(f"Successfully canceled ScheduledBlast ID: {blast_id}")
+    if blast.status == 'held':
+        if cancel_held_blast(blast):
+            flash('Message blast canceled before it was sent to Twilio.', 'success')
+            logger.info(f"Canceled held ScheduledBlast ID: {blast_id}")
+        else:
+            flash('This blast is being released to Twilio right now. Try again in a moment.', 'info')
+        db.session.commit()
+    elif blast.status in CANCELABLE_BLAST_STATUSES:
+        active_job = (Job.query
+                      .filter(Job.scheduled_blast_id == blast.id,
+                              Job.kind == 'cancel_blast',
+                              live_job_filter())
+                      .first())
+        if active_job:
+            flash('Cancellation is already in progress for this blast.', 'info')
         else:
-            flash('Failed to cancel the message blast with Twilio.', 'danger')
-            logger.error(f"Failed to cancel ScheduledBlast ID: {blast_id} with Twilio")
+            supersede_stale_jobs(blast.id, 'cancel_blast')
+            blast.status = 'canceling'
+            job = enqueue_job('cancel_blast', user_id=current_user.id, scheduled_blast_id=blast.id)
+            db.session.commit()
+            flash('Cancellation started. Progress is shown on the dashboard.', 'success')
+            logger.info(f"Queued cancel job {job.id} for ScheduledBlast ID: {blast_id}")
     else:
         flash('This blast cannot be canceled.', 'warning')
     
     return redirect(url_for('message_scheduler.dashboard'))
 
-app.register_blueprint(message_scheduler)
+@message_scheduler.route('/replay_failed/<int:blast_id>', methods=['POST'])
+@login_required
+def replay_failed(blast_id):
+    blast = ScheduledBlast.query.get_or_404(blast_id)
+    if blast.user_id != current_user.id:
+        flash('You are not authorized to modify this blast.', 'danger')
+        return redirect(url_for('message_scheduler.dashboard'))
+
+    active_job = (Job.query
+                  .filter(Job.scheduled_blast_id == blast.id,
+                          live_job_filter())
+                  .first())
+    if active_job:
+        flash('Another job is still running for this blast.', 'info')
+    elif blast.status not in REPLAYABLE_BLAST_STATUSES or not pending_dead_letter_counts([blast.id]):
+        flash('This blast has no failed messages that can be resent.', 'warning')
+    else:
+        supersede_stale_jobs(blast.id, 'replay_dead_letters')
+        job = enqueue_job('replay_dead_letters', user_id=current_user.id, scheduled_blast_id=blast.id)
+        db.session.commit()
+        flash('Resending failed messages. Progress is shown on the dashboard.', 'success')
+        logger.info(f"Queued dead-letter replay job {job.id} for ScheduledBlast ID: {blast_id}")
+
+    return redirect(url_for('message_scheduler.dashboard'))
@@ -0,0 +1,166 @@
+import os
+import math
+from string import Formatter
+
+# Price per outbound SMS segment, used only for pre-dispatch cost estimates
+SMS_SEGMENT_PRICE = float(os.environ.get("SMS_SEGMENT_PRICE", "0.0079"))
+
+# GSM 03.38 basic character set plus the extension table (each extension
+# character costs two septets).
+GSM7_BASIC = set(
+    "@£$¥èéùìòÇ\nØø\rÅåΔ_ΦΓΛΩΠΨΣΘΞÆæßÉ !\"#¤%&'()*+,-./0123456789:;<=>?"
+    "¡ABCDEFGHIJKLMNOPQRSTUVWXYZÄÖÑÜ§¿abcdefghijklmnopqrstuvwxyzäöñüà"
+)
+GSM7_EXTENDED = set("^{}\\[~]|€\f")
+
+GSM7_SINGLE_SEGMENT = 160
+GSM7_MULTI_SEGMENT = 153
+UCS2_SINGLE_SEGMENT = 70
+UCS2_MULTI_SEGMENT = 67
+
+DEFAULT_SEPARATOR = '|'
+
+def sms_encoding(text):
+    for char in text:
+        if char not in GSM7_BASIC and char not in GSM7_EXTENDED:
+            return 'UCS-2'
+    return 'GSM-7'
+
+def sms_length(text, encoding=None):
+    encoding = encoding or sms_encoding(text)
+    if encoding == 'GSM-7':
+        return sum(2 if char in GSM7_EXTENDED else 1 for char in text)
+    # UCS-2 is counted in UTF-16 code units, so astral characters take two
+    return len(text.encode('utf-16-le')) // 2
+
+def sms_segments(text):
+    encoding = sms_encoding(text)
+    length = sms_length(text, encoding)
+    if encoding == 'GSM-7':
+        single, multi = GSM7_SINGLE_SEGMENT, GSM7_MULTI_SEGMENT
+    else:
+        single, multi = UCS2_SINGLE_SEGMENT, UCS2_MULTI_SEGMENT
+    segments = 1 if length <= single else math.ceil(length / multi)
+    return encoding, length, segments
+
+class RenderedMessage:
+    def __init__(self, recipient_id, phone_number, body):
+        self.recipient_id = recipient_id
+        self.phone_number = phone_number
+        self.body = body
+        self.encoding, self.length, self.segments = sms_segments(body)
+
+class CompiledTemplate:
+    """A message template parsed once into literal text and field lookups.
+
+    Placeholders use `str.format` syntax. `{field|default}` renders `default`
+    when the recipient has no value for `field`; unknown fields without a
+    default render as an empty string instead of failing the message. Fields
+    are looked up in the recipient's `custom_fields` first, then in its
+    `phone_number`, `name` and `email` columns.
+    """
+
+    def __init__(self, template):
+        self.template = template
+        self.parts = []
+        self.fields = []
+        for literal, field_name, format_spec, conversion in Formatter().parse(template):
+            if literal:
+                self.parts.append((literal, None, None, None, None))
+            if field_name is None:
+                continue
+            name, _, default = field_name.partition(DEFAULT_SEPARATOR)
+            name = name.strip()
+            self.fields.append(name)
+            self.parts.append((None, name, default, format_spec, conversion))
+
+    def render_values(self, values):
+        out = []
+        for literal, name, default, format_spec, conversion in self.parts:
+            if literal is not None:
+                out.append(literal)
+                continue
+            value = values.get(name)
+            if value is None or value == '':
+                out.append(default)
+                continue
+            if conversion == 'r':
+                value = repr(value)
+            elif conversion == 'a':
+                value = ascii(value)
+            elif conversion == 's':
+                value = str(value)
+            out.append(format(value, format_spec) if format_spec else str(value))
+        return ''.join(out)
+
+    def render(self, recipient):
+        values = {
+            'phone_number': recipient.phone_number,
+            'name': recipient.name,
+            'email': recipient.email,
+        }
+        values.update(recipient.custom_fields or {})
+        return self.render_values(values)
+
+    def render_batch(self, recipients):
+        return [RenderedMessage(recipient.id, recipient.phone_number, self.render(recipient))
+                for recipient in recipients]
+
+    def missing_fields(self, columns):
+        available = set(columns) | {'phone_number', 'name', 'email'}
+        return sorted({name for name in self.fields if name not in available})
+
+    def coverage(self, columns, filled, rows):
+        """Per placeholder: whether the CSV has the column and how many of `rows`
+        will fall back to the default (or render empty) for lack of a value."""
+        coverage = {}
+        for _, name, default, _, _ in self.parts:
+            if name is None or name in coverage:
+                continue
+            coverage[name] = {
+                'column': name in columns,
+                'filled': min(filled.get(name, 0), rows),
+                'missing': rows - min(filled.get(name, 0), rows),
+                'default': default or None,
+            }
+        return coverage
+
+_compiled_templates = {}
+
+def compile_template(template):
+    compiled = _compiled_templates.get(template)
+    if compiled is None:
+        if len(_compiled_templates) >= 256:
+            _compiled_templates.clear()
+        compiled = _compiled_templates[template] = CompiledTemplate(template)
+    return compiled
+
+class SegmentTally:
+    def __init__(self):
+        self.totals = {'messages': 0, 'segments': 0, 'ucs2_messages': 0, 'max_length': 0}
+        # Templates without per-recipient fields render the same body every time
+        self._measured = {}
+
+    def add(self, body):
+        measured = self._measured.get(body)
+        if measured is None:
+            measured = sms_segments(body)
+            if len(self._measured) < 4096:
+                self._measured[body] = measured
+        encoding, length, segments = measured
+        totals = self.totals
+        totals['messages'] += 1
+        totals['segments'] += segments
+        totals['ucs2_messages'] += encoding == 'UCS-2'
+        totals['max_length'] = max(totals['max_length'], length)
+
+    def result(self):
+        return {**self.totals, 'estimated_cost': round(self.totals['segments'] * SMS_SEGMENT_PRICE, 4)}
+
+def estimate_segments(template, recipient_pages):
+    compiled = compile_template(template)
+    tally = SegmentTally()
+    for page in recipient_pages:
+        for recipient in page:
+            tally.add(compiled.render(recipient))
+    return tally.result()
@@ -0,0 +1,28 @@
+"""Add local_time and timezone_column to scheduled_blast
+
+Revision ID: 0b7e3d91c4a6
+Revises: f4c9b27e0d13
+Create Date: 2026-10-18 18:05:41.226390
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0b7e3d91c4a6'
+down_revision = 'f4c9b27e0d13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('scheduled_blast', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('local_time', sa.Boolean(), nullable=False, server_default=sa.false()))
+        batch_op.add_column(sa.Column('timezone_column', sa.String(length=64), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('scheduled_blast', schema=None) as batch_op:
+        batch_op.drop_column('timezone_column')
+        batch_op.drop_column('local_time')
@@ -0,0 +1,64 @@
+"""Add recipient_list and recipient_list_member tables
+
+Revision ID: 3c5f8a2d7e19
+Revises: 0b7e3d91c4a6
+Create Date: 2026-10-18 19:12:37.804515
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c5f8a2d7e19'
+down_revision = '0b7e3d91c4a6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('recipient_list',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=100), nullable=False),
+    sa.Column('member_count', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('recipient_list', schema=None) as batch_op:
+        batch_op.create_index('ix_recipient_list_user_name', ['user_id', 'name'], unique=True)
+
+    op.create_table('recipient_list_member',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('recipient_list_id', sa.Integer(), nullable=False),
+    sa.Column('recipient_id', sa.Integer(), nullable=False),
+    sa.Column('row_hash', sa.String(length=32), nullable=False),
+    sa.ForeignKeyConstraint(['recipient_id'], ['recipient.id'], ),
+    sa.ForeignKeyConstraint(['recipient_list_id'], ['recipient_list.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('recipient_list_member', schema=None) as batch_op:
+        batch_op.create_index('ix_recipient_list_member_list_recipient', ['recipient_list_id', 'recipient_id'], unique=True)
+
+    with op.batch_alter_table('scheduled_blast', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('recipient_list_id', sa.Integer(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_scheduled_blast_recipient_list_id'), ['recipient_list_id'], unique=False)
+        batch_op.create_foreign_key('fk_scheduled_blast_recipient_list_id', 'recipient_list', ['recipient_list_id'], ['id'])
+
+
+def downgrade():
+    with op.batch_alter_table('scheduled_blast', schema=None) as batch_op:
+        batch_op.drop_constraint('fk_scheduled_blast_recipient_list_id', type_='foreignkey')
+        batch_op.drop_index(batch_op.f('ix_scheduled_blast_recipient_list_id'))
+        batch_op.drop_column('recipient_list_id')
+
+    with op.batch_alter_table('recipient_list_member', schema=None) as batch_op:
+        batch_op.drop_index('ix_recipient_list_member_list_recipient')
+
+    op.drop_table('recipient_list_member')
+    with op.batch_alter_table('recipient_list', schema=None) as batch_op:
+        batch_op.drop_index('ix_recipient_list_user_name')
+
+    op.drop_table('recipient_list')
@@ -0,0 +1,28 @@
+"""Add ScheduledBlast(user_id, scheduled_time) index for the dashboard
+
+Revision ID: 5e92b8d4a017
+Revises: c3a7e5f18b20
+Create Date: 2026-10-18 12:40:09.117342
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e92b8d4a017'
+down_revision = 'c3a7e5f18b20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # RecipientBlastAssociation lookups by scheduled_blast_id are already served by
+    # the leading column of ix_recipient_blast_association_blast_recipient.
+    with op.batch_alter_table('scheduled_blast', schema=None) as batch_op:
+        batch_op.create_index('ix_scheduled_blast_user_scheduled_time', ['user_id', 'scheduled_time'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('scheduled_blast', schema=None) as batch_op:
+        batch_op.drop_index('ix_scheduled_blast_user_scheduled_time')
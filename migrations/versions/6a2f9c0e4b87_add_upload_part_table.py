@@ -0,0 +1,36 @@
+"""Add upload_part table so CSV uploads are readable from every worker host
+
+Revision ID: 6a2f9c0e4b87
+Revises: e5b9d3a7c142
+Create Date: 2026-10-21 10:12:40.583116
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6a2f9c0e4b87'
+down_revision = 'e5b9d3a7c142'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('upload_part',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('upload_id', sa.String(length=32), nullable=False),
+    sa.Column('seq', sa.Integer(), nullable=False),
+    sa.Column('data', sa.LargeBinary(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('upload_part', schema=None) as batch_op:
+        batch_op.create_index('ix_upload_part_upload_seq', ['upload_id', 'seq'], unique=True)
+
+
+def downgrade():
+    with op.batch_alter_table('upload_part', schema=None) as batch_op:
+        batch_op.drop_index('ix_upload_part_upload_seq')
+
+    op.drop_table('upload_part')
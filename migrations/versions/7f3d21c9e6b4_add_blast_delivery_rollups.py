@@ -0,0 +1,30 @@
+"""Add sent/delivered/failed rollup counters to ScheduledBlast
+
+Revision ID: 7f3d21c9e6b4
+Revises: 5e92b8d4a017
+Create Date: 2026-10-18 13:18:52.604410
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7f3d21c9e6b4'
+down_revision = '5e92b8d4a017'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('scheduled_blast', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('sent_count', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('delivered_count', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('failed_count', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('scheduled_blast', schema=None) as batch_op:
+        batch_op.drop_column('failed_count')
+        batch_op.drop_column('delivered_count')
+        batch_op.drop_column('sent_count')
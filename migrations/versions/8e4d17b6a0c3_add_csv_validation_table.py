@@ -0,0 +1,40 @@
+"""Add csv_validation table caching full-file upload checks
+
+Revision ID: 8e4d17b6a0c3
+Revises: 3c5f8a2d7e19
+Create Date: 2026-10-18 20:31:54.117208
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8e4d17b6a0c3'
+down_revision = '3c5f8a2d7e19'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('csv_validation',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('file_hash', sa.String(length=64), nullable=False),
+    sa.Column('template_hash', sa.String(length=64), nullable=False),
+    sa.Column('job_id', sa.Integer(), nullable=True),
+    sa.Column('result', sa.JSON(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['job_id'], ['job.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('csv_validation', schema=None) as batch_op:
+        batch_op.create_index('ix_csv_validation_user_file_template', ['user_id', 'file_hash', 'template_hash'], unique=True)
+
+
+def downgrade():
+    with op.batch_alter_table('csv_validation', schema=None) as batch_op:
+        batch_op.drop_index('ix_csv_validation_user_file_template')
+
+    op.drop_table('csv_validation')
@@ -0,0 +1,53 @@
+"""Unique index on Recipient.phone_number for bulk upserts
+
+Revision ID: 9d41f06a5c2e
+Revises: 4b8e2c71d9a3
+Create Date: 2026-10-18 10:02:47.905116
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d41f06a5c2e'
+down_revision = '4b8e2c71d9a3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Fold duplicate recipients into the oldest row for each phone number so the
+    # unique indexes can be created on existing data.
+    op.execute("""
+        UPDATE recipient_blast_association SET recipient_id = (
+            SELECT MIN(r2.id) FROM recipient r1
+            JOIN recipient r2 ON r2.phone_number = r1.phone_number
+            WHERE r1.id = recipient_blast_association.recipient_id
+        )
+    """)
+    op.execute("""
+        DELETE FROM recipient
+        WHERE id NOT IN (SELECT MIN(id) FROM recipient GROUP BY phone_number)
+    """)
+    op.execute("""
+        DELETE FROM recipient_blast_association
+        WHERE id NOT IN (
+            SELECT MIN(id) FROM recipient_blast_association
+            GROUP BY scheduled_blast_id, recipient_id
+        )
+    """)
+
+    with op.batch_alter_table('recipient', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_recipient_phone_number'), ['phone_number'], unique=True)
+
+    with op.batch_alter_table('recipient_blast_association', schema=None) as batch_op:
+        batch_op.create_index('ix_recipient_blast_association_blast_recipient', ['scheduled_blast_id', 'recipient_id'], unique=True)
+
+
+def downgrade():
+    with op.batch_alter_table('recipient_blast_association', schema=None) as batch_op:
+        batch_op.drop_index('ix_recipient_blast_association_blast_recipient')
+
+    with op.batch_alter_table('recipient', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_recipient_phone_number'))
@@ -0,0 +1,45 @@
+"""Add dead_letter table for permanently failed sends
+
+Revision ID: a6c0d94e3f71
+Revises: 7f3d21c9e6b4
+Create Date: 2026-10-18 14:05:31.772019
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a6c0d94e3f71'
+down_revision = '7f3d21c9e6b4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('dead_letter',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('scheduled_blast_id', sa.Integer(), nullable=False),
+    sa.Column('recipient_id', sa.Integer(), nullable=True),
+    sa.Column('phone_number', sa.String(length=20), nullable=False),
+    sa.Column('message_params', sa.JSON(), nullable=False),
+    sa.Column('error_code', sa.Integer(), nullable=True),
+    sa.Column('error_message', sa.Text(), nullable=True),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('permanent', sa.Boolean(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('replayed_at', sa.DateTime(), nullable=True),
+    sa.Column('replay_sid', sa.String(length=34), nullable=True),
+    sa.ForeignKeyConstraint(['recipient_id'], ['recipient.id'], ),
+    sa.ForeignKeyConstraint(['scheduled_blast_id'], ['scheduled_blast.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('dead_letter', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_dead_letter_scheduled_blast_id'), ['scheduled_blast_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('dead_letter', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_dead_letter_scheduled_blast_id'))
+
+    op.drop_table('dead_letter')
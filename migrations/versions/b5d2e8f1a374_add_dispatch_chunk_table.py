@@ -0,0 +1,53 @@
+"""Add dispatch_chunk table for leasing blast dispatch across workers
+
+Revision ID: b5d2e8f1a374
+Revises: 8e4d17b6a0c3
+Create Date: 2026-10-18 22:04:37.530196
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b5d2e8f1a374'
+down_revision = '8e4d17b6a0c3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('dispatch_chunk',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('scheduled_blast_id', sa.Integer(), nullable=False),
+    sa.Column('job_id', sa.Integer(), nullable=False),
+    sa.Column('seq', sa.Integer(), nullable=False),
+    sa.Column('first_recipient_id', sa.Integer(), nullable=False),
+    sa.Column('last_recipient_id', sa.Integer(), nullable=False),
+    sa.Column('messages', sa.Integer(), nullable=False),
+    sa.Column('first_index', sa.Integer(), nullable=False),
+    sa.Column('bucket_offsets', sa.JSON(), nullable=True),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('lease_owner', sa.String(length=64), nullable=True),
+    sa.Column('lease_expires_at', sa.DateTime(), nullable=True),
+    sa.Column('heartbeat_at', sa.DateTime(), nullable=True),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('dispatched', sa.Integer(), nullable=False),
+    sa.Column('succeeded', sa.Integer(), nullable=False),
+    sa.Column('error', sa.Text(), nullable=True),
+    sa.Column('finished_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['job_id'], ['job.id'], ),
+    sa.ForeignKeyConstraint(['scheduled_blast_id'], ['scheduled_blast.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('dispatch_chunk', schema=None) as batch_op:
+        batch_op.create_index('ix_dispatch_chunk_blast_seq', ['scheduled_blast_id', 'seq'], unique=True)
+        batch_op.create_index('ix_dispatch_chunk_status_lease', ['status', 'lease_expires_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('dispatch_chunk', schema=None) as batch_op:
+        batch_op.drop_index('ix_dispatch_chunk_status_lease')
+        batch_op.drop_index('ix_dispatch_chunk_blast_seq')
+
+    op.drop_table('dispatch_chunk')
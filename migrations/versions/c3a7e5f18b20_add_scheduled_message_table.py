@@ -0,0 +1,85 @@
+"""Add scheduled_message table and backfill from ScheduledBlast.twilio_message_sid
+
+Revision ID: c3a7e5f18b20
+Revises: 9d41f06a5c2e
+Create Date: 2026-10-18 11:26:14.530872
+
+"""
+from datetime import datetime
+import json
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3a7e5f18b20'
+down_revision = '9d41f06a5c2e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    scheduled_message = op.create_table('scheduled_message',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('scheduled_blast_id', sa.Integer(), nullable=False),
+    sa.Column('recipient_id', sa.Integer(), nullable=True),
+    sa.Column('twilio_sid', sa.String(length=34), nullable=True),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('error_code', sa.Integer(), nullable=True),
+    sa.Column('error_message', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['recipient_id'], ['recipient.id'], ),
+    sa.ForeignKeyConstraint(['scheduled_blast_id'], ['scheduled_blast.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('scheduled_message', schema=None) as batch_op:
+        batch_op.create_index('ix_scheduled_message_blast_recipient', ['scheduled_blast_id', 'recipient_id'], unique=True)
+        batch_op.create_index(batch_op.f('ix_scheduled_message_twilio_sid'), ['twilio_sid'], unique=True)
+
+    # The old JSON list does not record which recipient each SID belongs to,
+    # so backfilled rows keep recipient_id NULL.
+    connection = op.get_bind()
+    now = datetime.utcnow()
+    blasts = connection.execute(sa.text(
+        "SELECT id, status, twilio_message_sid FROM scheduled_blast WHERE twilio_message_sid IS NOT NULL"
+    ))
+    for blast_id, blast_status, sids_json in blasts.all():
+        try:
+            sids = json.loads(sids_json)
+        except ValueError:
+            sids = [sids_json]
+        status = 'canceled' if blast_status == 'canceled' else 'scheduled'
+        rows = [
+            {'scheduled_blast_id': blast_id, 'twilio_sid': sid, 'status': status,
+             'created_at': now, 'updated_at': now}
+            for sid in dict.fromkeys(sids) if sid
+        ]
+        if rows:
+            op.bulk_insert(scheduled_message, rows)
+
+    with op.batch_alter_table('scheduled_blast', schema=None) as batch_op:
+        batch_op.drop_column('twilio_message_sid')
+
+
+def downgrade():
+    with op.batch_alter_table('scheduled_blast', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('twilio_message_sid', sa.Text(), nullable=True))
+
+    connection = op.get_bind()
+    sids_by_blast = {}
+    for blast_id, sid in connection.execute(sa.text(
+        "SELECT scheduled_blast_id, twilio_sid FROM scheduled_message WHERE twilio_sid IS NOT NULL ORDER BY id"
+    )):
+        sids_by_blast.setdefault(blast_id, []).append(sid)
+    for blast_id, sids in sids_by_blast.items():
+        connection.execute(
+            sa.text("UPDATE scheduled_blast SET twilio_message_sid = :sids WHERE id = :id"),
+            {'sids': json.dumps(sids), 'id': blast_id}
+        )
+
+    with op.batch_alter_table('scheduled_message', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_scheduled_message_twilio_sid'))
+        batch_op.drop_index('ix_scheduled_message_blast_recipient')
+
+    op.drop_table('scheduled_message')
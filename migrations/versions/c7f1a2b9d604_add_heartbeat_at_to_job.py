@@ -0,0 +1,29 @@
+"""Add heartbeat_at to job so jobs of dead workers can be claimed again
+
+Revision ID: c7f1a2b9d604
+Revises: b5d2e8f1a374
+Create Date: 2026-10-19 10:12:08.341925
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7f1a2b9d604'
+down_revision = 'b5d2e8f1a374'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('job', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('heartbeat_at', sa.DateTime(), nullable=True))
+
+    # Jobs already running have no heartbeat; count their start as one
+    op.execute("UPDATE job SET heartbeat_at = started_at WHERE status = 'running'")
+
+
+def downgrade():
+    with op.batch_alter_table('job', schema=None) as batch_op:
+        batch_op.drop_column('heartbeat_at')
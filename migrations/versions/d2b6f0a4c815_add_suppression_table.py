@@ -0,0 +1,36 @@
+"""Add suppression table for opted-out and hard-bounced numbers
+
+Revision ID: d2b6f0a4c815
+Revises: a6c0d94e3f71
+Create Date: 2026-10-18 15:22:08.413950
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd2b6f0a4c815'
+down_revision = 'a6c0d94e3f71'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('suppression',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('phone_number', sa.String(length=20), nullable=False),
+    sa.Column('reason', sa.String(length=20), nullable=False),
+    sa.Column('error_code', sa.Integer(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('suppression', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_suppression_phone_number'), ['phone_number'], unique=True)
+
+
+def downgrade():
+    with op.batch_alter_table('suppression', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_suppression_phone_number'))
+
+    op.drop_table('suppression')
@@ -0,0 +1,34 @@
+"""Store each list member's row so list blasts don't render another upload's values
+
+Revision ID: e5b9d3a7c142
+Revises: c7f1a2b9d604
+Create Date: 2026-10-19 14:31:52.208417
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5b9d3a7c142'
+down_revision = 'c7f1a2b9d604'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('recipient_list_member', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('name', sa.String(length=100), nullable=True))
+        batch_op.add_column(sa.Column('email', sa.String(length=120), nullable=True))
+        batch_op.add_column(sa.Column('custom_fields', sa.JSON(), nullable=True))
+
+    # Existing members have no stored row; clearing the digest makes the next
+    # upload of each list write it
+    op.execute("UPDATE recipient_list_member SET row_hash = ''")
+
+
+def downgrade():
+    with op.batch_alter_table('recipient_list_member', schema=None) as batch_op:
+        batch_op.drop_column('custom_fields')
+        batch_op.drop_column('email')
+        batch_op.drop_column('name')
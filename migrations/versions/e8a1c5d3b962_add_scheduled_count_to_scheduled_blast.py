@@ -0,0 +1,39 @@
+"""Track scheduled messages per blast and the end of its send window
+
+Revision ID: e8a1c5d3b962
+Revises: d2b6f0a4c815
+Create Date: 2026-10-18 16:04:45.118274
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e8a1c5d3b962'
+down_revision = 'd2b6f0a4c815'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('scheduled_blast', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('scheduled_count', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('send_window_end', sa.DateTime(), nullable=True))
+
+    # Existing blasts sent everything at scheduled_time
+    op.execute("""
+        UPDATE scheduled_blast SET
+            send_window_end = scheduled_time,
+            scheduled_count = (
+                SELECT COUNT(*) FROM scheduled_message
+                WHERE scheduled_message.scheduled_blast_id = scheduled_blast.id
+                  AND scheduled_message.status = 'scheduled'
+            )
+    """)
+
+
+def downgrade():
+    with op.batch_alter_table('scheduled_blast', schema=None) as batch_op:
+        batch_op.drop_column('send_window_end')
+        batch_op.drop_column('scheduled_count')
@@ -0,0 +1,33 @@
+"""Add run_at to job for delayed jobs
+
+Revision ID: f4c9b27e0d13
+Revises: e8a1c5d3b962
+Create Date: 2026-10-18 16:47:12.530871
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f4c9b27e0d13'
+down_revision = 'e8a1c5d3b962'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('job', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('run_at', sa.DateTime(), nullable=True))
+
+    op.execute("UPDATE job SET run_at = created_at")
+
+    with op.batch_alter_table('job', schema=None) as batch_op:
+        batch_op.alter_column('run_at', existing_type=sa.DateTime(), nullable=False)
+        batch_op.create_index('ix_job_status_run_at', ['status', 'run_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('job', schema=None) as batch_op:
+        batch_op.drop_index('ix_job_status_run_at')
+        batch_op.drop_column('run_at')
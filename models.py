@@ -2,8 +2,8 @@ from app import db
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 from sqlalchemy.orm import validates, relationship
+from datetime import datetime
 import re
-import json
 
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -20,7 +20,7 @@ class User(UserMixin, db.Model):
 
 class Recipient(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    phone_number = db.Column(db.String(20), nullable=False)
+    phone_number = db.Column(db.String(20), nullable=False, unique=True, index=True)
     name = db.Column(db.String(100))
     email = db.Column(db.String(120))
     custom_fields = db.Column(db.JSON)
@@ -33,6 +33,10 @@ class Recipient(db.Model):
         return phone_number
 
 class ScheduledBlast(db.Model):
+    __table_args__ = (
+        db.Index('ix_scheduled_blast_user_scheduled_time', 'user_id', 'scheduled_time'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     user = relationship('User', back_populates='scheduled_blasts')
@@ -40,18 +44,207 @@ class ScheduledBlast(db.Model):
     mms_url = db.Column(db.String(255))  # New field for MMS URL
     scheduled_time = db.Column(db.DateTime, nullable=False)
     status = db.Column(db.String(20), default='scheduled')
-    twilio_message_sid = db.Column(db.Text)
+    # Rollups maintained incrementally from Twilio status callbacks
+    sent_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    delivered_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    failed_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Messages still waiting at Twilio, counted towards the account's scheduled-message limit
+    scheduled_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # send_at of the last chunk when the blast is staggered
+    send_window_end = db.Column(db.DateTime)
+    # Local-time mode: each recipient gets the scheduled wall-clock time in their own
+    # timezone, read from `timezone_column` or inferred from the phone number
+    local_time = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
+    timezone_column = db.Column(db.String(64))
+    recipient_list_id = db.Column(db.Integer, db.ForeignKey('recipient_list.id'), index=True)
+    recipient_list = relationship('RecipientList')
     recipient_associations = relationship('RecipientBlastAssociation', back_populates='scheduled_blast', cascade='all, delete-orphan')
+    messages = relationship('ScheduledMessage', back_populates='scheduled_blast', cascade='all, delete-orphan', lazy='dynamic')
+
+class RecipientList(db.Model):
+    __table_args__ = (
+        db.Index('ix_recipient_list_user_name', 'user_id', 'name', unique=True),
+    )
 
-    def set_twilio_message_sids(self, sids):
-        self.twilio_message_sid = json.dumps(sids)
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    name = db.Column(db.String(100), nullable=False)
+    member_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
 
-    def get_twilio_message_sids(self):
-        return json.loads(self.twilio_message_sid) if self.twilio_message_sid else []
+class RecipientListMember(db.Model):
+    __table_args__ = (
+        db.Index('ix_recipient_list_member_list_recipient', 'recipient_list_id', 'recipient_id', unique=True),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    recipient_list_id = db.Column(db.Integer, db.ForeignKey('recipient_list.id'), nullable=False)
+    recipient_id = db.Column(db.Integer, db.ForeignKey('recipient.id'), nullable=False)
+    # Digest of the member's CSV row; an upload only rewrites rows whose digest changed
+    row_hash = db.Column(db.String(32), nullable=False)
+    # The row's own values, which list blasts render from; Recipient holds whatever
+    # upload last touched the number. Null name/email fall back to Recipient.
+    name = db.Column(db.String(100))
+    email = db.Column(db.String(120))
+    custom_fields = db.Column(db.JSON)
 
 class RecipientBlastAssociation(db.Model):
+    __table_args__ = (
+        db.Index('ix_recipient_blast_association_blast_recipient', 'scheduled_blast_id', 'recipient_id', unique=True),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     recipient_id = db.Column(db.Integer, db.ForeignKey('recipient.id'), nullable=False)
     scheduled_blast_id = db.Column(db.Integer, db.ForeignKey('scheduled_blast.id'), nullable=False)
     recipient = relationship('Recipient', back_populates='blast_associations')
     scheduled_blast = relationship('ScheduledBlast', back_populates='recipient_associations')
+
+class ScheduledMessage(db.Model):
+    __table_args__ = (
+        db.Index('ix_scheduled_message_blast_recipient', 'scheduled_blast_id', 'recipient_id', unique=True),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    scheduled_blast_id = db.Column(db.Integer, db.ForeignKey('scheduled_blast.id'), nullable=False)
+    # Nullable only for rows backfilled from the old JSON SID list
+    recipient_id = db.Column(db.Integer, db.ForeignKey('recipient.id'))
+    twilio_sid = db.Column(db.String(34), unique=True, index=True)
+    status = db.Column(db.String(20), nullable=False, default='pending')
+    error_code = db.Column(db.Integer)
+    error_message = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+    scheduled_blast = relationship('ScheduledBlast', back_populates='messages')
+    recipient = relationship('Recipient')
+
+class DispatchChunk(db.Model):
+    """A run of a blast's recipients (by recipient id) that one worker at a time
+    leases and sends."""
+    __table_args__ = (
+        db.Index('ix_dispatch_chunk_blast_seq', 'scheduled_blast_id', 'seq', unique=True),
+        db.Index('ix_dispatch_chunk_status_lease', 'status', 'lease_expires_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    scheduled_blast_id = db.Column(db.Integer, db.ForeignKey('scheduled_blast.id'), nullable=False)
+    job_id = db.Column(db.Integer, db.ForeignKey('job.id'), nullable=False)
+    seq = db.Column(db.Integer, nullable=False)
+    first_recipient_id = db.Column(db.Integer, nullable=False)
+    last_recipient_id = db.Column(db.Integer, nullable=False)
+    messages = db.Column(db.Integer, nullable=False)
+    # Where the chunk's messages start in the blast's plan: overall, and per
+    # timezone for local-time blasts
+    first_index = db.Column(db.Integer, nullable=False)
+    bucket_offsets = db.Column(db.JSON)
+    # 'pending', 'leased', 'done' or 'failed'
+    status = db.Column(db.String(20), nullable=False, default='pending')
+    lease_owner = db.Column(db.String(64))
+    lease_expires_at = db.Column(db.DateTime)
+    heartbeat_at = db.Column(db.DateTime)
+    # Bumped by every claim; a worker's writes only land while it still matches
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    dispatched = db.Column(db.Integer, nullable=False, default=0)
+    succeeded = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text)
+    finished_at = db.Column(db.DateTime)
+
+class DeadLetter(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    scheduled_blast_id = db.Column(db.Integer, db.ForeignKey('scheduled_blast.id'), nullable=False, index=True)
+    recipient_id = db.Column(db.Integer, db.ForeignKey('recipient.id'))
+    phone_number = db.Column(db.String(20), nullable=False)
+    message_params = db.Column(db.JSON, nullable=False)
+    error_code = db.Column(db.Integer)
+    error_message = db.Column(db.Text)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    # Permanent errors (e.g. an invalid number), and sends Twilio may have
+    # accepted after all, are skipped by default on replay
+    permanent = db.Column(db.Boolean, nullable=False, default=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    replayed_at = db.Column(db.DateTime)
+    replay_sid = db.Column(db.String(34))
+
+class Suppression(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    phone_number = db.Column(db.String(20), nullable=False, unique=True, index=True)
+    # 'opt_out' (replied STOP) or 'hard_bounce' (number can never receive messages)
+    reason = db.Column(db.String(20), nullable=False)
+    error_code = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class UploadPart(db.Model):
+    # Uploaded CSVs live in the database so a worker on any host can read them
+    __table_args__ = (
+        db.Index('ix_upload_part_upload_seq', 'upload_id', 'seq', unique=True),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    upload_id = db.Column(db.String(32), nullable=False)
+    seq = db.Column(db.Integer, nullable=False)
+    data = db.Column(db.LargeBinary, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class CsvValidation(db.Model):
+    __table_args__ = (
+        db.Index('ix_csv_validation_user_file_template', 'user_id', 'file_hash', 'template_hash', unique=True),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    # sha256 of the uploaded file and of the message template the estimate was made for
+    file_hash = db.Column(db.String(64), nullable=False)
+    template_hash = db.Column(db.String(64), nullable=False)
+    job_id = db.Column(db.Integer, db.ForeignKey('job.id'))
+    result = db.Column(db.JSON)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    job = relationship('Job')
+
+class Job(db.Model):
+    __table_args__ = (
+        db.Index('ix_job_status_run_at', 'status', 'run_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.JSON, default=dict)
+    status = db.Column(db.String(20), nullable=False, default='queued', index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    scheduled_blast_id = db.Column(db.Integer, db.ForeignKey('scheduled_blast.id'), index=True)
+    progress_done = db.Column(db.Integer, nullable=False, default=0)
+    progress_total = db.Column(db.Integer)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    locked_by = db.Column(db.String(64))
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # Not claimed before this time; release_blast jobs wait here for far-future blasts
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    # Renewed while a worker runs the job; a stale one lets another worker claim it
+    heartbeat_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    scheduled_blast = relationship('ScheduledBlast')
+
+    PROGRESS_VERBS = {
+        'schedule_blast': 'sent',
+        'cancel_blast': 'canceled',
+        'replay_dead_letters': 'resent',
+        'release_blast': 'sent',
+    }
+
+    @property
+    def is_waiting(self):
+        return self.status == 'queued' and self.run_at is not None and self.run_at > datetime.utcnow()
+
+    @property
+    def progress_label(self):
+        if self.is_waiting:
+            return f'held until {self.run_at:%Y-%m-%d %H:%M} UTC'
+        if self.status == 'queued':
+            return 'queued'
+        if self.status == 'running':
+            if self.progress_total:
+                verb = self.PROGRESS_VERBS.get(self.kind, 'done')
+                return f'{self.progress_done} of {self.progress_total} {verb}'
+            return 'processing'
+        return self.status
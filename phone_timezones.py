@@ -0,0 +1,142 @@
+"""Phone-number prefix to timezone lookup for local-time blasts.
+
+NANP numbers are keyed by country code plus area code ('1212'), everything
+else by country code ('44'). Area codes that straddle a timezone boundary map
+to the zone most of their numbers are in. Lookups are plain dict hits; pytz
+is only touched once per distinct timezone in a blast.
+"""
+import pytz
+
+DEFAULT_TIMEZONE = 'US/Eastern'
+
+_TIMEZONE_PREFIXES = {
+    'America/New_York': (
+        '1201 1202 1203 1207 1212 1215 1216 1220 1223 1227 1231 1234 1240 1248 1252 1260 1267 1269 1272 '
+        '1276 1283 1301 1302 1304 1305 1313 1315 1317 1321 1324 1326 1330 1332 1336 1339 1347 1351 1352 '
+        '1363 1380 1386 1401 1404 1407 1410 1412 1413 1419 1423 1434 1440 1443 1445 1448 1463 1470 1472 '
+        '1475 1478 1484 1502 1513 1516 1517 1518 1540 1551 1561 1567 1570 1571 1574 1582 1585 1586 1603 '
+        '1606 1607 1609 1610 1614 1616 1617 1631 1640 1645 1646 1656 1667 1678 1679 1680 1681 1689 1703 '
+        '1704 1706 1716 1717 1718 1724 1727 1728 1732 1734 1740 1743 1754 1757 1762 1765 1770 1771 1772 '
+        '1774 1781 1786 1802 1803 1804 1810 1812 1813 1814 1826 1828 1835 1838 1839 1843 1845 1848 1854 '
+        '1856 1857 1859 1860 1862 1863 1864 1865 1878 1904 1906 1908 1910 1912 1914 1917 1919 1929 1930 '
+        '1934 1937 1941 1943 1947 1948 1954 1959 1973 1978 1980 1984 1989 '
+        # Ontario and Quebec
+        '1226 1249 1263 1289 1343 1354 1365 1367 1382 1416 1418 1437 1438 1450 1468 1514 1519 1548 1579 '
+        '1581 1613 1647 1683 1705 1742 1753 1819 1873 1905 1942'
+    ),
+    'America/Chicago': (
+        '1205 1210 1214 1217 1218 1219 1224 1225 1228 1251 1254 1256 1262 1270 1274 1281 1308 1309 1312 '
+        '1314 1316 1318 1319 1320 1325 1327 1331 1334 1337 1346 1361 1364 1402 1405 1409 1414 1417 1430 '
+        '1432 1447 1464 1469 1479 1483 1501 1504 1507 1512 1515 1531 1534 1539 1557 1563 1572 1573 1580 '
+        '1601 1605 1608 1612 1615 1618 1620 1629 1630 1636 1641 1651 1659 1660 1662 1682 1701 1708 1712 '
+        '1713 1715 1726 1730 1731 1737 1763 1769 1773 1779 1785 1806 1815 1816 1817 1830 1832 1847 1850 '
+        '1861 1870 1872 1901 1903 1913 1918 1920 1924 1931 1936 1938 1940 1945 1952 1956 1972 1975 1979 '
+        '1985 '
+        # Manitoba
+        '1204 1431 1584'
+    ),
+    'America/Regina': '1306 1474 1639',
+    'America/Denver': '1208 1303 1307 1385 1406 1435 1505 1575 1719 1720 1801 1915 1970 1983 1986',
+    'America/Edmonton': '1368 1403 1587 1780 1825',
+    'America/Phoenix': '1480 1520 1602 1623 1928',
+    'America/Los_Angeles': (
+        '1206 1209 1213 1253 1279 1310 1323 1341 1350 1360 1369 1408 1415 1424 1425 1442 1458 1503 1509 '
+        '1510 1530 1541 1559 1562 1564 1619 1626 1628 1650 1657 1661 1669 1702 1707 1714 1725 1747 1760 '
+        '1775 1805 1818 1820 1831 1840 1858 1909 1916 1925 1949 1951 1971'
+    ),
+    'America/Vancouver': '1236 1250 1257 1604 1672 1778',
+    'America/Anchorage': '1907',
+    'Pacific/Honolulu': '1808',
+    'America/Halifax': '1428 1506 1782 1902',
+    'America/St_Johns': '1709 1879',
+    'America/Puerto_Rico': '1340 1787 1939',
+    'Pacific/Guam': '1671',
+    'Pacific/Saipan': '1670',
+    'Pacific/Pago_Pago': '1684',
+    'America/Mexico_City': '52',
+    'America/Sao_Paulo': '55',
+    'Europe/London': '44',
+    'Europe/Dublin': '353',
+    'Europe/Lisbon': '351',
+    'Europe/Paris': '33',
+    'Europe/Brussels': '32',
+    'Europe/Amsterdam': '31',
+    'Europe/Berlin': '49',
+    'Europe/Zurich': '41',
+    'Europe/Vienna': '43',
+    'Europe/Madrid': '34',
+    'Europe/Rome': '39',
+    'Europe/Copenhagen': '45',
+    'Europe/Stockholm': '46',
+    'Europe/Oslo': '47',
+    'Europe/Warsaw': '48',
+    'Africa/Johannesburg': '27',
+    'Africa/Lagos': '234',
+    'Asia/Jerusalem': '972',
+    'Asia/Dubai': '971',
+    'Asia/Kolkata': '91',
+    'Asia/Singapore': '65',
+    'Asia/Manila': '63',
+    'Asia/Hong_Kong': '852',
+    'Asia/Shanghai': '86',
+    'Asia/Seoul': '82',
+    'Asia/Tokyo': '81',
+    'Australia/Sydney': '61',
+    'Pacific/Auckland': '64',
+}
+
+PREFIX_TIMEZONES = {
+    prefix: timezone
+    for timezone, prefixes in _TIMEZONE_PREFIXES.items()
+    for prefix in prefixes.split()
+}
+_PREFIX_LENGTHS = sorted({len(prefix) for prefix in PREFIX_TIMEZONES}, reverse=True)
+
+_valid_timezones = {}
+
+def normalize_timezone(name):
+    """Return `name` stripped if pytz knows it, otherwise None."""
+    if not name:
+        return None
+    name = name.strip()
+    if name not in _valid_timezones:
+        if len(_valid_timezones) >= 4096:
+            _valid_timezones.clear()
+        _valid_timezones[name] = name if name in pytz.all_timezones_set else None
+    return _valid_timezones[name]
+
+def timezone_for_phone_number(phone_number):
+    digits = phone_number.lstrip('+')
+    for length in _PREFIX_LENGTHS:
+        timezone = PREFIX_TIMEZONES.get(digits[:length])
+        if timezone:
+            return timezone
+    return None
+
+def recipient_timezone(recipient, column=None, default=DEFAULT_TIMEZONE):
+    # An explicit CSV value wins over the area-code guess
+    if column:
+        timezone = normalize_timezone((recipient.custom_fields or {}).get(column))
+        if timezone:
+            return timezone
+    return timezone_for_phone_number(recipient.phone_number) or default
+
+def local_send_times(wall_clock, timezones):
+    """Map each timezone to the naive UTC instant when it reaches `wall_clock`."""
+    send_times = {}
+    for name in timezones:
+        localized = pytz.timezone(name).localize(wall_clock)
+        send_times[name] = localized.astimezone(pytz.UTC).replace(tzinfo=None)
+    return send_times
+
+def wall_clock_time(scheduled_time, timezone=DEFAULT_TIMEZONE):
+    # Blasts store the entered time converted from DEFAULT_TIMEZONE to naive UTC
+    return pytz.UTC.localize(scheduled_time).astimezone(pytz.timezone(timezone)).replace(tzinfo=None)
+
+def count_timezones(recipient_pages, column=None):
+    counts = {}
+    for page in recipient_pages:
+        for recipient in page:
+            timezone = recipient_timezone(recipient, column)
+            counts[timezone] = counts.get(timezone, 0) + 1
+    return counts
@@ -0,0 +1,161 @@
+import hashlib
+import logging
+from datetime import datetime
+from sqlalchemy import select, delete, func, literal, exists
+from models import RecipientList, RecipientListMember, Recipient, RecipientBlastAssociation, Suppression, db
+from db_utils import insert_for_dialect
+from ingestion import upsert_recipients, custom_fields_of
+from metrics import DB_FLUSH_SECONDS
+
+logger = logging.getLogger(__name__)
+
+LIST_SCAN_PAGE_SIZE = 5000
+
+class ListSyncStats:
+    def __init__(self):
+        self.rows = 0
+        self.duplicates = 0
+        self.added = 0
+        self.changed = 0
+        self.unchanged = 0
+        self.removed = 0
+        self.created = 0
+        self.invalid_count = 0
+        self.invalid_sample = []
+
+    def as_dict(self):
+        return {
+            'rows': self.rows,
+            'duplicates': self.duplicates,
+            'list_added': self.added,
+            'list_changed': self.changed,
+            'list_unchanged': self.unchanged,
+            'list_removed': self.removed,
+            'created': self.created,
+            'invalid_count': self.invalid_count,
+        }
+
+def row_hash(row):
+    # Column order in the CSV does not matter; any edited value does
+    content = '\x1f'.join(f'{key}\x1e{value}' for key, value in sorted(row.items(), key=lambda item: str(item[0])))
+    return hashlib.blake2b(content.encode(), digest_size=16).hexdigest()
+
+def user_lists(user_id):
+    return RecipientList.query.filter_by(user_id=user_id).order_by(RecipientList.name).all()
+
+def get_or_create_list(user_id, name):
+    recipient_list = RecipientList.query.filter_by(user_id=user_id, name=name).first()
+    if recipient_list is None:
+        recipient_list = RecipientList(user_id=user_id, name=name, member_count=0)
+        db.session.add(recipient_list)
+        db.session.flush()
+    return recipient_list
+
+def sync_list_chunk(list_id, rows, seen, stats):
+    # Rows whose digest matches the stored one cost a lookup and nothing else;
+    # only new and edited rows touch Recipient and the member table.
+    hashes = {}
+    for row in rows:
+        phone_number = row['phone_number']
+        if phone_number in seen or phone_number in hashes:
+            stats.duplicates += 1
+            continue
+        hashes[phone_number] = (row_hash(row), row)
+    if not hashes:
+        return
+    seen.update(hashes)
+
+    stored = dict(db.session.execute(
+        select(Recipient.phone_number, RecipientListMember.row_hash)
+        .join(RecipientListMember, RecipientListMember.recipient_id == Recipient.id)
+        .where(RecipientListMember.recipient_list_id == list_id, Recipient.phone_number.in_(list(hashes)))
+    ).all())
+
+    by_phone = {}
+    for phone_number, (digest, row) in hashes.items():
+        previous = stored.get(phone_number)
+        if previous == digest:
+            stats.unchanged += 1
+            continue
+        if previous is None:
+            stats.added += 1
+        else:
+            stats.changed += 1
+        by_phone[phone_number] = row
+    if not by_phone:
+        return
+
+    recipients, created = upsert_recipients(by_phone)
+    stats.created += created
+    # Rows are stored on the member too: another upload of the same number rewrites
+    # Recipient, but must not change what this list's unchanged rows render
+    members = insert_for_dialect(RecipientListMember).values([
+        {'recipient_list_id': list_id, 'recipient_id': recipient_id, 'row_hash': hashes[phone_number][0],
+         'name': by_phone[phone_number].get('name'), 'email': by_phone[phone_number].get('email'),
+         'custom_fields': custom_fields_of(by_phone[phone_number])}
+        for recipient_id, phone_number in recipients
+    ])
+    db.session.execute(members.on_conflict_do_update(
+        index_elements=[RecipientListMember.recipient_list_id, RecipientListMember.recipient_id],
+        set_={'row_hash': members.excluded.row_hash, 'name': members.excluded.name,
+              'email': members.excluded.email, 'custom_fields': members.excluded.custom_fields}
+    ))
+
+def remove_missing_members(list_id, seen, page_size=LIST_SCAN_PAGE_SIZE):
+    # Walks the list's (list, recipient) index in pages and deletes members
+    # that the upload no longer contains
+    removed = 0
+    last_recipient_id = 0
+    while True:
+        page = db.session.execute(
+            select(RecipientListMember.id, RecipientListMember.recipient_id, Recipient.phone_number)
+            .join(Recipient, Recipient.id == RecipientListMember.recipient_id)
+            .where(RecipientListMember.recipient_list_id == list_id,
+                   RecipientListMember.recipient_id > last_recipient_id)
+            .order_by(RecipientListMember.recipient_id)
+            .limit(page_size)
+        ).all()
+        if not page:
+            return removed
+        missing = [member_id for member_id, _, phone_number in page if phone_number not in seen]
+        if missing:
+            db.session.execute(delete(RecipientListMember).where(RecipientListMember.id.in_(missing)))
+            removed += len(missing)
+        last_recipient_id = page[-1].recipient_id
+
+def sync_recipient_list(recipient_list, reader):
+    """Make `recipient_list` match the uploaded CSV, writing only the delta."""
+    stats = ListSyncStats()
+    seen = set()
+    for chunk in reader:
+        with DB_FLUSH_SECONDS.time(operation='list_sync_chunk'):
+            sync_list_chunk(recipient_list.id, chunk, seen, stats)
+    stats.removed = remove_missing_members(recipient_list.id, seen)
+    stats.rows = reader.rows_read
+    stats.invalid_count = reader.invalid_count
+    stats.invalid_sample = reader.invalid_sample
+
+    recipient_list.member_count = db.session.execute(
+        select(func.count(RecipientListMember.id)).where(RecipientListMember.recipient_list_id == recipient_list.id)
+    ).scalar()
+    recipient_list.updated_at = datetime.utcnow()
+    logger.info(f"Synced recipient list {recipient_list.id} ({recipient_list.name}): {stats.as_dict()}")
+    return stats
+
+def associate_list_members(blast_id, list_id):
+    """Copy the list's members onto the blast with one INSERT ... SELECT, leaving out suppressed numbers."""
+    members = (
+        select(RecipientListMember.recipient_id, literal(blast_id))
+        .join(Recipient, Recipient.id == RecipientListMember.recipient_id)
+        .where(RecipientListMember.recipient_list_id == list_id,
+               ~exists().where(Suppression.phone_number == Recipient.phone_number))
+    )
+    statement = (insert_for_dialect(RecipientBlastAssociation)
+                 .from_select(['recipient_id', 'scheduled_blast_id'], members)
+                 .on_conflict_do_nothing(index_elements=[RecipientBlastAssociation.scheduled_blast_id,
+                                                         RecipientBlastAssociation.recipient_id]))
+    with DB_FLUSH_SECONDS.time(operation='list_associations'):
+        db.session.execute(statement)
+    return db.session.execute(
+        select(func.count(RecipientBlastAssociation.id)).where(RecipientBlastAssociation.scheduled_blast_id == blast_id)
+    ).scalar()
@@ -0,0 +1,149 @@
+from datetime import datetime
+from sqlalchemy import select, update, func, and_
+from models import ScheduledMessage, ScheduledBlast, Recipient, RecipientBlastAssociation, RecipientListMember, db
+from db_utils import insert_for_dialect
+
+RECIPIENT_PAGE_SIZE = 1000
+
+CANCELABLE_MESSAGE_STATUSES = ['scheduled', 'cancel_failed']
+
+def iter_blast_recipient_pages(blast_id, page_size=RECIPIENT_PAGE_SIZE, first_id=None, last_id=None):
+    # Keyset pagination: each page is its own short query, so the caller may
+    # commit between pages without invalidating an open cursor.
+    # `first_id`/`last_id` bound the walk to one dispatch chunk.
+    # List blasts render each member's row as the list stored it, falling back
+    # to Recipient for members that have since left the list
+    after_id = 0 if first_id is None else first_id - 1
+    list_id = db.session.execute(
+        select(ScheduledBlast.recipient_list_id).where(ScheduledBlast.id == blast_id)
+    ).scalar()
+    if list_id is None:
+        columns = [Recipient.name, Recipient.email, Recipient.custom_fields]
+    else:
+        columns = [func.coalesce(RecipientListMember.name, Recipient.name).label('name'),
+                   func.coalesce(RecipientListMember.email, Recipient.email).label('email'),
+                   func.coalesce(RecipientListMember.custom_fields, Recipient.custom_fields).label('custom_fields')]
+    while True:
+        query = (select(Recipient.id, Recipient.phone_number, *columns)
+                 .join(RecipientBlastAssociation, RecipientBlastAssociation.recipient_id == Recipient.id)
+                 .where(RecipientBlastAssociation.scheduled_blast_id == blast_id, Recipient.id > after_id))
+        if list_id is not None:
+            query = query.outerjoin(RecipientListMember, and_(RecipientListMember.recipient_id == Recipient.id,
+                                                              RecipientListMember.recipient_list_id == list_id))
+        if last_id is not None:
+            query = query.where(Recipient.id <= last_id)
+        page = db.session.execute(query.order_by(Recipient.id).limit(page_size)).all()
+        if not page:
+            return
+        yield page
+        after_id = page[-1].id
+
+def iter_blast_recipient_id_pages(blast_id, page_size=RECIPIENT_PAGE_SIZE * 10):
+    # Served from the (blast, recipient) index alone
+    last_id = 0
+    while True:
+        page = db.session.execute(
+            select(RecipientBlastAssociation.recipient_id)
+            .where(RecipientBlastAssociation.scheduled_blast_id == blast_id,
+                   RecipientBlastAssociation.recipient_id > last_id)
+            .order_by(RecipientBlastAssociation.recipient_id)
+            .limit(page_size)
+        ).scalars().all()
+        if not page:
+            return
+        yield page
+        last_id = page[-1]
+
+def record_dispatch_results(blast_id, results, overwrite=True):
+    # Without `overwrite`, recipients that already have a row keep it
+    if not results:
+        return
+    now = datetime.utcnow()
+    statement = insert_for_dialect(ScheduledMessage).values([
+        {
+            'scheduled_blast_id': blast_id,
+            'recipient_id': result.key,
+            'twilio_sid': result.sid,
+            'status': result.status or ('failed' if result.error else 'pending'),
+            'error_code': result.error_code,
+            'error_message': result.error,
+            'created_at': now,
+            'updated_at': now,
+        }
+        for result in results
+    ])
+    if not overwrite:
+        db.session.execute(statement.on_conflict_do_nothing(
+            index_elements=[ScheduledMessage.scheduled_blast_id, ScheduledMessage.recipient_id]))
+        return
+    statement = statement.on_conflict_do_update(
+        index_elements=[ScheduledMessage.scheduled_blast_id, ScheduledMessage.recipient_id],
+        set_={
+            'twilio_sid': statement.excluded.twilio_sid,
+            'status': statement.excluded.status,
+            'error_code': statement.excluded.error_code,
+            'error_message': statement.excluded.error_message,
+            'updated_at': statement.excluded.updated_at,
+        }
+    )
+    db.session.execute(statement)
+
+def recorded_recipient_ids(blast_id, first_id, last_id):
+    return set(db.session.execute(
+        select(ScheduledMessage.recipient_id)
+        .where(ScheduledMessage.scheduled_blast_id == blast_id,
+               ScheduledMessage.recipient_id.between(first_id, last_id))
+    ).scalars())
+
+def recorded_message_counts(blast_id, first_id, last_id):
+    """(recorded, with a SID) for the blast's recipients in `first_id`..`last_id`."""
+    return tuple(db.session.execute(
+        select(func.count(ScheduledMessage.id), func.count(ScheduledMessage.twilio_sid))
+        .where(ScheduledMessage.scheduled_blast_id == blast_id,
+               ScheduledMessage.recipient_id.between(first_id, last_id))
+    ).one())
+
+def message_sids(blast_id, statuses=None):
+    query = (select(ScheduledMessage.twilio_sid)
+             .where(ScheduledMessage.scheduled_blast_id == blast_id,
+                    ScheduledMessage.twilio_sid.isnot(None)))
+    if statuses is not None:
+        query = query.where(ScheduledMessage.status.in_(statuses))
+    return db.session.execute(query.order_by(ScheduledMessage.id)).scalars().all()
+
+def update_message_status(twilio_sid, status, error_code=None, error_message=None):
+    values = {'status': status, 'updated_at': datetime.utcnow()}
+    if error_code is not None:
+        values['error_code'] = error_code
+    if error_message is not None:
+        values['error_message'] = error_message
+    db.session.execute(
+        update(ScheduledMessage)
+        .where(ScheduledMessage.twilio_sid == twilio_sid)
+        .values(**values)
+    )
+
+def record_cancel_results(results):
+    # Group by outcome so a batch becomes a handful of UPDATE ... WHERE sid IN (...)
+    groups = {}
+    for result in results:
+        if result.ok:
+            outcome = ('canceled', None, None)
+        else:
+            outcome = ('cancel_failed', result.error_code, result.error or f"Status is {result.status}")
+        groups.setdefault(outcome, []).append(result.sid)
+    now = datetime.utcnow()
+    for (status, error_code, error_message), sids in groups.items():
+        db.session.execute(
+            update(ScheduledMessage)
+            .where(ScheduledMessage.twilio_sid.in_(sids))
+            .values(status=status, error_code=error_code, error_message=error_message, updated_at=now)
+        )
+
+def status_counts(blast_id):
+    rows = db.session.execute(
+        select(ScheduledMessage.status, func.count())
+        .where(ScheduledMessage.scheduled_blast_id == blast_id)
+        .group_by(ScheduledMessage.status)
+    )
+    return dict(rows.all())
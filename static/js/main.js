@@ -7,15 +7,18 @@ document.addEventListener('DOMContentLoaded', function() {
     if (scheduleBlastForm) {
         scheduleBlastForm.addEventListener('submit', function(event) {
             const csvFile = document.getElementById('csv_file');
+            const recipientList = document.getElementById('recipient_list_id');
             const messageTemplate = document.getElementById('message_template');
             const scheduledTime = document.getElementById('scheduled_time');
             
             let isValid = true;
             
-            // Validate CSV file
+            // Validate CSV file; optional when sending to a saved list
             if (csvFile.files.length === 0) {
-                alert('Please upload a CSV file.');
-                isValid = false;
+                if (!recipientList || !recipientList.value) {
+                    alert('Please upload a CSV file.');
+                    isValid = false;
+                }
             } else if (!csvFile.files[0].name.endsWith('.csv')) {
                 alert('Please upload a valid CSV file.');
                 isValid = false;
@@ -31,13 +34,14 @@ document.addEventListener('DOMContentLoaded', function() {
             const now = new Date();
             const selectedTime = new Date(scheduledTime.value);
             const minTime = new Date(now.getTime() + 15 * 60000); // 15 minutes from now
-            const maxTime = new Date(now.getTime() + 35 * 24 * 60 * 60000); // 35 days from now
+            const maxDays = parseInt(scheduledTime.dataset.maxDays || '35', 10);
+            const maxTime = new Date(now.getTime() + maxDays * 24 * 60 * 60000);
             
             if (selectedTime < minTime) {
                 alert('Scheduled time must be at least 15 minutes in the future.');
                 isValid = false;
             } else if (selectedTime > maxTime) {
-                alert('Scheduled time must be within 35 days from now.');
+                alert(`Scheduled time must be within ${maxDays} days from now.`);
                 isValid = false;
             }
             
@@ -82,6 +86,29 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
 
+    document.querySelectorAll('.job-progress').forEach(function(element) {
+        const status = element.dataset.jobStatus;
+        if (status === 'queued' || status === 'running') {
+            pollJobProgress(element);
+        }
+    });
+
+    function pollJobProgress(element) {
+        fetch(`/jobs/${element.dataset.jobId}`)
+            .then(response => response.json())
+            .then(data => {
+                element.textContent = data.label;
+                if (data.status === 'queued' || data.status === 'running') {
+                    setTimeout(() => pollJobProgress(element), 2000);
+                } else {
+                    window.location.reload();
+                }
+            })
+            .catch(error => {
+                console.error('Error:', error);
+            });
+    }
+
     function updateFieldPicker(headers) {
         fieldPicker.innerHTML = '<option value="">Select a field</option>';
         headers.forEach(header => {
@@ -0,0 +1,213 @@
+import os
+import atexit
+import threading
+import logging
+from datetime import datetime
+from flask import Blueprint, request, abort
+from sqlalchemy import select, update
+from twilio.request_validator import RequestValidator
+from models import ScheduledMessage, ScheduledBlast, db
+from suppression import (suppress_message_sids, add_suppressions, remove_opt_out, opt_out_action,
+                         SUPPRESSION_ERROR_CODES)
+from metrics import DB_FLUSH_SECONDS
+
+logger = logging.getLogger(__name__)
+
+TWILIO_AUTH_TOKEN = os.environ.get("TWILIO_AUTH_TOKEN")
+TWILIO_STATUS_CALLBACK_URL = os.environ.get("TWILIO_STATUS_CALLBACK_URL")
+# Public URL of /twilio/inbound, set as the Messaging Service's incoming message webhook
+TWILIO_INBOUND_URL = os.environ.get("TWILIO_INBOUND_URL")
+STATUS_FLUSH_SIZE = int(os.environ.get("STATUS_FLUSH_SIZE", "500"))
+STATUS_FLUSH_INTERVAL = float(os.environ.get("STATUS_FLUSH_INTERVAL", "1"))
+
+# Callbacks can arrive out of order; a message never moves back to an earlier stage.
+STATUS_RANKS = {
+    'pending': 0, 'scheduled': 0, 'accepted': 1, 'queued': 1, 'sending': 2,
+    'sent': 3, 'delivered': 4, 'undelivered': 4, 'failed': 4, 'canceled': 4, 'read': 5,
+}
+
+# Blast-level counters and the message statuses each one counts
+ROLLUP_COUNTERS = {
+    'sent_count': {'sent', 'delivered', 'undelivered', 'read'},
+    'delivered_count': {'delivered', 'read'},
+    'failed_count': {'failed', 'undelivered'},
+    'scheduled_count': {'scheduled'},
+}
+
+status_callbacks = Blueprint('status_callbacks', __name__)
+
+class StatusUpdateBuffer:
+    """Collects status callbacks in memory and writes them to the database in batches.
+
+    Updates for the same SID are coalesced, so only the latest status per message is
+    written. A background thread flushes every STATUS_FLUSH_INTERVAL seconds, or as
+    soon as STATUS_FLUSH_SIZE messages are waiting.
+    """
+
+    def __init__(self, app=None, flush_size=STATUS_FLUSH_SIZE, flush_interval=STATUS_FLUSH_INTERVAL):
+        self.app = app
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def init_app(self, app):
+        self.app = app
+
+    def add(self, sid, status, error_code=None):
+        with self._lock:
+            current = self._pending.get(sid)
+            if current is None or STATUS_RANKS.get(status, 0) >= STATUS_RANKS.get(current[0], 0):
+                self._pending[sid] = (status, error_code)
+            full = len(self._pending) >= self.flush_size
+            self._ensure_thread()
+        if full:
+            self._wake.set()
+
+    def _ensure_thread(self):
+        # Started lazily (and again after fork) so each worker process gets its own flusher;
+        # called under the lock so concurrent requests start only one
+        if self._thread is None or self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='status-callback-flush', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.exception(f"Failed to flush status callbacks: {str(e)}")
+
+    def flush(self):
+        with self._lock:
+            batch, self._pending = self._pending, {}
+        if not batch:
+            return 0
+        with self.app.app_context():
+            try:
+                with DB_FLUSH_SECONDS.time(operation='status_callbacks'):
+                    apply_status_updates(batch)
+                    db.session.commit()
+            except Exception:
+                db.session.rollback()
+                with self._lock:
+                    for sid, update_ in batch.items():
+                        self._pending.setdefault(sid, update_)
+                raise
+            finally:
+                db.session.remove()
+        return len(batch)
+
+def apply_status_updates(batch):
+    # Locked in SID order so two flushes touching the same messages can't deadlock (no-op on SQLite)
+    rows = db.session.execute(
+        select(ScheduledMessage.twilio_sid, ScheduledMessage.status)
+        .where(ScheduledMessage.twilio_sid.in_(list(batch)))
+        .order_by(ScheduledMessage.twilio_sid)
+        .with_for_update()
+    ).all()
+
+    transitions = {}
+    for sid, old_status in rows:
+        new_status, error_code = batch[sid]
+        if new_status == old_status or STATUS_RANKS.get(new_status, 0) < STATUS_RANKS.get(old_status, 0):
+            continue
+        transitions.setdefault((old_status, new_status, error_code), []).append(sid)
+
+    rollups = {}
+    failures = {}
+    now = datetime.utcnow()
+    for (old_status, new_status, error_code), sids in transitions.items():
+        # Only rows still in the status read above change, and only those are counted,
+        # so a message another flush moved in the meantime is neither regressed nor counted twice
+        updated = db.session.execute(
+            update(ScheduledMessage)
+            .where(ScheduledMessage.twilio_sid.in_(sids), ScheduledMessage.status == old_status)
+            .values(status=new_status, error_code=error_code, updated_at=now)
+            .returning(ScheduledMessage.twilio_sid, ScheduledMessage.scheduled_blast_id)
+        ).all()
+        for sid, blast_id in updated:
+            if error_code is not None and new_status in ROLLUP_COUNTERS['failed_count']:
+                failures[sid] = error_code
+            deltas = rollups.setdefault(blast_id, dict.fromkeys(ROLLUP_COUNTERS, 0))
+            for counter, statuses in ROLLUP_COUNTERS.items():
+                deltas[counter] += (new_status in statuses) - (old_status in statuses)
+
+    for blast_id, deltas in rollups.items():
+        values = {counter: getattr(ScheduledBlast, counter) + delta
+                  for counter, delta in deltas.items() if delta}
+        if deltas['sent_count'] > 0:
+            # The first message out of Twilio moves the whole blast to 'sent'
+            db.session.execute(
+                update(ScheduledBlast)
+                .where(ScheduledBlast.id == blast_id, ScheduledBlast.status == 'scheduled')
+                .values(status='sent')
+            )
+        if values:
+            db.session.execute(update(ScheduledBlast).where(ScheduledBlast.id == blast_id).values(**values))
+    suppress_message_sids(failures)
+
+status_buffer = StatusUpdateBuffer()
+atexit.register(status_buffer.flush)
+
+_missing_token_logged = threading.Event()
+
+def is_valid_twilio_request(public_url=None):
+    # An empty key would make every signature forgeable, so without the token nothing is accepted
+    if not TWILIO_AUTH_TOKEN:
+        if not _missing_token_logged.is_set():
+            _missing_token_logged.set()
+            logger.error("TWILIO_AUTH_TOKEN is not set; rejecting every Twilio webhook")
+        return False
+    signature = request.headers.get('X-Twilio-Signature', '')
+    url = public_url or request.url
+    return RequestValidator(TWILIO_AUTH_TOKEN).validate(url, request.form.to_dict(), signature)
+
+def reject_webhook(kind):
+    if TWILIO_AUTH_TOKEN:
+        logger.warning(f"Rejected {kind} with an invalid Twilio signature")
+    abort(403)
+
+@status_callbacks.route('/twilio/status_callback', methods=['POST'])
+def status_callback():
+    if not is_valid_twilio_request(TWILIO_STATUS_CALLBACK_URL):
+        reject_webhook('status callback')
+
+    sid = request.form.get('MessageSid')
+    status = request.form.get('MessageStatus')
+    if not sid or not status:
+        abort(400)
+    error_code = request.form.get('ErrorCode')
+    error_code = int(error_code) if error_code and error_code.isdigit() else None
+    if error_code in SUPPRESSION_ERROR_CODES:
+        # Written before acknowledging: Twilio doesn't resend a callback, and an
+        # opt-out still in the buffer would be lost if this process is killed.
+        # Only the status and the rollups wait for the next flush.
+        suppress_message_sids({sid: error_code})
+        db.session.commit()
+    status_buffer.add(sid, status, error_code)
+    return '', 204
+
+@status_callbacks.route('/twilio/inbound', methods=['POST'])
+def inbound_message():
+    if not is_valid_twilio_request(TWILIO_INBOUND_URL):
+        reject_webhook('inbound message')
+
+    phone_number = request.form.get('From')
+    action = opt_out_action(request.form.get('Body'), request.form.get('OptOutType'))
+    if phone_number and action == 'opt_out':
+        add_suppressions([(phone_number, 'opt_out', None)])
+        db.session.commit()
+        logger.info(f"Suppressed {phone_number} after an opt-out reply")
+    elif phone_number and action == 'opt_in':
+        remove_opt_out(phone_number)
+        db.session.commit()
+        logger.info(f"Removed opt-out for {phone_number}")
+    # Empty TwiML: Twilio's Advanced Opt-Out sends the confirmation reply itself
+    return '<Response/>', 200, {'Content-Type': 'text/xml'}
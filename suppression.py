@@ -0,0 +1,205 @@
+import os
+import threading
+import logging
+from array import array
+from bisect import bisect_left
+from datetime import datetime
+from sqlalchemy import select, delete, func
+from models import Suppression, ScheduledMessage, Recipient, db
+from db_utils import insert_for_dialect
+
+logger = logging.getLogger(__name__)
+
+SUPPRESSION_FILTER_BITS = int(os.environ.get("SUPPRESSION_FILTER_BITS", "16"))
+# Numbers added since the last full load are kept in a plain set until there are this many
+SUPPRESSION_REBUILD_THRESHOLD = int(os.environ.get("SUPPRESSION_REBUILD_THRESHOLD", "100000"))
+SUPPRESSION_LOAD_BATCH = 50000
+
+# Twilio error codes that mean a number should never be messaged again
+SUPPRESSION_ERROR_CODES = {
+    21610: 'opt_out',      # recipient replied STOP
+    21211: 'hard_bounce',  # invalid 'To' number
+    21614: 'hard_bounce',  # not a mobile number
+    30005: 'hard_bounce',  # unknown destination handset
+    30006: 'hard_bounce',  # landline or unreachable carrier
+}
+
+OPT_OUT_KEYWORDS = {'STOP', 'STOPALL', 'UNSUBSCRIBE', 'CANCEL', 'END', 'QUIT', 'REVOKE', 'OPTOUT'}
+OPT_IN_KEYWORDS = {'START', 'UNSTOP', 'YES'}
+
+def phone_key(phone_number):
+    # E.164 numbers are at most 15 digits with no leading zero, so they fit in an int64
+    try:
+        return int(phone_number.lstrip('+'))
+    except (AttributeError, ValueError):
+        return None
+
+class SuppressionIndex:
+    """Compact membership index over suppressed phone numbers.
+
+    Numbers are kept as a sorted int64 array (8 bytes each) behind a one-probe
+    bloom filter of SUPPRESSION_FILTER_BITS bits per number, so the common case,
+    a number that is not suppressed, costs one modulo and one bit test. Filter
+    hits are confirmed by binary search, so there are no false positives.
+    Numbers added after the index was built live in a small set.
+    """
+
+    def __init__(self, sorted_keys=None, bits_per_key=SUPPRESSION_FILTER_BITS):
+        self._keys = sorted_keys if sorted_keys is not None else array('q')
+        self._extra = set()
+        # Odd modulus so sequential number ranges spread over the whole bitmap
+        self._modulus = max(1024, len(self._keys) * bits_per_key) | 1
+        self._bits = bytearray(self._modulus // 8 + 1)
+        bits, modulus = self._bits, self._modulus
+        for key in self._keys:
+            position = key % modulus
+            bits[position >> 3] |= 1 << (position & 7)
+
+    def __len__(self):
+        return len(self._keys) + len(self._extra)
+
+    def contains_key(self, key):
+        position = key % self._modulus
+        if self._bits[position >> 3] & (1 << (position & 7)):
+            keys = self._keys
+            i = bisect_left(keys, key)
+            if i < len(keys) and keys[i] == key:
+                return True
+        return key in self._extra
+
+    def __contains__(self, phone_number):
+        key = phone_key(phone_number)
+        return key is not None and self.contains_key(key)
+
+    def add(self, phone_number):
+        key = phone_key(phone_number)
+        if key is not None and not self.contains_key(key):
+            self._extra.add(key)
+
+    @property
+    def pending(self):
+        return len(self._extra)
+
+    @property
+    def memory_bytes(self):
+        return len(self._bits) + self._keys.itemsize * len(self._keys)
+
+def load_suppression_keys():
+    # Ordering by (length, text) equals numeric order for digit strings without
+    # leading zeros, so rows stream straight into a sorted array.
+    keys = array('q')
+    in_order = True
+    last = -1
+    rows = db.session.execute(
+        select(Suppression.phone_number)
+        .order_by(func.length(Suppression.phone_number), Suppression.phone_number)
+        .execution_options(yield_per=SUPPRESSION_LOAD_BATCH)
+    ).scalars()
+    for phone_number in rows:
+        key = phone_key(phone_number)
+        if key is None:
+            continue
+        if key < last:
+            in_order = False
+        last = key
+        keys.append(key)
+    return keys if in_order else array('q', sorted(keys))
+
+class SuppressionCache:
+    """Per-process SuppressionIndex that is brought up to date before each use.
+
+    New suppressions (rows with a higher id) are added incrementally; when rows
+    were removed, or many were added, the index is rebuilt from scratch.
+    """
+
+    def __init__(self):
+        self._index = None
+        self._max_id = 0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def get(self):
+        with self._lock:
+            max_id, count = db.session.execute(
+                select(func.coalesce(func.max(Suppression.id), 0), func.count(Suppression.id))
+            ).one()
+            if self._index is not None and (max_id, count) == (self._max_id, self._count):
+                return self._index
+
+            if self._index is not None and count >= self._count:
+                added = db.session.execute(
+                    select(Suppression.phone_number).where(Suppression.id > self._max_id)
+                ).scalars().all()
+                if self._count + len(added) == count and self._index.pending + len(added) <= SUPPRESSION_REBUILD_THRESHOLD:
+                    for phone_number in added:
+                        self._index.add(phone_number)
+                    self._max_id, self._count = max_id, count
+                    return self._index
+
+            self._index = SuppressionIndex(load_suppression_keys())
+            self._max_id, self._count = max_id, count
+            logger.info(f"Loaded suppression index: {len(self._index)} numbers, "
+                        f"{self._index.memory_bytes / (1024 * 1024):.1f} MB")
+            return self._index
+
+suppression_cache = SuppressionCache()
+
+def get_suppression_index():
+    return suppression_cache.get()
+
+def add_suppressions(entries):
+    """Persist `(phone_number, reason, error_code)` entries, ignoring numbers already suppressed."""
+    rows = {}
+    for phone_number, reason, error_code in entries:
+        rows.setdefault(phone_number, {
+            'phone_number': phone_number,
+            'reason': reason,
+            'error_code': error_code,
+            'created_at': datetime.utcnow(),
+        })
+    if not rows:
+        return 0
+    db.session.execute(
+        insert_for_dialect(Suppression).values(list(rows.values()))
+        .on_conflict_do_nothing(index_elements=[Suppression.phone_number])
+    )
+    return len(rows)
+
+def remove_opt_out(phone_number):
+    # Only a STOP can be undone by the recipient; hard bounces stay suppressed
+    db.session.execute(
+        delete(Suppression).where(Suppression.phone_number == phone_number, Suppression.reason == 'opt_out')
+    )
+
+def suppress_failed_sends(results):
+    return add_suppressions(
+        (result.to, SUPPRESSION_ERROR_CODES[result.error_code], result.error_code)
+        for result in results
+        if not result.ok and result.error_code in SUPPRESSION_ERROR_CODES
+    )
+
+def suppress_message_sids(error_codes_by_sid):
+    sids = [sid for sid, error_code in error_codes_by_sid.items() if error_code in SUPPRESSION_ERROR_CODES]
+    if not sids:
+        return 0
+    rows = db.session.execute(
+        select(ScheduledMessage.twilio_sid, Recipient.phone_number)
+        .join(Recipient, Recipient.id == ScheduledMessage.recipient_id)
+        .where(ScheduledMessage.twilio_sid.in_(sids))
+    ).all()
+    return add_suppressions(
+        (phone_number, SUPPRESSION_ERROR_CODES[error_codes_by_sid[sid]], error_codes_by_sid[sid])
+        for sid, phone_number in rows
+    )
+
+def opt_out_action(body, opt_out_type=None):
+    """Return 'opt_out', 'opt_in' or None for an inbound message."""
+    if opt_out_type:
+        keyword = opt_out_type.upper()
+        return {'STOP': 'opt_out', 'START': 'opt_in'}.get(keyword)
+    keyword = (body or '').strip().upper()
+    if keyword in OPT_OUT_KEYWORDS:
+        return 'opt_out'
+    if keyword in OPT_IN_KEYWORDS:
+        return 'opt_in'
+    return None
@@ -0,0 +1,108 @@
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import fake_twilio
+
+# Set before the app is imported: the Twilio settings are read at import time
+WORKDIR = tempfile.mkdtemp(prefix='twilio-scheduler-tests-')
+FAKE_TWILIO, FAKE_TWILIO_URL = fake_twilio.start_in_thread()
+os.environ.update({
+    'DATABASE_URL': f"sqlite:///{os.path.join(WORKDIR, 'test.db')}",
+    'TWILIO_API_BASE_URL': FAKE_TWILIO_URL,
+    'TWILIO_ACCOUNT_SID': 'ACtest',
+    'TWILIO_AUTH_TOKEN': 'test-token',
+    'TWILIO_MESSAGING_SERVICE_SID': 'MGtest',
+    'TWILIO_MESSAGING_MPS': '1000',
+})
+
+from app import create_app, db
+import blast_jobs  # noqa: F401 registers the job handlers
+import suppression
+from models import User, ScheduledBlast, Recipient, RecipientBlastAssociation, Job
+
+@pytest.fixture(scope='session')
+def app():
+    return create_app()
+
+@pytest.fixture(autouse=True)
+def database(app, monkeypatch):
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+    # The cache compares row ids, which start over with every fresh database
+    monkeypatch.setattr(suppression, 'suppression_cache', suppression.SuppressionCache())
+    FAKE_TWILIO.state.messages.clear()
+    yield
+    with app.app_context():
+        db.session.remove()
+
+@pytest.fixture
+def fake_twilio_messages():
+    return FAKE_TWILIO.state.messages
+
+@pytest.fixture
+def user_id(app):
+    with app.app_context():
+        user = User(username='user', email='user@example.com')
+        user.set_password('password')
+        db.session.add(user)
+        db.session.commit()
+        return user.id
+
+@pytest.fixture
+def client(app, user_id):
+    client = app.test_client()
+    client.post('/login', data={'username': 'user', 'password': 'password'})
+    return client
+
+@pytest.fixture
+def ctx(app):
+    with app.app_context():
+        yield
+
+@pytest.fixture
+def make_blast(user_id):
+    """Create a blast with `recipients` phone numbers attached, inside an app context."""
+    def make_blast(recipients=(), status='queued', scheduled_time=None, **fields):
+        blast = ScheduledBlast(user_id=user_id, message_template='Hi {name|there}', status=status,
+                               scheduled_time=scheduled_time or datetime.utcnow() + timedelta(hours=1), **fields)
+        db.session.add(blast)
+        db.session.flush()
+        for phone_number in recipients:
+            recipient = Recipient(phone_number=phone_number)
+            db.session.add(recipient)
+            db.session.flush()
+            db.session.add(RecipientBlastAssociation(recipient_id=recipient.id, scheduled_blast_id=blast.id))
+        db.session.commit()
+        return blast
+    return make_blast
+
+@pytest.fixture
+def run_jobs(app):
+    """Run due jobs the way a worker does, until none is left."""
+    from job_queue import claim_next_job, run_job
+
+    def run_jobs():
+        ran = []
+        with app.app_context():
+            while True:
+                job = claim_next_job('test-worker')
+                if job is None:
+                    return ran
+                ran.append(job.kind)
+                run_job(job, app)
+    return run_jobs
+
+def schedule_time(delta):
+    """The dashboard form's US/Eastern wall-clock value for now + `delta`."""
+    import pytz
+    return (datetime.now(pytz.timezone('US/Eastern')) + delta).strftime('%Y-%m-%dT%H:%M')
+
+def latest_job(kind):
+    return Job.query.filter_by(kind=kind).order_by(Job.id.desc()).first()
@@ -0,0 +1,219 @@
+import io
+from datetime import datetime, timedelta
+import pytest
+import blast_jobs
+import local_scheduler
+from conftest import schedule_time, latest_job
+from dispatch_planner import TWILIO_SCHEDULE_WINDOW
+from models import ScheduledBlast, ScheduledMessage, Suppression, UploadPart, Job, db
+
+CSV = ('phone_number,name,timezone\n'
+       '+12125550001,Ann,\n'
+       '+13125550002,Bob,\n'
+       '+14155550003,Cy,\n'
+       '+447700900004,Di,\n'
+       'not-a-number,Ed,\n')
+
+def post_blast(client, when, csv=CSV, **fields):
+    data = {'csv_file': (io.BytesIO(csv.encode()), 'recipients.csv'), 'message_template': 'Hi {name}',
+            'scheduled_time': when, **fields}
+    return client.post('/schedule_blast', data=data, content_type='multipart/form-data')
+
+def statuses(blast_id):
+    return sorted(message.status for message in ScheduledMessage.query.filter_by(scheduled_blast_id=blast_id))
+
+def latest_job_id(app, kind):
+    with app.app_context():
+        return latest_job(kind).id
+
+def test_schedule_blast_returns_before_sending(app, client, fake_twilio_messages):
+    response = post_blast(client, schedule_time(timedelta(hours=2)))
+    assert response.status_code == 302
+    assert fake_twilio_messages == {}
+    with app.app_context():
+        job = latest_job('schedule_blast')
+        assert (job.status, job.scheduled_blast.status) == ('queued', 'queued')
+
+def test_schedule_blast_sends_every_valid_recipient(app, client, run_jobs, fake_twilio_messages):
+    post_blast(client, schedule_time(timedelta(hours=2)))
+    assert run_jobs() == ['schedule_blast']
+
+    with app.app_context():
+        job = latest_job('schedule_blast')
+        blast = job.scheduled_blast
+        assert (job.status, blast.status, blast.scheduled_count) == ('done', 'scheduled', 4)
+        assert job.payload['invalid_count'] == 1
+        assert job.progress_done == job.progress_total == 4
+        assert statuses(blast.id) == ['scheduled'] * 4
+    assert sorted(message['body'] for message in fake_twilio_messages.values()) == ['Hi Ann', 'Hi Bob', 'Hi Cy', 'Hi Di']
+    assert {message['status'] for message in fake_twilio_messages.values()} == {'scheduled'}
+
+    job_id = latest_job_id(app, 'schedule_blast')
+    progress = client.get(f'/jobs/{job_id}').get_json()
+    assert (progress['status'], progress['blast_status'], progress['progress_done']) == ('done', 'scheduled', 4)
+
+def test_upload_is_read_from_the_database_not_the_web_host(app, client, run_jobs, fake_twilio_messages):
+    post_blast(client, schedule_time(timedelta(hours=2)))
+    with app.app_context():
+        payload = latest_job('schedule_blast').payload
+        assert 'upload_path' not in payload
+        assert UploadPart.query.filter_by(upload_id=payload['upload_id']).count() > 0
+    run_jobs()
+
+    with app.app_context():
+        assert UploadPart.query.count() == 0
+    assert len(fake_twilio_messages) == 4
+
+def test_suppressed_numbers_are_left_out(app, client, run_jobs, fake_twilio_messages):
+    with app.app_context():
+        db.session.add(Suppression(phone_number='+13125550002', reason='opt_out'))
+        db.session.commit()
+    post_blast(client, schedule_time(timedelta(hours=2)))
+    run_jobs()
+
+    with app.app_context():
+        job = latest_job('schedule_blast')
+        assert (job.payload['suppressed'], job.scheduled_blast.scheduled_count) == (1, 3)
+    assert sorted(message['body'] for message in fake_twilio_messages.values()) == ['Hi Ann', 'Hi Cy', 'Hi Di']
+
+def test_blast_that_drifts_inside_twilio_lead_while_queued_is_sent_now(app, client, run_jobs, fake_twilio_messages):
+    post_blast(client, schedule_time(timedelta(minutes=20)))
+    with app.app_context():
+        # The job waited in the queue until Twilio would reject the send_at
+        ScheduledBlast.query.one().scheduled_time = datetime.utcnow() + timedelta(minutes=10)
+        db.session.commit()
+    run_jobs()
+
+    with app.app_context():
+        job = latest_job('schedule_blast')
+        assert (job.status, job.payload['send_now'], job.scheduled_blast.status) == ('done', True, 'sent')
+        assert 'plan' not in job.payload
+    assert len(fake_twilio_messages) == 4
+    assert {message['status'] for message in fake_twilio_messages.values()} == {'queued'}
+
+def test_cancel_blast_cancels_scheduled_messages(app, client, run_jobs, fake_twilio_messages):
+    post_blast(client, schedule_time(timedelta(hours=2)))
+    run_jobs()
+    with app.app_context():
+        blast_id = ScheduledBlast.query.one().id
+
+    client.post(f'/cancel_blast/{blast_id}')
+    with app.app_context():
+        assert db.session.get(ScheduledBlast, blast_id).status == 'canceling'
+    # A second click while the first job is live queues nothing
+    client.post(f'/cancel_blast/{blast_id}')
+    assert run_jobs() == ['cancel_blast']
+
+    with app.app_context():
+        blast = db.session.get(ScheduledBlast, blast_id)
+        assert (blast.status, blast.scheduled_count) == ('canceled', 0)
+        assert statuses(blast_id) == ['canceled'] * 4
+    assert {message['status'] for message in fake_twilio_messages.values()} == {'canceled'}
+
+def test_partially_failed_cancel_leaves_the_rest_cancelable(app, client, run_jobs, fake_twilio_messages):
+    post_blast(client, schedule_time(timedelta(hours=2)))
+    run_jobs()
+    with app.app_context():
+        blast_id = ScheduledBlast.query.one().id
+        kept = ScheduledMessage.query.filter_by(scheduled_blast_id=blast_id).first().twilio_sid
+    # Twilio no longer knows one of the messages
+    fake_twilio_messages.pop(kept)
+
+    client.post(f'/cancel_blast/{blast_id}')
+    run_jobs()
+    with app.app_context():
+        assert db.session.get(ScheduledBlast, blast_id).status == 'partially_canceled'
+        assert statuses(blast_id) == ['cancel_failed', 'canceled', 'canceled', 'canceled']
+
+def test_far_blast_is_held_and_canceled_without_twilio(app, client, run_jobs, fake_twilio_messages):
+    post_blast(client, schedule_time(timedelta(days=20)))
+    assert run_jobs() == ['schedule_blast']
+    with app.app_context():
+        blast = ScheduledBlast.query.one()
+        release = latest_job('release_blast')
+        assert blast.status == 'held'
+        assert release.run_at > datetime.utcnow()
+        assert release.run_at == blast.scheduled_time - TWILIO_SCHEDULE_WINDOW + local_scheduler.LOCAL_RELEASE_MARGIN
+        blast_id = blast.id
+
+    client.post(f'/cancel_blast/{blast_id}')
+    with app.app_context():
+        assert db.session.get(ScheduledBlast, blast_id).status == 'canceled'
+        blast = db.session.get(ScheduledBlast, blast_id)
+        release = latest_job('release_blast')
+        assert (release.status, blast.scheduled_count) == ('canceled', 0)
+        assert release.finished_at is not None
+    assert fake_twilio_messages == {}
+
+def test_held_blast_is_released_to_twilio_scheduling(app, client, run_jobs, fake_twilio_messages):
+    post_blast(client, schedule_time(timedelta(days=20)))
+    run_jobs()
+    with app.app_context():
+        blast = ScheduledBlast.query.one()
+        blast.scheduled_time = datetime.utcnow() + timedelta(days=6)
+        latest_job('release_blast').run_at = datetime.utcnow()
+        db.session.commit()
+
+    assert run_jobs() == ['release_blast']
+    with app.app_context():
+        assert ScheduledBlast.query.one().status == 'scheduled'
+        assert latest_job('release_blast').status == 'done'
+    assert len(fake_twilio_messages) == 4
+    assert {message['status'] for message in fake_twilio_messages.values()} == {'scheduled'}
+
+def test_release_past_twilio_lead_sends_now(app, client, run_jobs, fake_twilio_messages):
+    post_blast(client, schedule_time(timedelta(days=20)))
+    run_jobs()
+    with app.app_context():
+        ScheduledBlast.query.one().scheduled_time = datetime.utcnow() + timedelta(minutes=5)
+        latest_job('release_blast').run_at = datetime.utcnow()
+        db.session.commit()
+
+    run_jobs()
+    with app.app_context():
+        assert ScheduledBlast.query.one().status == 'sent'
+        assert latest_job('release_blast').payload['send_now'] is True
+    assert {message['status'] for message in fake_twilio_messages.values()} == {'queued'}
+
+def test_local_time_blast_is_released_for_its_earliest_timezone(app, client, run_jobs, monkeypatch):
+    # Direct mode would hold until the scheduled time; local-time blasts still
+    # need Twilio's send_at for every timezone but the first
+    hold_blast = blast_jobs.hold_blast
+    monkeypatch.setattr(blast_jobs, 'hold_blast', lambda blast, user_id, **kwargs: hold_blast(blast, user_id, mode='direct', **kwargs))
+    post_blast(client, schedule_time(timedelta(days=20)), local_time='1', timezone_column='timezone')
+    run_jobs()
+
+    with app.app_context():
+        blast = ScheduledBlast.query.one()
+        release = latest_job('release_blast')
+        first_send_at = blast_jobs.first_local_send_time(blast)
+        assert (blast.status, release.payload['send_mode']) == ('held', 'twilio')
+        # London reaches the wall-clock time hours before New York does
+        assert first_send_at < blast.scheduled_time
+        assert release.run_at == first_send_at - TWILIO_SCHEDULE_WINDOW + local_scheduler.LOCAL_RELEASE_MARGIN
+
+        blast.scheduled_time -= timedelta(days=14)
+        release.run_at = datetime.utcnow()
+        db.session.commit()
+
+    assert run_jobs() == ['release_blast']
+    with app.app_context():
+        blast = ScheduledBlast.query.one()
+        plan = latest_job('release_blast').payload['plan']
+        assert blast.status == 'scheduled'
+        assert not latest_job('release_blast').payload.get('send_now')
+        starts = {bucket['start'] for bucket in plan['buckets'].values()}
+        assert len(plan['buckets']) == 4 and len(starts) == 4
+
+@pytest.mark.parametrize('kind, status', [('schedule_blast', 'queued'), ('release_blast', 'held')])
+def test_abandoned_blast_job_fails_its_blast(app, ctx, make_blast, run_jobs, kind, status):
+    from job_queue import enqueue_job, JOB_MAX_ATTEMPTS
+    blast = make_blast(status=status)
+    job = enqueue_job(kind, scheduled_blast_id=blast.id)
+    job.attempts = JOB_MAX_ATTEMPTS
+    db.session.commit()
+    blast_id, job_id = blast.id, job.id
+
+    run_jobs()
+    assert db.session.get(Job, job_id, populate_existing=True).status == 'failed'
+    assert db.session.get(ScheduledBlast, blast_id, populate_existing=True).status == 'failed'
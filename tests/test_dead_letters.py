@@ -0,0 +1,59 @@
+from datetime import datetime, timedelta
+import pytz
+from dead_letters import record_dead_letters
+from twilio_dispatch import DispatchResult
+from models import DeadLetter, ScheduledBlast, ScheduledMessage, db
+
+def throttled(recipient_id, phone_number, send_at):
+    params = {'messaging_service_sid': 'MGtest', 'body': 'Hi', 'to': phone_number, 'schedule_type': 'fixed',
+              'send_at': pytz.UTC.localize(send_at).isoformat()}
+    return DispatchResult(recipient_id, params, error='Too Many Requests', error_code=20429, attempts=5)
+
+def failed_blast(make_blast, permanent=False):
+    # Every message ran out of retries on 429s, so the blast itself failed
+    blast = make_blast(['+15550000001', '+15550000002'], status='failed')
+    results = [throttled(association.recipient_id, association.recipient.phone_number,
+                         blast.scheduled_time) for association in blast.recipient_associations]
+    for result in results:
+        result.permanent = permanent
+    record_dead_letters(blast.id, results)
+    db.session.commit()
+    return blast.id
+
+def test_fully_dead_lettered_blast_can_be_replayed(app, client, make_blast, run_jobs, fake_twilio_messages):
+    with app.app_context():
+        blast_id = failed_blast(make_blast)
+    assert 'Resend Failed (2)' in client.get('/dashboard').data.decode()
+
+    client.post(f'/replay_failed/{blast_id}')
+    assert run_jobs() == ['replay_dead_letters']
+    with app.app_context():
+        blast = db.session.get(ScheduledBlast, blast_id)
+        assert (blast.status, blast.scheduled_count) == ('scheduled', 2)
+        assert {message.status for message in ScheduledMessage.query} == {'scheduled'}
+        assert DeadLetter.query.filter(DeadLetter.replayed_at.is_(None)).count() == 0
+    assert len(fake_twilio_messages) == 2
+
+def test_failed_blast_without_replayable_letters_is_not_replayed(app, client, make_blast, run_jobs):
+    with app.app_context():
+        blast_id = failed_blast(make_blast, permanent=True)
+    assert 'Resend Failed' not in client.get('/dashboard').data.decode()
+
+    client.post(f'/replay_failed/{blast_id}')
+    assert run_jobs() == []
+    with app.app_context():
+        assert db.session.get(ScheduledBlast, blast_id).status == 'failed'
+
+def test_expired_letters_are_skipped(app, client, make_blast, run_jobs, fake_twilio_messages):
+    with app.app_context():
+        blast_id = failed_blast(make_blast)
+        for letter in DeadLetter.query:
+            too_soon = pytz.UTC.localize(datetime.utcnow() + timedelta(minutes=5)).isoformat()
+            letter.message_params = {**letter.message_params, 'send_at': too_soon}
+        db.session.commit()
+
+    client.post(f'/replay_failed/{blast_id}')
+    run_jobs()
+    with app.app_context():
+        assert db.session.get(ScheduledBlast, blast_id).status == 'failed'
+    assert fake_twilio_messages == {}
@@ -0,0 +1,118 @@
+from datetime import datetime, timedelta
+import pytest
+from dispatch_chunks import (split_blast, create_chunks, claim_next_chunk, finish_dispatch, sending_workers,
+                             LeaseLost, CHUNK_MAX_ATTEMPTS)
+from job_queue import enqueue_job
+from models import DispatchChunk, ScheduledBlast, ScheduledMessage, db
+
+@pytest.fixture
+def chunked_blast(ctx, make_blast):
+    blast = make_blast([f'+1555000{i:04d}' for i in range(5)], status='dispatching')
+    job = enqueue_job('schedule_blast', scheduled_blast_id=blast.id)
+    db.session.flush()
+    chunks, _ = split_blast(blast.id, chunk_size=2)
+    create_chunks(blast.id, job.id, chunks)
+    db.session.commit()
+    return blast.id
+
+def expire(lease):
+    db.session.get(DispatchChunk, lease.id).lease_expires_at = datetime.utcnow() - timedelta(seconds=1)
+    db.session.commit()
+
+def test_split_blast_cuts_recipients_in_id_order(ctx, make_blast):
+    blast = make_blast([f'+1555000{i:04d}' for i in range(5)])
+    chunks, _ = split_blast(blast.id, chunk_size=2)
+    assert [(chunk['seq'], chunk['first_index'], chunk['messages']) for chunk in chunks] == [(0, 0, 2), (1, 2, 2), (2, 4, 1)]
+    assert chunks[0]['last_recipient_id'] < chunks[1]['first_recipient_id']
+
+def test_split_blast_counts_buckets_before_each_chunk(ctx, make_blast):
+    blast = make_blast(['+12125550001', '+447700900001', '+12125550002'])
+    chunks, counts = split_blast(blast.id, chunk_size=2, bucket_of=lambda recipient: recipient.phone_number[:2])
+    assert counts == {'+1': 2, '+4': 1}
+    assert [chunk['bucket_offsets'] for chunk in chunks] == [{}, {'+1': 1, '+4': 1}]
+
+def test_chunks_are_claimed_once_in_order(chunked_blast):
+    first = claim_next_chunk('worker-a', chunked_blast)
+    second = claim_next_chunk('worker-b', chunked_blast)
+    assert (first.seq, first.token, second.seq) == (0, 1, 1)
+    assert sending_workers() == 2
+
+def test_expired_lease_is_taken_over(chunked_blast):
+    stalled = claim_next_chunk('worker-a', chunked_blast)
+    expire(stalled)
+    taken = claim_next_chunk('worker-b', chunked_blast)
+    assert (taken.id, taken.owner, taken.token) == (stalled.id, 'worker-b', 2)
+
+    # The stalled worker can neither renew nor complete once it resumes
+    with pytest.raises(LeaseLost):
+        stalled.renew(1)
+    with pytest.raises(LeaseLost):
+        stalled.complete(2, 2)
+    taken.complete(2, 2)
+    db.session.commit()
+    chunk = db.session.get(DispatchChunk, taken.id)
+    assert (chunk.status, chunk.succeeded) == ('done', 2)
+
+def test_released_chunk_goes_back_until_out_of_attempts(chunked_blast):
+    for attempt in range(1, CHUNK_MAX_ATTEMPTS + 1):
+        lease = claim_next_chunk('worker-a', chunked_blast)
+        assert (lease.seq, lease.token) == (0, attempt)
+        gave_up = lease.release('Twilio unavailable')
+        db.session.commit()
+        assert gave_up == (attempt == CHUNK_MAX_ATTEMPTS)
+    chunk = db.session.get(DispatchChunk, lease.id, populate_existing=True)
+    assert (chunk.status, chunk.error) == ('failed', 'Twilio unavailable')
+    assert claim_next_chunk('worker-a', chunked_blast).seq == 1
+
+def test_finish_dispatch_waits_for_every_chunk(chunked_blast):
+    leases = [claim_next_chunk('worker-a', chunked_blast) for _ in range(3)]
+    for lease in leases[:2]:
+        lease.complete(2, 2)
+    db.session.commit()
+    assert finish_dispatch(chunked_blast) is False
+    assert db.session.get(ScheduledBlast, chunked_blast).status == 'dispatching'
+
+    leases[2].complete(1, 0)
+    db.session.commit()
+    assert finish_dispatch(chunked_blast) is True
+    assert db.session.get(ScheduledBlast, chunked_blast, populate_existing=True).status == 'scheduled'
+    # A second worker finishing at the same time finds it already settled
+    assert finish_dispatch(chunked_blast) is True
+
+def test_lost_lease_mid_chunk_sends_no_recipient_twice(app, ctx, make_blast, fake_twilio_messages, monkeypatch):
+    from conftest import FAKE_TWILIO
+    import blast_jobs
+    from blast_jobs import run_chunk
+    from dispatch_chunks import ChunkLease
+    # Slow sends keep a full pool's worth in flight when the lease goes
+    monkeypatch.setattr(FAKE_TWILIO.state, 'latency', 0.02)
+    monkeypatch.setattr(blast_jobs, 'RESULT_FLUSH_SIZE', 5)
+    recipients = [f'+1555000{i:04d}' for i in range(120)]
+    blast = make_blast(recipients, status='dispatching')
+    job = enqueue_job('schedule_blast', {'send_now': True}, scheduled_blast_id=blast.id)
+    db.session.flush()
+    chunks, _ = split_blast(blast.id, chunk_size=len(recipients))
+    create_chunks(blast.id, job.id, chunks)
+    db.session.commit()
+    blast_id = blast.id
+
+    stalled = claim_next_chunk('worker-a', blast_id)
+    renewals = []
+
+    def renew(dispatched):
+        # Taken over at the third flush, while later sends are still out at Twilio
+        renewals.append(dispatched)
+        if len(renewals) == 3:
+            raise LeaseLost(f"Lease on {stalled} was taken over")
+        ChunkLease.renew(stalled, dispatched)
+    monkeypatch.setattr(stalled, 'renew', renew)
+    run_chunk(stalled)
+    sent_by_stalled = len(fake_twilio_messages)
+    assert 10 < sent_by_stalled < len(recipients)
+
+    expire(stalled)
+    run_chunk(claim_next_chunk('worker-b', blast_id))
+    sent_to = [message['to'] for message in fake_twilio_messages.values()]
+    assert sorted(sent_to) == recipients
+    assert ScheduledMessage.query.filter_by(scheduled_blast_id=blast_id).count() == len(recipients)
+    assert db.session.get(ScheduledBlast, blast_id, populate_existing=True).status == 'sent'
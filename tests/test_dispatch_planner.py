@@ -0,0 +1,46 @@
+from datetime import datetime, timedelta
+import pytest
+import dispatch_planner
+from dispatch_planner import BlastPlan, DispatchPlanError, plan_blast, outstanding_scheduled_messages
+
+START = datetime(2030, 1, 1, 12, 0)
+
+def test_chunks_are_staggered_at_the_delivery_rate():
+    plan = BlastPlan(START, 2500, rate=10, chunk_size=1000)
+    assert plan.chunks == 3
+    assert [plan.send_at(index) for index in (0, 999, 1000, 2000, 2499)] == \
+        [START, START, START + timedelta(seconds=100), START + timedelta(seconds=200), START + timedelta(seconds=200)]
+    assert plan.finishes_at == START + timedelta(seconds=250)
+
+def test_overlapping_buckets_share_one_timeline():
+    buckets = {'America/New_York': (START, 1000), 'America/Chicago': (START, 1000)}
+    plan = BlastPlan(START, 2000, rate=10, chunk_size=1000, buckets=buckets)
+    assert sorted([plan.send_at(0, 'America/New_York'), plan.send_at(0, 'America/Chicago')]) == \
+        [START, START + timedelta(seconds=100)]
+
+def test_plan_round_trips_through_its_dict():
+    buckets = {'Europe/London': (START, 10), 'America/New_York': (START + timedelta(hours=5), 10)}
+    plan = BlastPlan(START, 20, rate=1, chunk_size=5, buckets=buckets)
+    rebuilt = BlastPlan.from_dict(START, plan.as_dict())
+    assert rebuilt.as_dict() == plan.as_dict()
+
+def test_blast_running_past_twilio_window_is_rejected(ctx, make_blast):
+    blast = make_blast(scheduled_time=datetime.utcnow() + timedelta(days=6, hours=23))
+    with pytest.raises(DispatchPlanError, match='7-day'):
+        # Two hours of messages at the delivery rate, starting an hour before the window closes
+        plan_blast(blast, int(dispatch_planner.TWILIO_DELIVERY_MPS * 3600 * 2))
+
+def test_blast_is_rejected_without_room_under_the_account_limit(ctx, make_blast, monkeypatch):
+    monkeypatch.setattr(dispatch_planner, 'TWILIO_SCHEDULED_MESSAGE_LIMIT', 100)
+    earlier = make_blast(status='scheduled')
+    plan_blast(earlier, 80)
+    assert outstanding_scheduled_messages() == 80
+
+    with pytest.raises(DispatchPlanError, match='only 20'):
+        plan_blast(make_blast(), 30)
+
+def test_local_buckets_too_close_to_send_move_to_the_earliest_allowed_time(ctx, make_blast):
+    now = datetime.utcnow()
+    blast = make_blast(scheduled_time=now + timedelta(hours=1), local_time=True)
+    plan = plan_blast(blast, 2, buckets={'Europe/London': (now, 1), 'America/New_York': (now + timedelta(hours=5), 1)}, now=now)
+    assert plan.send_at(0, 'Europe/London') == (now + dispatch_planner.TWILIO_MIN_SCHEDULE_LEAD).replace(microsecond=0)
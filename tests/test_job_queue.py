@@ -0,0 +1,83 @@
+from datetime import datetime, timedelta
+import job_queue
+from job_queue import (enqueue_job, claim_next_job, run_job, live_job_filter, supersede_stale_jobs,
+                       JOB_LEASE_SECONDS, JOB_MAX_ATTEMPTS)
+from models import Job, ScheduledBlast, db
+
+def expire_lease(job_id):
+    job = db.session.get(Job, job_id)
+    job.heartbeat_at = datetime.utcnow() - timedelta(seconds=JOB_LEASE_SECONDS + 1)
+    db.session.commit()
+
+def test_job_is_claimed_by_one_worker(ctx, make_blast):
+    blast = make_blast()
+    job = enqueue_job('cancel_blast', scheduled_blast_id=blast.id)
+    db.session.commit()
+
+    claimed = claim_next_job('worker-a')
+    assert (claimed.id, claimed.status, claimed.locked_by, claimed.attempts) == (job.id, 'running', 'worker-a', 1)
+    assert claim_next_job('worker-b') is None
+
+def test_job_waits_for_its_run_at(ctx):
+    enqueue_job('cancel_blast', run_at=datetime.utcnow() + timedelta(hours=1))
+    db.session.commit()
+    assert claim_next_job('worker-a') is None
+
+def test_expired_lease_is_claimed_again_and_fences_the_old_run(app, ctx, make_blast):
+    blast = make_blast(status='canceled')
+    job = enqueue_job('cancel_blast', scheduled_blast_id=blast.id)
+    db.session.commit()
+    job_id = job.id
+    first = claim_next_job('worker-a')
+    attempt = first.attempts
+    assert Job.query.filter(Job.id == job_id, live_job_filter()).count() == 1
+
+    expire_lease(job_id)
+    assert Job.query.filter(Job.id == job_id, live_job_filter()).count() == 0
+    second = claim_next_job('worker-b')
+    assert (second.id, second.locked_by, second.attempts) == (job_id, 'worker-b', 2)
+
+    # The first worker finishing late must not settle the job the second one now runs
+    assert job_queue._settle_job(job_id, attempt, status='done') == 0
+    assert db.session.get(Job, job_id, populate_existing=True).status == 'running'
+
+def test_job_is_abandoned_after_max_attempts(app, ctx, make_blast):
+    blast = make_blast(status='dispatching')
+    job = enqueue_job('schedule_blast', {'upload_id': None}, scheduled_blast_id=blast.id)
+    job.status = 'running'
+    job.attempts = JOB_MAX_ATTEMPTS
+    db.session.commit()
+    expire_lease(job.id)
+
+    run_job(claim_next_job('worker-a'), app)
+    job = db.session.get(Job, job.id, populate_existing=True)
+    assert job.status == 'failed'
+    assert 'Gave up' in job.error
+    assert db.session.get(ScheduledBlast, blast.id, populate_existing=True).status == 'failed'
+
+def test_handler_error_fails_the_job(app, ctx, monkeypatch):
+    def broken(job):
+        raise ValueError('boom')
+    monkeypatch.setitem(job_queue.JOB_HANDLERS, 'broken', broken)
+    job = enqueue_job('broken')
+    db.session.commit()
+    job_id = job.id
+
+    run_job(claim_next_job('worker-a'), app)
+    job = db.session.get(Job, job_id, populate_existing=True)
+    assert (job.status, job.error) == ('failed', 'boom')
+
+def test_supersede_stale_jobs_only_touches_expired_runs(ctx, make_blast):
+    blast = make_blast()
+    live = enqueue_job('cancel_blast', scheduled_blast_id=blast.id)
+    stale = enqueue_job('cancel_blast', scheduled_blast_id=blast.id)
+    for job in (live, stale):
+        job.status = 'running'
+        job.heartbeat_at = datetime.utcnow()
+    db.session.commit()
+    expire_lease(stale.id)
+
+    assert supersede_stale_jobs(blast.id, 'cancel_blast') == 1
+    db.session.commit()
+    assert db.session.get(Job, live.id).status == 'running'
+    assert db.session.get(Job, stale.id).status == 'failed'
@@ -0,0 +1,39 @@
+from message_templates import sms_segments, compile_template, estimate_segments, SMS_SEGMENT_PRICE
+
+class Recipient:
+    def __init__(self, phone_number, name=None, email=None, custom_fields=None):
+        self.phone_number = phone_number
+        self.name = name
+        self.email = email
+        self.custom_fields = custom_fields
+
+def test_gsm7_segments():
+    assert sms_segments('a' * 160) == ('GSM-7', 160, 1)
+    assert sms_segments('a' * 161) == ('GSM-7', 161, 2)
+    assert sms_segments('a' * 306) == ('GSM-7', 306, 2)
+    assert sms_segments('a' * 307) == ('GSM-7', 307, 3)
+
+def test_gsm7_extension_characters_take_two_septets():
+    assert sms_segments('€' * 80) == ('GSM-7', 160, 1)
+    assert sms_segments('a' + '€' * 80) == ('GSM-7', 161, 2)
+
+def test_ucs2_segments():
+    assert sms_segments('✓' * 70) == ('UCS-2', 70, 1)
+    assert sms_segments('✓' * 71) == ('UCS-2', 71, 2)
+    # Characters outside the BMP take two UTF-16 code units
+    assert sms_segments('😀' * 35) == ('UCS-2', 70, 1)
+    assert sms_segments('😀' * 36) == ('UCS-2', 72, 2)
+
+def test_render_uses_defaults_and_custom_fields():
+    template = compile_template('Hi {name|there}, {city|your town} {missing}!')
+    assert template.render(Recipient('+15550000001', name='Ann', custom_fields={'city': 'NYC'})) == 'Hi Ann, NYC !'
+    assert template.render(Recipient('+15550000002', custom_fields={'city': ''})) == 'Hi there, your town !'
+    assert template.missing_fields(['phone_number', 'city']) == ['missing']
+
+def test_estimate_segments():
+    pages = [[Recipient('+15550000001', name='Ann'), Recipient('+15550000002', name='Zoë ✓')],
+             [Recipient('+15550000003', name='b' * 160)]]
+    estimate = estimate_segments('Hi {name}', pages)
+    assert {key: estimate[key] for key in ('messages', 'segments', 'ucs2_messages', 'max_length')} == \
+        {'messages': 3, 'segments': 4, 'ucs2_messages': 1, 'max_length': 163}
+    assert estimate['estimated_cost'] == round(4 * SMS_SEGMENT_PRICE, 4)
@@ -0,0 +1,69 @@
+import io
+from datetime import timedelta
+from conftest import schedule_time, latest_job
+from models import RecipientList, RecipientListMember, Suppression, db
+
+def csv_file(rows):
+    return io.BytesIO(('phone_number,name,city\n' + '\n'.join(rows)).encode()), 'list.csv'
+
+def post_blast(client, template='Hi {name} {city}', **fields):
+    return client.post('/schedule_blast', data={'message_template': template,
+                                                'scheduled_time': schedule_time(timedelta(hours=2)), **fields},
+                       content_type='multipart/form-data')
+
+def list_delta(app):
+    with app.app_context():
+        payload = latest_job('schedule_blast').payload
+        return {key: payload.get(key) for key in
+                ('list_added', 'list_changed', 'list_unchanged', 'list_removed', 'duplicates', 'associated')}
+
+VERSION_1 = [f'+1555000{i:04d},Name{i},NYC' for i in range(10)]
+
+def test_list_upload_writes_only_the_delta(app, client, run_jobs):
+    post_blast(client, csv_file=csv_file(VERSION_1), list_name='weekly')
+    run_jobs()
+    assert list_delta(app) == {'list_added': 10, 'list_changed': 0, 'list_unchanged': 0, 'list_removed': 0,
+                               'duplicates': 0, 'associated': 10}
+    with app.app_context():
+        list_id = RecipientList.query.one().id
+
+    # Two rows dropped, one edited, one added and one repeated
+    version_2 = VERSION_1[2:] + ['+15559990000,New,LA', VERSION_1[-1]]
+    version_2[0] = version_2[0].replace('NYC', 'Boston')
+    post_blast(client, csv_file=csv_file(version_2), recipient_list_id=str(list_id))
+    run_jobs()
+    assert list_delta(app) == {'list_added': 1, 'list_changed': 1, 'list_unchanged': 7, 'list_removed': 2,
+                               'duplicates': 1, 'associated': 9}
+    with app.app_context():
+        assert db.session.get(RecipientList, list_id).member_count == 9
+        assert RecipientListMember.query.filter_by(recipient_list_id=list_id).count() == 9
+
+def test_saved_list_blast_skips_suppressed_members(app, client, run_jobs, fake_twilio_messages):
+    post_blast(client, csv_file=csv_file(VERSION_1[:3]), list_name='weekly')
+    run_jobs()
+    with app.app_context():
+        list_id = RecipientList.query.one().id
+        db.session.add(Suppression(phone_number=VERSION_1[0].split(',')[0], reason='opt_out'))
+        db.session.commit()
+    fake_twilio_messages.clear()
+
+    post_blast(client, recipient_list_id=str(list_id))
+    run_jobs()
+    with app.app_context():
+        payload = latest_job('schedule_blast').payload
+        assert (payload['associated'], payload['suppressed']) == (2, 1)
+    assert sorted(message['body'] for message in fake_twilio_messages.values()) == ['Hi Name1 NYC', 'Hi Name2 NYC']
+
+def test_list_blast_renders_the_lists_own_rows(app, client, run_jobs, fake_twilio_messages):
+    post_blast(client, csv_file=csv_file(['+15550000001,Ann,NYC']), list_name='weekly')
+    run_jobs()
+    # An ad-hoc upload of the same number rewrites the shared recipient row
+    post_blast(client, csv_file=csv_file(['+15550000001,Annie,Boston']))
+    run_jobs()
+    with app.app_context():
+        list_id = RecipientList.query.one().id
+    fake_twilio_messages.clear()
+
+    post_blast(client, recipient_list_id=str(list_id))
+    run_jobs()
+    assert [message['body'] for message in fake_twilio_messages.values()] == ['Hi Ann NYC']
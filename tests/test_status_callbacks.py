@@ -0,0 +1,75 @@
+import pytest
+from twilio.request_validator import RequestValidator
+import status_callbacks
+from status_callbacks import apply_status_updates, status_buffer
+from models import ScheduledBlast, ScheduledMessage, Suppression, db
+
+CALLBACK_URL = 'http://localhost/twilio/status_callback'
+
+@pytest.fixture
+def blast_id(ctx, make_blast):
+    blast = make_blast(['+15550000001', '+15550000002', '+15550000003'], status='scheduled')
+    for index, association in enumerate(blast.recipient_associations):
+        db.session.add(ScheduledMessage(scheduled_blast_id=blast.id, recipient_id=association.recipient_id,
+                                        twilio_sid=f'SM{index}', status='scheduled'))
+    blast.scheduled_count = 3
+    db.session.commit()
+    return blast.id
+
+def apply(batch):
+    apply_status_updates(batch)
+    db.session.commit()
+
+def counts(blast_id):
+    blast = db.session.get(ScheduledBlast, blast_id, populate_existing=True)
+    return blast.status, blast.scheduled_count, blast.sent_count, blast.delivered_count, blast.failed_count
+
+def test_rollups_follow_each_transition(blast_id):
+    apply({'SM0': ('sent', None), 'SM1': ('sent', None)})
+    assert counts(blast_id) == ('sent', 1, 2, 0, 0)
+    apply({'SM0': ('delivered', None), 'SM1': ('undelivered', 30003), 'SM2': ('failed', 30003)})
+    assert counts(blast_id) == ('sent', 0, 2, 1, 2)
+
+def test_repeated_callback_is_counted_once(blast_id):
+    apply({'SM0': ('delivered', None)})
+    apply({'SM0': ('delivered', None)})
+    assert counts(blast_id) == ('sent', 2, 1, 1, 0)
+
+def test_late_callback_never_moves_a_message_back(blast_id):
+    apply({'SM0': ('delivered', None)})
+    apply({'SM0': ('sent', None)})
+    assert db.session.get(ScheduledMessage, 1).status == 'delivered'
+    assert counts(blast_id) == ('sent', 2, 1, 1, 0)
+
+def test_opt_out_failure_suppresses_the_number(blast_id):
+    apply({'SM1': ('failed', 21610), 'SM2': ('failed', 30003)})
+    assert [(row.phone_number, row.reason) for row in Suppression.query] == [('+15550000002', 'opt_out')]
+
+def post_callback(app, form, token='test-token'):
+    signature = RequestValidator(token).compute_signature(CALLBACK_URL, form)
+    return app.test_client().post('/twilio/status_callback', data=form, headers={'X-Twilio-Signature': signature})
+
+def test_signed_callback_is_applied(app, blast_id):
+    assert post_callback(app, {'MessageSid': 'SM0', 'MessageStatus': 'delivered'}).status_code == 204
+    status_buffer.flush()
+    assert counts(blast_id) == ('sent', 2, 1, 1, 0)
+
+def test_forged_signature_is_rejected(app, blast_id):
+    response = post_callback(app, {'MessageSid': 'SM0', 'MessageStatus': 'delivered'}, token='guessed')
+    assert response.status_code == 403
+
+def test_callbacks_are_rejected_without_an_auth_token(app, blast_id, monkeypatch):
+    monkeypatch.setattr(status_callbacks, 'TWILIO_AUTH_TOKEN', None)
+    # Signed with the empty key an unset token used to fall back to
+    assert post_callback(app, {'MessageSid': 'SM0', 'MessageStatus': 'delivered'}, token='').status_code == 403
+    status_buffer.flush()
+    assert counts(blast_id) == ('scheduled', 3, 0, 0, 0)
+
+def test_opt_out_callback_is_stored_before_it_is_acknowledged(app, blast_id):
+    response = post_callback(app, {'MessageSid': 'SM1', 'MessageStatus': 'failed', 'ErrorCode': '21610'})
+    assert response.status_code == 204
+    # Nothing flushed yet: only the suppression is already written
+    assert [(row.phone_number, row.reason) for row in Suppression.query] == [('+15550000002', 'opt_out')]
+    assert counts(blast_id) == ('scheduled', 3, 0, 0, 0)
+    status_buffer.flush()
+    assert counts(blast_id) == ('scheduled', 2, 0, 0, 1)
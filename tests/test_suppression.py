@@ -0,0 +1,47 @@
+from array import array
+from suppression import SuppressionIndex, get_suppression_index, add_suppressions, remove_opt_out, phone_key, opt_out_action
+from models import Suppression, db
+
+def test_phone_key():
+    assert phone_key('+15550000001') == 15550000001
+    assert phone_key('not-a-number') is None
+    assert phone_key(None) is None
+
+def test_index_has_no_false_positives():
+    numbers = [f'+1555{i:07d}' for i in range(0, 20000, 2)]
+    index = SuppressionIndex(array('q', sorted(phone_key(number) for number in numbers)))
+    assert len(index) == 10000
+    assert all(number in index for number in numbers)
+    assert not any(f'+1555{i:07d}' in index for i in range(1, 20000, 2))
+    assert 'garbage' not in index
+
+def test_index_takes_numbers_added_after_it_was_built():
+    index = SuppressionIndex(array('q', [15550000001]))
+    index.add('+15550000009')
+    index.add('+15550000001')
+    assert '+15550000009' in index
+    assert (len(index), index.pending) == (2, 1)
+
+def test_cache_follows_inserts_and_deletes(ctx):
+    add_suppressions([('+15550000001', 'opt_out', 21610), ('+15550000002', 'hard_bounce', 30005)])
+    db.session.commit()
+    index = get_suppression_index()
+    assert '+15550000001' in index and '+15550000002' in index
+
+    add_suppressions([('+15550000003', 'opt_out', None), ('+15550000001', 'opt_out', None)])
+    db.session.commit()
+    assert get_suppression_index() is index
+    assert '+15550000003' in index and Suppression.query.count() == 3
+
+    # Only opt-outs can be undone; removing one means rebuilding the index
+    remove_opt_out('+15550000001')
+    remove_opt_out('+15550000002')
+    db.session.commit()
+    index = get_suppression_index()
+    assert '+15550000001' not in index and '+15550000002' in index
+
+def test_opt_out_keywords():
+    assert opt_out_action(' stop ') == 'opt_out'
+    assert opt_out_action('start') == 'opt_in'
+    assert opt_out_action('Stop sending me these please') is None
+    assert opt_out_action('hello', opt_out_type='STOP') == 'opt_out'
@@ -0,0 +1,20 @@
+from twilio_dispatch import run_rate_limited, CancelResult
+
+def cancel(sid, limiter):
+    limiter.acquire()
+    return CancelResult(sid, status='canceled' if sid % 3 else None, error=None if sid % 3 else 'not found')
+
+def test_results_come_back_in_order():
+    seen = []
+    report = run_rate_limited(cancel, range(1, 11), concurrency=4, rate=1000, on_result=seen.append)
+    assert [result.sid for result in seen] == [result.sid for result in report.results] == list(range(1, 11))
+    assert report.summary()['succeeded'] == 7
+
+def test_report_keeps_only_failures_when_results_are_consumed():
+    seen = []
+    report = run_rate_limited(cancel, range(1, 101), concurrency=4, rate=1000, on_result=seen.append,
+                              keep_results=False)
+    assert len(seen) == 100
+    assert [result.sid for result in report.results] == list(range(3, 101, 3))
+    summary = report.summary()
+    assert (summary['total'], summary['succeeded'], summary['failed']) == (100, 67, 33)
@@ -0,0 +1,20 @@
+import pytest
+from twilio_http import HttpxTransport, http2_available
+
+pytestmark = pytest.mark.skipif(not http2_available(), reason='httpx[http2] is not installed')
+
+def test_httpx_pool_stats():
+    transport = HttpxTransport(pool_size=2, keepalive=True, keepalive_expiry=5)
+    try:
+        assert transport.pool_stats() == {'connections_open': 0, 'connections_idle': 0}
+    finally:
+        transport.close()
+
+def test_httpx_pool_stats_without_the_pool_internals(monkeypatch):
+    transport = HttpxTransport(pool_size=2, keepalive=True, keepalive_expiry=5)
+    try:
+        monkeypatch.setattr(transport.client, '_transport', object())
+        assert transport.pool_stats() == {'connections_open': None, 'connections_idle': None}
+    finally:
+        monkeypatch.undo()
+        transport.close()
@@ -0,0 +1,26 @@
+import io
+import pytest
+from csv_stream import stream_digest
+from uploads import store_upload, open_upload, upload_digest, delete_upload
+from models import UploadPart, db
+
+def test_upload_reads_back_across_parts(ctx):
+    content = b'phone_number,name\n' + b''.join(f'+1212555{i:04d},Name {i}\n'.encode() for i in range(50))
+    upload_id = store_upload(io.BytesIO(content), part_size=7)
+    db.session.commit()
+
+    assert UploadPart.query.filter_by(upload_id=upload_id).count() == -(-len(content) // 7)
+    with open_upload(upload_id) as f:
+        assert f.read() == content
+    assert upload_digest(upload_id) == stream_digest(io.BytesIO(content))
+
+def test_empty_upload_is_not_missing(ctx):
+    upload_id = store_upload(io.BytesIO(b''))
+    with open_upload(upload_id) as f:
+        assert f.read() == b''
+
+def test_deleted_upload_is_missing(ctx):
+    upload_id = store_upload(io.BytesIO(b'phone_number\n'))
+    delete_upload(upload_id)
+    with pytest.raises(FileNotFoundError):
+        open_upload(upload_id)
@@ -0,0 +1,215 @@
+import threading
+from collections import deque
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from twilio_retry import AdaptiveRateLimiter, call_with_retry
+from metrics import Counter, LogSampler
+
+logger = logging.getLogger(__name__)
+
+TWILIO_MESSAGES = Counter('twilio_messages_total', 'Message create calls by outcome.', ['outcome'])
+TWILIO_CANCELLATIONS = Counter('twilio_cancellations_total', 'Message cancel calls by outcome.', ['outcome'])
+
+send_error_sample = LogSampler()
+cancel_error_sample = LogSampler()
+
+def log_sampled(sample, message):
+    # One line per recipient is too much at blast scale; the rest stay at debug
+    if sample():
+        logger.warning(f"{message} (logging 1 in {sample.every})")
+    else:
+        logger.debug(message)
+
+class DispatchResult:
+    def __init__(self, key, params, sid=None, status=None, error=None, error_code=None,
+                 elapsed=0.0, attempts=1, permanent=False):
+        self.key = key
+        self.params = params
+        self.to = params['to']
+        self.sid = sid
+        self.status = status
+        self.error = error
+        self.error_code = error_code
+        self.elapsed = elapsed
+        self.attempts = attempts
+        self.permanent = permanent
+
+    @property
+    def ok(self):
+        return self.sid is not None
+
+class CancelResult:
+    def __init__(self, sid, status=None, error=None, error_code=None, elapsed=0.0, attempts=1):
+        self.sid = sid
+        self.status = status
+        self.error = error
+        self.error_code = error_code
+        self.elapsed = elapsed
+        self.attempts = attempts
+
+    @property
+    def ok(self):
+        return self.status == 'canceled'
+
+class DispatchReport:
+    """`results` holds every result, or only the failures for a run that
+    didn't keep them; `total` and `succeeded_count` always cover every item."""
+
+    def __init__(self, results, elapsed, limiter_stats=None, transport_stats=None, total=None, succeeded_count=None):
+        self.results = results
+        self.total = len(results) if total is None else total
+        self.succeeded_count = len(self.succeeded) if succeeded_count is None else succeeded_count
+        self.elapsed = elapsed
+        self.limiter_stats = limiter_stats or {}
+        self.transport_stats = transport_stats
+
+    @property
+    def succeeded(self):
+        return [r for r in self.results if r.ok]
+
+    @property
+    def failed(self):
+        return [r for r in self.results if not r.ok]
+
+    @property
+    def throughput(self):
+        return self.total / self.elapsed if self.elapsed > 0 else 0.0
+
+    def summary(self):
+        return {
+            'total': self.total,
+            'succeeded': self.succeeded_count,
+            'failed': self.total - self.succeeded_count,
+            'elapsed_seconds': round(self.elapsed, 3),
+            'requests_per_second': round(self.throughput, 2),
+            **self.limiter_stats,
+            **({'http_pool': self.transport_stats} if self.transport_stats else {}),
+        }
+
+def _send_one(client, limiter, key, params):
+    started = time.monotonic()
+    # A create is a POST: sent again after a timeout or a 5xx it can deliver the message twice
+    outcome = call_with_retry(lambda: client.messages.create(**params), limiter, idempotent=False)
+    elapsed = time.monotonic() - started
+    if outcome.error is None:
+        message = outcome.value
+        TWILIO_MESSAGES.inc(outcome='created')
+        return DispatchResult(key, params, sid=message.sid, status=message.status,
+                              elapsed=elapsed, attempts=outcome.attempts)
+    e = outcome.error
+    if outcome.ambiguous:
+        # Dead-lettered as permanent, so a replay only resends it when asked to include those
+        TWILIO_MESSAGES.inc(outcome='unknown')
+        log_sampled(send_error_sample, f"Twilio send outcome unknown to={params['to']}: {str(e)}")
+        return DispatchResult(key, params, error=f"Outcome unknown, not resent in case Twilio accepted it: {str(e)}",
+                              error_code=getattr(e, 'code', None), elapsed=elapsed, attempts=outcome.attempts,
+                              permanent=True)
+    TWILIO_MESSAGES.inc(outcome='failed')
+    log_sampled(send_error_sample, f"Twilio send failed to={params['to']} code={getattr(e, 'code', None)} "
+                                   f"attempts={outcome.attempts}: {str(e)}")
+    return DispatchResult(key, params, error=str(e), error_code=getattr(e, 'code', None),
+                          elapsed=elapsed, attempts=outcome.attempts, permanent=outcome.permanent)
+
+def _cancel_one(client, limiter, sid):
+    started = time.monotonic()
+    outcome = call_with_retry(lambda: client.messages(sid).update(status="canceled"), limiter)
+    elapsed = time.monotonic() - started
+    if outcome.error is None:
+        message = outcome.value
+        if message.status == "canceled":
+            TWILIO_CANCELLATIONS.inc(outcome='canceled')
+        else:
+            TWILIO_CANCELLATIONS.inc(outcome='not_cancelable')
+            log_sampled(cancel_error_sample, f"Twilio cancel skipped sid={sid} status={message.status}")
+        return CancelResult(sid, status=message.status, elapsed=elapsed, attempts=outcome.attempts)
+    e = outcome.error
+    TWILIO_CANCELLATIONS.inc(outcome='failed')
+    log_sampled(cancel_error_sample, f"Twilio cancel failed sid={sid} code={getattr(e, 'code', None)}: {str(e)}")
+    return CancelResult(sid, error=str(e), error_code=getattr(e, 'code', None),
+                        elapsed=elapsed, attempts=outcome.attempts)
+
+def run_rate_limited(task, items, concurrency=16, rate=10, on_result=None, on_progress=None, progress_interval=1.0,
+                     limiter=None, keep_results=True, on_abandoned=None):
+    """Run `task(item, limiter)` for every item on a bounded thread pool.
+
+    At most `concurrency` tasks are in flight. Tasks call `limiter.acquire()` before
+    each request; the limiter starts at `rate` per second and backs off on 429s.
+    Pass a `limiter` to share one (and its backoff) across calls.
+    Results come back in item order. `on_result(result)` is called for each result
+    as soon as it and every earlier item have finished, and `on_progress(completed)`
+    at most every `progress_interval` seconds and once at the end; both run on the
+    calling thread, so they may use the database session. Callers that consume
+    results through `on_result` pass `keep_results=False`, and the report then
+    holds only the failures, so a 500k-message run doesn't keep every result.
+    If a callback raises, queued tasks are canceled, the ones already running
+    finish, and their results go to `on_abandoned(results)` before the error
+    is re-raised: a send that reached Twilio is never silently dropped.
+    """
+    limiter = limiter or AdaptiveRateLimiter(rate)
+    in_flight = threading.BoundedSemaphore(concurrency * 2)
+    pending = deque()
+    results = []
+    completed = 0
+    succeeded = 0
+    started = time.monotonic()
+    last_progress = started
+
+    def report_progress(force=False):
+        nonlocal last_progress
+        now = time.monotonic()
+        if on_progress is not None and (force or now - last_progress >= progress_interval):
+            last_progress = now
+            on_progress(completed)
+
+    def drain(block=False):
+        nonlocal completed, succeeded
+        while pending and (block or pending[0].done()):
+            result = pending.popleft().result()
+            completed += 1
+            succeeded += result.ok
+            if keep_results or not result.ok:
+                results.append(result)
+            if on_result is not None:
+                on_result(result)
+        report_progress()
+
+    pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='twilio-dispatch')
+    try:
+        for item in items:
+            # Bound queued work so large blasts are not materialized all at once
+            in_flight.acquire()
+            future = pool.submit(task, item, limiter)
+            future.add_done_callback(lambda _: in_flight.release())
+            pending.append(future)
+            drain()
+        drain(block=True)
+    except BaseException:
+        pool.shutdown(wait=True, cancel_futures=True)
+        finished = [future.result() for future in pending
+                    if not future.cancelled() and future.exception() is None]
+        if finished and on_abandoned is not None:
+            on_abandoned(finished)
+        raise
+    finally:
+        pool.shutdown(wait=True)
+
+    report_progress(force=True)
+    return DispatchReport(results, time.monotonic() - started, limiter.stats(),
+                          total=completed, succeeded_count=succeeded)
+
+def _with_transport_stats(client, report):
+    stats = getattr(client.http_client, 'stats', None)
+    if stats is not None:
+        report.transport_stats = stats()
+    return report
+
+def dispatch_messages(client, jobs, **kwargs):
+    """Create a message for each `(key, message_params)` job; see `run_rate_limited`."""
+    report = run_rate_limited(lambda job, limiter: _send_one(client, limiter, *job), jobs, **kwargs)
+    return _with_transport_stats(client, report)
+
+def cancel_messages(client, sids, **kwargs):
+    """Cancel each scheduled message SID; see `run_rate_limited`."""
+    report = run_rate_limited(lambda sid, limiter: _cancel_one(client, limiter, sid), sids, **kwargs)
+    return _with_transport_stats(client, report)
@@ -0,0 +1,215 @@
+"""Pooled, per-process HTTP transport for the Twilio client.
+
+The transport is built lazily on first use and rebuilt when the process id
+changes, so a client created before gunicorn forks never shares sockets
+between workers. HTTP/1.1 goes through a requests Session; with
+TWILIO_HTTP2=1 and httpx[http2] installed, an httpx client is used instead.
+Neither, nor the Twilio SDK, is imported until the first request.
+"""
+import os
+import re
+import time
+import threading
+import logging
+from metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+TWILIO_REQUEST_SECONDS = Histogram('twilio_request_seconds', 'Twilio API request latency by HTTP status.',
+                                   ['method', 'status'])
+
+# Defaults to the larger of the dispatch and cancel concurrency
+TWILIO_HTTP_POOL_SIZE = int(os.environ.get("TWILIO_HTTP_POOL_SIZE", "0")) or None
+TWILIO_HTTP_CONNECT_TIMEOUT = float(os.environ.get("TWILIO_HTTP_CONNECT_TIMEOUT", "5"))
+TWILIO_HTTP_READ_TIMEOUT = float(os.environ.get("TWILIO_HTTP_READ_TIMEOUT", "30"))
+TWILIO_HTTP_KEEPALIVE = os.environ.get("TWILIO_HTTP_KEEPALIVE", "1") == "1"
+TWILIO_HTTP_KEEPALIVE_EXPIRY = float(os.environ.get("TWILIO_HTTP_KEEPALIVE_EXPIRY", "60"))
+TWILIO_HTTP2 = os.environ.get("TWILIO_HTTP2", "0") == "1"
+
+class RequestsTransport:
+    def __init__(self, pool_size, keepalive):
+        import requests
+        from requests.adapters import HTTPAdapter
+        self.session = requests.Session()
+        # pool_block makes extra threads wait for a free connection instead of
+        # opening one that is thrown away afterwards
+        self.adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, pool_block=True)
+        self.session.mount('https://', self.adapter)
+        self.session.mount('http://', self.adapter)
+        if not keepalive:
+            self.session.headers['Connection'] = 'close'
+
+    def send(self, method, url, params, data, json, headers, auth, timeout, allow_redirects):
+        response = self.session.request(method, url, params=params, data=data, json=json, headers=headers,
+                                        auth=auth, timeout=timeout, allow_redirects=allow_redirects)
+        return response.status_code, response.text, response.headers
+
+    def pool_stats(self):
+        opened = idle = 0
+        pools = self.adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            opened += pool.num_connections
+            idle += sum(1 for conn in list(pool.pool.queue) if conn is not None)
+        return {'connections_opened': opened, 'connections_idle': idle}
+
+    def close(self):
+        self.session.close()
+
+class HttpxTransport:
+    def __init__(self, pool_size, keepalive, keepalive_expiry):
+        import httpx
+        limits = httpx.Limits(max_connections=pool_size,
+                              max_keepalive_connections=pool_size if keepalive else 0,
+                              keepalive_expiry=keepalive_expiry)
+        self.client = httpx.Client(http2=True, limits=limits)
+
+    def send(self, method, url, params, data, json, headers, auth, timeout, allow_redirects):
+        import httpx
+        import requests
+        from urllib3.exceptions import NewConnectionError
+        try:
+            response = self.client.request(method, url, params=params, data=data, json=json, headers=headers,
+                                           auth=auth, timeout=httpx.Timeout(timeout[1], connect=timeout[0]),
+                                           follow_redirects=allow_redirects)
+        # Surface transport failures as the requests errors twilio_retry tells apart
+        except httpx.ConnectTimeout as e:
+            raise requests.exceptions.ConnectTimeout(str(e)) from e
+        except httpx.ConnectError as e:
+            raise requests.exceptions.ConnectionError(NewConnectionError(None, str(e))) from e
+        except httpx.TimeoutException as e:
+            raise requests.exceptions.Timeout(str(e)) from e
+        except httpx.TransportError as e:
+            raise requests.exceptions.ConnectionError(str(e)) from e
+        return response.status_code, response.text, response.headers
+
+    def pool_stats(self):
+        # httpx has no public view of its pool; if an upgrade moves these
+        # internals the counts are reported as unknown rather than failing
+        pool = getattr(getattr(self.client, '_transport', None), '_pool', None)
+        connections = getattr(pool, 'connections', None)
+        try:
+            return {
+                'connections_open': len(connections),
+                'connections_idle': sum(1 for conn in connections if conn.is_idle()),
+            }
+        except (TypeError, AttributeError):
+            return {'connections_open': None, 'connections_idle': None}
+
+    def close(self):
+        self.client.close()
+
+def http2_available():
+    try:
+        import httpx, h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+class PooledHttpClient:
+    """Thread-safe Twilio HttpClient backed by one connection pool per process.
+
+    It provides the `request` and `is_async` the SDK calls rather than
+    subclassing twilio.http.HttpClient, whose import pulls in requests.
+    `base_url`, when given, replaces the scheme and host of every request so the
+    client can talk to a local stand-in such as fake_twilio.py.
+    """
+
+    def __init__(self, pool_size=16, connect_timeout=TWILIO_HTTP_CONNECT_TIMEOUT,
+                 read_timeout=TWILIO_HTTP_READ_TIMEOUT, keepalive=TWILIO_HTTP_KEEPALIVE,
+                 keepalive_expiry=TWILIO_HTTP_KEEPALIVE_EXPIRY, http2=TWILIO_HTTP2, base_url=None):
+        if read_timeout is not None and read_timeout <= 0:
+            raise ValueError(read_timeout)
+        self.logger = logging.getLogger('twilio.http_client')
+        self.is_async = False
+        self.timeout = read_timeout
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.keepalive = keepalive
+        self.keepalive_expiry = keepalive_expiry
+        self.http2 = http2
+        if http2 and not http2_available():
+            logger.warning("TWILIO_HTTP2 is set but httpx[http2] is not installed; using HTTP/1.1")
+            self.http2 = False
+        self.base_url = base_url.rstrip('/') if base_url else None
+        self._transport = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._reset_counters()
+
+    def _reset_counters(self):
+        self.requests = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.request_seconds = 0.0
+
+    def transport(self):
+        # Rebuilt after fork so each worker process gets its own sockets
+        if self._transport is None or self._pid != os.getpid():
+            with self._lock:
+                if self._transport is None or self._pid != os.getpid():
+                    self._pid = os.getpid()
+                    self._reset_counters()
+                    if self.http2:
+                        self._transport = HttpxTransport(self.pool_size, self.keepalive, self.keepalive_expiry)
+                    else:
+                        self._transport = RequestsTransport(self.pool_size, self.keepalive)
+        return self._transport
+
+    def request(self, method, url, params=None, data=None, headers=None, auth=None,
+                timeout=None, allow_redirects=False):
+        if timeout is not None and timeout <= 0:
+            raise ValueError(timeout)
+        timeout = (self.connect_timeout, timeout or self.timeout)
+        if self.base_url:
+            url = re.sub(r'^https://[^/]+', self.base_url, url)
+
+        json = None
+        if headers and headers.get('Content-Type') in ('application/json', 'application/scim+json'):
+            data, json = None, data
+
+        transport = self.transport()
+        with self._lock:
+            self.requests += 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        started = time.monotonic()
+        status = 'error'
+        try:
+            status_code, text, response_headers = transport.send(method.upper(), url, params, data, json,
+                                                                 headers, auth, timeout, allow_redirects)
+            status = status_code
+        except Exception:
+            with self._lock:
+                self.errors += 1
+            raise
+        finally:
+            elapsed = time.monotonic() - started
+            with self._lock:
+                self.in_flight -= 1
+                self.request_seconds += elapsed
+            TWILIO_REQUEST_SECONDS.observe(elapsed, method=method.upper(), status=status)
+
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(f"{method.upper()} {url} -> {status_code}")
+        from twilio.http.response import Response
+        return Response(int(status_code), text, response_headers)
+
+    def stats(self):
+        with self._lock:
+            stats = {
+                'protocol': 'http2' if self.http2 else 'http1.1',
+                'pool_size': self.pool_size,
+                'requests': self.requests,
+                'errors': self.errors,
+                'in_flight': self.in_flight,
+                'peak_in_flight': self.peak_in_flight,
+                'avg_request_ms': round(self.request_seconds / self.requests * 1000, 2) if self.requests else None,
+            }
+        transport = self._transport
+        if transport is not None and self._pid == os.getpid():
+            stats.update(transport.pool_stats())
+        return stats
@@ -1,13 +1,27 @@
 import os
-import json
-from twilio.rest import Client
-from twilio.base.exceptions import TwilioException, TwilioRestException
+import threading
+import pytz
+from twilio_dispatch import dispatch_messages, cancel_messages
+from twilio_retry import AdaptiveRateLimiter
+from twilio_http import PooledHttpClient, TWILIO_HTTP_POOL_SIZE
+from message_templates import compile_template
+from scheduled_messages import iter_blast_recipient_pages, message_sids, CANCELABLE_MESSAGE_STATUSES
+from phone_timezones import recipient_timezone
+from metrics import REGISTRY
 import re
 import logging
 
 TWILIO_ACCOUNT_SID = os.environ.get("TWILIO_ACCOUNT_SID")
 TWILIO_AUTH_TOKEN = os.environ.get("TWILIO_AUTH_TOKEN")
 TWILIO_MESSAGING_SERVICE_SID = os.environ.get("TWILIO_MESSAGING_SERVICE_SID")
+# Public URL of /twilio/status_callback; delivery tracking is off when unset
+TWILIO_STATUS_CALLBACK_URL = os.environ.get("TWILIO_STATUS_CALLBACK_URL")
+# Point the client at a local stand-in (e.g. fake_twilio.py) instead of api.twilio.com
+TWILIO_API_BASE_URL = os.environ.get("TWILIO_API_BASE_URL")
+TWILIO_DISPATCH_CONCURRENCY = int(os.environ.get("TWILIO_DISPATCH_CONCURRENCY", "16"))
+TWILIO_MESSAGING_MPS = float(os.environ.get("TWILIO_MESSAGING_MPS", "10"))
+TWILIO_CANCEL_CONCURRENCY = int(os.environ.get("TWILIO_CANCEL_CONCURRENCY", "16"))
+TWILIO_CANCEL_RATE = float(os.environ.get("TWILIO_CANCEL_RATE", "25"))
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -20,70 +34,138 @@ def is_valid_phone_number(phone_number):
     pattern = r'^\+[1-9]\d{1,14}$'
     return re.match(pattern, phone_number) is not None
 
-try:
-    check_twilio_credentials()
-    client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
-except (ValueError, TwilioException) as e:
-    logger.error(f"Error initializing Twilio client: {str(e)}")
-    client = None
-
-def schedule_twilio_message(scheduled_blast):
-    if client is None:
-        logger.error("Twilio client is not initialized. Cannot schedule messages.")
-        return None
-
-    message_sids = []
-    for association in scheduled_blast.recipient_associations:
-        recipient = association.recipient
-        personalized_message = scheduled_blast.message_template.format(**recipient.custom_fields)
-        
-        if not is_valid_phone_number(recipient.phone_number):
-            logger.warning(f"Invalid phone number format: {recipient.phone_number}")
-            continue
-
-        try:
-            message_params = {
-                'messaging_service_sid': TWILIO_MESSAGING_SERVICE_SID,
-                'body': personalized_message,
-                'schedule_type': "fixed",
-                'send_at': scheduled_blast.scheduled_time.isoformat(),
-                'to': recipient.phone_number
-            }
-            
-            # Add MMS URL if provided
-            if scheduled_blast.mms_url:
-                message_params['media_url'] = [scheduled_blast.mms_url]
-
-            message = client.messages.create(**message_params)
-            message_sids.append(message.sid)
-            logger.info(f"Scheduled message for {recipient.phone_number}: SID {message.sid}")
-        except TwilioRestException as e:
-            logger.error(f"Twilio API error for {recipient.phone_number}: {str(e)}")
-        except Exception as e:
-            logger.error(f"Unexpected error scheduling message for {recipient.phone_number}: {str(e)}")
-
-    return json.dumps(message_sids) if message_sids else None
-
-def cancel_twilio_message(message_sids_json):
-    if client is None:
-        logger.error("Twilio client is not initialized. Cannot cancel messages.")
-        return False
-
-    success = True
-    message_sids = json.loads(message_sids_json)
-    for message_sid in message_sids:
-        try:
-            message = client.messages(message_sid).update(status="canceled")
-            if message.status != "canceled":
-                logger.warning(f"Failed to cancel message {message_sid}: status is {message.status}")
-                success = False
-            else:
-                logger.info(f"Successfully canceled message {message_sid}")
-        except TwilioRestException as e:
-            logger.error(f"Twilio API error canceling message {message_sid}: {str(e)}")
-            success = False
-        except Exception as e:
-            logger.error(f"Unexpected error canceling message {message_sid}: {str(e)}")
-            success = False
-
-    return success
+def build_twilio_client():
+    # twilio.rest is the bulk of the SDK's import time; processes that never send skip it
+    from twilio.rest import Client
+    # Every dispatch thread should be able to hold a connection at once
+    pool_size = TWILIO_HTTP_POOL_SIZE or max(TWILIO_DISPATCH_CONCURRENCY, TWILIO_CANCEL_CONCURRENCY)
+    http_client = PooledHttpClient(pool_size=pool_size, base_url=TWILIO_API_BASE_URL)
+    return Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, http_client=http_client)
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """This process's Twilio client, built on first use. Raises ValueError when
+    credentials are missing, so the job that needed the client fails saying why."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                check_twilio_credentials()
+                _client = build_twilio_client()
+    return _client
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+def get_limiter(name, rate):
+    """This process's rate limiter for `name`, shared by every chunk and job it
+    runs so a backoff after 429s carries over from one to the next."""
+    with _limiters_lock:
+        if name not in _limiters:
+            _limiters[name] = AdaptiveRateLimiter(rate)
+        return _limiters[name]
+
+def send_limiter(workers=1):
+    # The account's MPS is split evenly between the worker processes sending at once
+    limiter = get_limiter('send', TWILIO_MESSAGING_MPS)
+    limiter.set_max_rate(TWILIO_MESSAGING_MPS / max(1, workers))
+    return limiter
+
+def http_pool_stats():
+    # Never builds the client just to report on it
+    if _client is None:
+        return {}
+    return _client.http_client.stats()
+
+def http_pool_metrics():
+    return [(f'twilio_http_pool_{name}', f'Twilio HTTP pool {name.replace("_", " ")}.', value)
+            for name, value in http_pool_stats().items()
+            if isinstance(value, (int, float)) and not isinstance(value, bool)]
+
+REGISTRY.add_collector(http_pool_metrics)
+
+def schedule_twilio_message(scheduled_blast, plan=None, send_now=False, on_result=None, on_progress=None,
+                            pages=None, indexes=None, skip=frozenset(), on_abandoned=None):
+    """Send the blast, or the recipient `pages` of one of its chunks. `indexes`
+    gives each bucket's position in the plan where the pages start; recipients
+    in `skip` keep their place in the plan but are not sent again."""
+    client = get_client()
+    blast_id = scheduled_blast.id
+    template = compile_template(scheduled_blast.message_template)
+    scheduled_time = scheduled_blast.scheduled_time
+    mms_url = scheduled_blast.mms_url
+    timezone_column = scheduled_blast.timezone_column
+    local = plan is not None and plan.local
+
+    # Plain rows paged by keyset rather than ORM objects: callers commit while
+    # dispatch is running, which would expire and reload every instance.
+    def jobs():
+        # Per-bucket message counters; a single bucket (None) unless local
+        counters = dict(indexes or {})
+        for page in (pages if pages is not None else iter_blast_recipient_pages(blast_id)):
+            buckets = [recipient_timezone(row, timezone_column) for row in page] if local else [None] * len(page)
+            for message, bucket in zip(template.render_batch(page), buckets):
+                # Counted before any skip so positions match the chunk split
+                index = counters.get(bucket, 0)
+                counters[bucket] = index + 1
+                if message.recipient_id in skip:
+                    continue
+                phone_number = message.phone_number
+                if not is_valid_phone_number(phone_number):
+                    logger.debug(f"Skipping invalid phone number: {phone_number}")
+                    continue
+
+                message_params = {
+                    'messaging_service_sid': TWILIO_MESSAGING_SERVICE_SID,
+                    'body': message.body,
+                    'to': phone_number
+                }
+                if not send_now:
+                    send_at = plan.send_at(index, bucket) if plan else scheduled_time
+                    message_params['schedule_type'] = "fixed"
+                    # Stored times are naive UTC; Twilio needs the offset spelled out
+                    message_params['send_at'] = pytz.UTC.localize(send_at).isoformat()
+
+                # Add MMS URL if provided
+                if mms_url:
+                    message_params['media_url'] = [mms_url]
+
+                if TWILIO_STATUS_CALLBACK_URL:
+                    message_params['status_callback'] = TWILIO_STATUS_CALLBACK_URL
+
+                yield message.recipient_id, message_params
+
+    report = dispatch_messages(client, jobs(),
+                               concurrency=TWILIO_DISPATCH_CONCURRENCY,
+                               limiter=get_limiter('send', TWILIO_MESSAGING_MPS),
+                               on_result=on_result,
+                               on_progress=on_progress,
+                               keep_results=False,
+                               on_abandoned=on_abandoned)
+    logger.info(f"Dispatch report for ScheduledBlast ID {blast_id}: {report.summary()}")
+    return report
+
+def resend_twilio_messages(jobs, on_result=None, on_progress=None):
+    report = dispatch_messages(get_client(), jobs,
+                               concurrency=TWILIO_DISPATCH_CONCURRENCY,
+                               limiter=get_limiter('send', TWILIO_MESSAGING_MPS),
+                               on_result=on_result,
+                               on_progress=on_progress,
+                               keep_results=False)
+    logger.info(f"Resend report: {report.summary()}")
+    return report
+
+def cancel_twilio_message(scheduled_blast, on_result=None, on_progress=None):
+    # Only messages that are still scheduled, or whose earlier cancel attempt
+    # failed, are sent again; a rerun after a crash resumes where it stopped.
+    sids = message_sids(scheduled_blast.id, statuses=CANCELABLE_MESSAGE_STATUSES)
+    report = cancel_messages(get_client(), sids,
+                             concurrency=TWILIO_CANCEL_CONCURRENCY,
+                             limiter=get_limiter('cancel', TWILIO_CANCEL_RATE),
+                             on_result=on_result,
+                             on_progress=on_progress,
+                             keep_results=False)
+    logger.info(f"Cancel report for ScheduledBlast ID {scheduled_blast.id}: {report.summary()}")
+    return report
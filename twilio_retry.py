@@ -0,0 +1,200 @@
+import os
+import time
+import random
+import threading
+import logging
+from metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+TWILIO_RETRIES = Counter('twilio_retries_total', 'Twilio requests retried, by cause.', ['reason'])
+
+TWILIO_RETRY_MAX_ATTEMPTS = int(os.environ.get("TWILIO_RETRY_MAX_ATTEMPTS", "5"))
+TWILIO_RETRY_BASE_DELAY = float(os.environ.get("TWILIO_RETRY_BASE_DELAY", "0.5"))
+TWILIO_RETRY_MAX_DELAY = float(os.environ.get("TWILIO_RETRY_MAX_DELAY", "30"))
+TWILIO_MIN_RATE = float(os.environ.get("TWILIO_MIN_RATE", "1"))
+
+class TokenBucket:
+    """Thread-safe token bucket; `rate` tokens per second, bursting up to `capacity`."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1, rate))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def set_rate(self, rate):
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = float(rate)
+            # Shrink the burst along with the rate so a slowdown takes effect at once
+            self.capacity = max(1.0, self.rate)
+            self._tokens = min(self._tokens, self.capacity)
+
+    def acquire(self, tokens=1):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+class AdaptiveRateLimiter:
+    """Token bucket whose rate follows AIMD: halve on 429, creep back up on success.
+
+    The rate never exceeds the configured `max_rate` (the account's MPS) and never
+    falls below `min_rate`. Decreases are limited to one per `cooldown` seconds so a
+    burst of 429s from requests that were already in flight counts as one signal.
+    """
+
+    def __init__(self, max_rate, min_rate=TWILIO_MIN_RATE, increase=None, decrease=0.5, cooldown=1.0):
+        self.max_rate = float(max_rate)
+        self._floor = float(min_rate)
+        self.min_rate = min(self._floor, self.max_rate)
+        # Default additive step: regain 5% of the ceiling per second of clean sends
+        self._increase = increase
+        self.increase = increase if increase is not None else max(1.0, self.max_rate * 0.05)
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.bucket = TokenBucket(self.max_rate)
+        self.throttled = 0
+        self.retries = 0
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def rate(self):
+        return self.bucket.rate
+
+    def acquire(self):
+        self.bucket.acquire()
+
+    def set_max_rate(self, max_rate):
+        # Moves the ceiling without forgetting a backoff already under way
+        with self._lock:
+            if float(max_rate) == self.max_rate:
+                return
+            self.max_rate = float(max_rate)
+            self.min_rate = min(self._floor, self.max_rate)
+            if self._increase is None:
+                self.increase = max(1.0, self.max_rate * 0.05)
+            if self.bucket.rate > self.max_rate:
+                self.bucket.set_rate(self.max_rate)
+
+    def on_success(self):
+        if self.bucket.rate >= self.max_rate:
+            return
+        with self._lock:
+            # `increase / rate` per success adds roughly `increase` per second
+            rate = self.bucket.rate
+            self.bucket.set_rate(min(self.max_rate, rate + self.increase / rate))
+
+    def on_throttle(self):
+        with self._lock:
+            self.throttled += 1
+            now = time.monotonic()
+            if now - self._last_decrease < self.cooldown:
+                return
+            self._last_decrease = now
+            rate = max(self.min_rate, self.bucket.rate * self.decrease)
+            self.bucket.set_rate(rate)
+        logger.warning(f"Twilio throttled requests; send rate lowered to {rate:.1f}/s")
+
+    def on_retry(self):
+        with self._lock:
+            self.retries += 1
+
+    def stats(self):
+        return {'rate': round(self.rate, 2), 'throttled': self.throttled, 'retries': self.retries}
+
+def error_status(exc):
+    return getattr(exc, 'status', None)
+
+def is_throttle(exc):
+    return error_status(exc) == 429
+
+# requests, urllib3 and the Twilio SDK are imported where an error is inspected,
+# by which point the client that raised it has loaded them anyway
+def is_retryable(exc):
+    from requests.exceptions import ConnectionError as RequestsConnectionError, Timeout
+    from twilio.base.exceptions import TwilioException
+    if isinstance(exc, (RequestsConnectionError, Timeout)):
+        return True
+    if isinstance(exc, TwilioException):
+        status = error_status(exc)
+        return status == 429 or (status is not None and status >= 500)
+    return False
+
+def is_connect_error(exc):
+    # Failed before the request went out, so even a POST is safe to repeat
+    from requests.exceptions import ConnectionError as RequestsConnectionError, ConnectTimeout
+    from urllib3.exceptions import NewConnectionError
+    if isinstance(exc, ConnectTimeout):
+        return True
+    if isinstance(exc, RequestsConnectionError):
+        reason = exc.args[0] if exc.args else None
+        # urllib3 wraps the connect failure in a MaxRetryError
+        return isinstance(getattr(reason, 'reason', reason), NewConnectionError)
+    return False
+
+def is_safe_to_repeat(exc):
+    """Retryable for a request that creates something: only errors that show
+    the request was never acted on. A read timeout, a dropped connection or a
+    5xx may come after Twilio already accepted it."""
+    return is_throttle(exc) or is_connect_error(exc)
+
+def retry_reason(exc):
+    if is_throttle(exc):
+        return 'throttled'
+    from twilio.base.exceptions import TwilioException
+    if isinstance(exc, TwilioException):
+        return 'server_error'
+    return 'connection'
+
+def backoff_delay(attempt, base_delay=TWILIO_RETRY_BASE_DELAY, max_delay=TWILIO_RETRY_MAX_DELAY):
+    # Full jitter keeps retries from a throttled burst from arriving together
+    return random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+
+class RetryOutcome:
+    def __init__(self, value=None, error=None, attempts=0, permanent=False, ambiguous=False):
+        self.value = value
+        self.error = error
+        self.attempts = attempts
+        self.permanent = permanent
+        self.ambiguous = ambiguous
+
+def call_with_retry(func, limiter, max_attempts=TWILIO_RETRY_MAX_ATTEMPTS, idempotent=True):
+    """Call `func()` under `limiter`, retrying 429s, 5xx and connection errors.
+
+    With `idempotent=False` only errors from `is_safe_to_repeat` are retried;
+    any other retryable error stops with `ambiguous` set, since the call may
+    have taken effect. Never raises: the outcome carries either the value or
+    the last error, and `permanent` is True when the error was not worth retrying.
+    """
+    for attempt in range(max_attempts):
+        limiter.acquire()
+        try:
+            value = func()
+        except Exception as e:
+            if is_throttle(e):
+                limiter.on_throttle()
+            if not is_retryable(e):
+                return RetryOutcome(error=e, attempts=attempt + 1, permanent=True)
+            if not idempotent and not is_safe_to_repeat(e):
+                return RetryOutcome(error=e, attempts=attempt + 1, ambiguous=True)
+            if attempt + 1 == max_attempts:
+                return RetryOutcome(error=e, attempts=attempt + 1)
+            limiter.on_retry()
+            TWILIO_RETRIES.inc(reason=retry_reason(e))
+            time.sleep(backoff_delay(attempt))
+            continue
+        limiter.on_success()
+        return RetryOutcome(value=value, attempts=attempt + 1)
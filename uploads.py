@@ -0,0 +1,75 @@
+import io
+import os
+import uuid
+import hashlib
+from sqlalchemy import select, insert, delete
+from models import UploadPart, db
+
+# Uploads are copied into the database in parts of this many bytes, so the
+# worker that ingests one doesn't need the web host's filesystem
+UPLOAD_PART_SIZE = int(os.environ.get("UPLOAD_PART_SIZE", str(1 << 20)))
+
+def store_upload(binary_stream, part_size=UPLOAD_PART_SIZE):
+    """Copy `binary_stream` into upload_part rows and return the new upload's id.
+    The rows are written in the caller's transaction."""
+    upload_id = uuid.uuid4().hex
+    seq = 0
+    while True:
+        data = binary_stream.read(part_size)
+        # An empty upload still gets one part, so open_upload can tell it from a missing one
+        if not data and seq > 0:
+            break
+        db.session.execute(insert(UploadPart).values(upload_id=upload_id, seq=seq, data=data))
+        if not data:
+            break
+        seq += 1
+    return upload_id
+
+def iter_upload_parts(upload_id):
+    # One part is fetched at a time so a large upload is never held in memory whole
+    seq = 0
+    while True:
+        data = db.session.execute(
+            select(UploadPart.data).where(UploadPart.upload_id == upload_id, UploadPart.seq == seq)
+        ).scalar()
+        if data is None:
+            if seq == 0:
+                raise FileNotFoundError(f"Upload {upload_id} does not exist")
+            return
+        yield data
+        seq += 1
+
+class UploadStream(io.RawIOBase):
+    """A read-only binary stream over a stored upload's parts."""
+
+    def __init__(self, upload_id):
+        self._parts = iter_upload_parts(upload_id)
+        self._part = next(self._parts)
+        self._offset = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while self._offset >= len(self._part):
+            self._part = next(self._parts, None)
+            self._offset = 0
+            if self._part is None:
+                self._part = b''
+                return 0
+        size = min(len(buffer), len(self._part) - self._offset)
+        buffer[:size] = self._part[self._offset:self._offset + size]
+        self._offset += size
+        return size
+
+def open_upload(upload_id):
+    return io.BufferedReader(UploadStream(upload_id))
+
+def upload_digest(upload_id):
+    digest = hashlib.sha256()
+    for data in iter_upload_parts(upload_id):
+        digest.update(data)
+    return digest.hexdigest()
+
+def delete_upload(upload_id):
+    db.session.execute(delete(UploadPart).where(UploadPart.upload_id == upload_id))
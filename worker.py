@@ -0,0 +1,39 @@
+import os
+import logging
+import multiprocessing
+from app import create_app, db
+from job_queue import run_worker
+from metrics import start_metrics_server, WORKER_METRICS_PORT
+from twilio_integration import check_twilio_credentials
+import blast_jobs
+
+logger = logging.getLogger(__name__)
+
+# Worker processes started by this command; more can run on other hosts against the same database
+WORKER_PROCESSES = int(os.environ.get("WORKER_PROCESSES", "1"))
+
+def start_worker(app, index=0):
+    if WORKER_METRICS_PORT:
+        # One port per process, counting up from WORKER_METRICS_PORT
+        start_metrics_server(WORKER_METRICS_PORT + index)
+    with app.app_context():
+        # Connections inherited through fork belong to the parent
+        db.engine.dispose(close=False)
+    run_worker(app)
+
+if __name__ == "__main__":
+    try:
+        check_twilio_credentials()
+    except ValueError as e:
+        # The client itself is built on first use; say so now rather than at the first blast
+        logger.error(str(e))
+    app = create_app(web=False)
+    if WORKER_PROCESSES > 1:
+        processes = [multiprocessing.Process(target=start_worker, args=(app, index), name=f'worker-{index}')
+                     for index in range(WORKER_PROCESSES)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+    else:
+        start_worker(app)